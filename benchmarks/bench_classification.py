@@ -0,0 +1,91 @@
+"""
+Benchmark da classificação de documentos fiscais.
+
+Compara o processamento linha a linha original de
+FiscalDocumentAgent.process_documents com o modo vetorizado em lote.
+Os dados são gerados replicando as notas de 202401_NFs.zip com novas
+chaves de acesso.
+
+Uso:
+    python benchmarks/bench_classification.py --copies 200
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import zipfile
+
+import pandas as pd
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+
+from fiscal_agent import DocumentOrganizer, FiscalDocumentAgent
+
+SAMPLE_ZIP = os.path.join(ROOT_DIR, "202401_NFs.zip")
+
+
+def build_dataset(copies: int, workdir: str):
+    """
+    Gera arquivos de cabeçalho e itens com `copies` réplicas da amostra.
+    """
+    with zipfile.ZipFile(SAMPLE_ZIP) as zf:
+        names = zf.namelist()
+        cab_name = next(n for n in names if "cabecalho" in n.lower())
+        itens_name = next(n for n in names if "itens" in n.lower())
+        with zf.open(cab_name) as f:
+            df_cab = pd.read_csv(f)
+        with zf.open(itens_name) as f:
+            df_itens = pd.read_csv(f)
+
+    cab_parts, itens_parts = [], []
+    for i in range(copies):
+        suffix = f"{i:06d}"
+        cab = df_cab.copy()
+        cab["CHAVE DE ACESSO"] = cab["CHAVE DE ACESSO"].astype(str) + suffix
+        itens = df_itens.copy()
+        itens["CHAVE DE ACESSO"] = itens["CHAVE DE ACESSO"].astype(str) + suffix
+        cab_parts.append(cab)
+        itens_parts.append(itens)
+
+    cab_path = os.path.join(workdir, "bench_cabecalho.csv")
+    itens_path = os.path.join(workdir, "bench_itens.csv")
+    pd.concat(cab_parts).to_csv(cab_path, index=False)
+    pd.concat(itens_parts).to_csv(itens_path, index=False)
+    return cab_path, itens_path
+
+
+def run(cab_path: str, itens_path: str, db_path: str, vectorized: bool):
+    agent = FiscalDocumentAgent(cab_path, itens_path)
+    agent.organizer = DocumentOrganizer(db_path)
+    agent.load_data()
+    start = time.perf_counter()
+    count = agent.process_documents(vectorized=vectorized)
+    return count, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--copies", type=int, default=100, help="Número de réplicas da amostra (100 notas cada)")
+    parser.add_argument("--skip-legacy", action="store_true", help="Não executa o modo linha a linha")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        cab_path, itens_path = build_dataset(args.copies, workdir)
+
+        results = {}
+        modes = [("vetorizado", True)] if args.skip_legacy else [("linha a linha", False), ("vetorizado", True)]
+        for label, vectorized in modes:
+            db_path = os.path.join(workdir, f"bench_{int(vectorized)}.db")
+            count, elapsed = run(cab_path, itens_path, db_path, vectorized)
+            results[label] = count / elapsed
+            print(f"{label:>14}: {count} documentos em {elapsed:.3f}s ({count / elapsed:,.0f} docs/s)")
+
+        if len(results) == 2:
+            print(f"Ganho: {results['vetorizado'] / results['linha a linha']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Benchmark da classificação incremental.
+
+Classifica um histórico completo (réplicas de 202401_NFs.zip), acrescenta
+um lote novo de notas e compara a reclassificação completa com
+process_documents(incremental=True), que processa apenas o lote novo.
+
+Uso:
+    python benchmarks/bench_incremental.py --copies 2000 --new-copies 20
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from bench_classification import build_dataset
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+
+from fiscal_agent import FiscalDocumentAgent
+from storage import close_pool
+
+
+def run(cab_path: str, itens_path: str, db_path: str, incremental: bool):
+    agent = FiscalDocumentAgent(cab_path, itens_path, db_path=db_path)
+    agent.load_data()
+    start = time.perf_counter()
+    count = agent.process_documents(incremental=incremental)
+    return count, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--copies", type=int, default=1000, help="Réplicas do histórico (100 notas cada)")
+    parser.add_argument("--new-copies", type=int, default=10, help="Réplicas acrescentadas no lote novo")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        history_dir = os.path.join(workdir, "historico")
+        current_dir = os.path.join(workdir, "atual")
+        os.makedirs(history_dir)
+        os.makedirs(current_dir)
+        history = build_dataset(args.copies, history_dir)
+        # As réplicas têm sufixos sequenciais: o conjunto maior contém o histórico
+        current = build_dataset(args.copies + args.new_copies, current_dir)
+
+        base_db = os.path.join(workdir, "base.db")
+        count, elapsed = run(*history, base_db, incremental=False)
+        print(f"     histórico: {count} documentos em {elapsed:.3f}s")
+        # Fecha as conexões para que o WAL seja consolidado antes da cópia
+        close_pool(base_db)
+
+        for label, incremental in (("completo", False), ("incremental", True)):
+            db_path = os.path.join(workdir, f"{label}.db")
+            shutil.copy(base_db, db_path)
+            count, elapsed = run(*current, db_path, incremental)
+            print(f"{label:>14}: {count} documentos gravados em {elapsed:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
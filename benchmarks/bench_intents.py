@@ -0,0 +1,85 @@
+"""
+Micro-benchmark do roteamento de perguntas por intenção.
+
+Mede a latência de IntentRegistry.match (termos de todas as intenções
+compilados em um autômato de Aho–Corasick) com as intenções padrão dos
+agentes e com centenas de modelos sintéticos adicionais, comparando com a
+busca linear que testa as expressões das intenções uma a uma.
+
+Uso:
+    python benchmarks/bench_intents.py --templates 500
+"""
+
+import argparse
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+
+import csv_query_agent  # noqa: F401  (registra as intenções de consulta)
+import fiscal_agent  # noqa: F401  (registra as intenções de classificação)
+from intents import IntentRegistry, contains, get_intent_registry, method, normalize_question
+
+QUESTIONS = [
+    "Qual é o fornecedor com maior valor total de notas?",
+    "Qual item teve maior volume de compra?",
+    "Qual o valor médio por nota fiscal?",
+    "Quantos documentos são de compra?",
+    "Top 5 fornecedores em SP no mês de março",
+    "Liste os setores encontrados nos documentos.",
+    "Resuma os dados presentes.",
+]
+
+
+def build_registry(templates: int) -> IntentRegistry:
+    """
+    Copia as intenções padrão e acrescenta `templates` modelos sintéticos antes delas.
+    """
+    registry = IntentRegistry()
+    for i in range(templates):
+        registry.register(f"sintetica_{i}", method("_general_analysis"), "consulta",
+                          terms=(f"indicador {i} ",), pattern=contains(r"(?P<ano>\d{4})"), priority=150)
+    for intent in get_intent_registry().intents():
+        registry.register(intent.name, intent.handler, intent.target, terms=intent.terms,
+                          pattern=intent.pattern, priority=intent.priority,
+                          converters=intent.converters, context=intent.context)
+    return registry
+
+
+def linear_match(patterns, question):
+    text = normalize_question(question)
+    for intent, pattern in patterns:
+        if pattern.match(text):
+            return intent
+    return None
+
+
+def measure(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for question in QUESTIONS:
+            fn(question)
+    return (time.perf_counter() - start) / (repeat * len(QUESTIONS)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--templates", type=int, default=500, help="Modelos sintéticos adicionais")
+    parser.add_argument("--repeat", type=int, default=2000, help="Repetições de cada pergunta")
+    args = parser.parse_args()
+
+    for templates in (0, args.templates):
+        registry = build_registry(templates)
+        registry.match(QUESTIONS[0])  # compila fora da medição
+        patterns = [(intent, intent.regex) for intent in registry.intents()]
+
+        compiled_us = measure(registry.match, args.repeat)
+        linear_us = measure(lambda q: linear_match(patterns, q), args.repeat)
+        print(f"{len(patterns):>5} intenções: registro compilado {compiled_us:7.1f} µs/pergunta, "
+              f"busca linear {linear_us:7.1f} µs/pergunta")
+
+
+if __name__ == "__main__":
+    main()
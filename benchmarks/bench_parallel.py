@@ -0,0 +1,54 @@
+"""
+Benchmark da classificação paralela em pool de processos.
+
+Mede FiscalDocumentAgent.process_documents com 1 a N processos sobre os
+mesmos dados (réplicas de 202401_NFs.zip) e informa o ganho em relação
+ao modo vetorizado de um único processo.
+
+Uso:
+    python benchmarks/bench_parallel.py --copies 2000 --max-workers 4
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from bench_classification import build_dataset
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+
+from fiscal_agent import DocumentOrganizer, FiscalDocumentAgent
+
+
+def run(cab_path: str, itens_path: str, db_path: str, workers: int):
+    agent = FiscalDocumentAgent(cab_path, itens_path)
+    agent.organizer = DocumentOrganizer(db_path)
+    agent.load_data()
+    start = time.perf_counter()
+    count = agent.process_documents(workers=workers)
+    return count, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--copies", type=int, default=1000, help="Número de réplicas da amostra (100 notas cada)")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1, help="Maior número de processos testado")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        cab_path, itens_path = build_dataset(args.copies, workdir)
+
+        baseline = None
+        for workers in range(1, args.max_workers + 1):
+            db_path = os.path.join(workdir, f"bench_{workers}.db")
+            count, elapsed = run(cab_path, itens_path, db_path, workers)
+            baseline = baseline or elapsed
+            print(f"{workers:>2} processo(s): {count} documentos em {elapsed:.3f}s "
+                  f"({count / elapsed:,.0f} docs/s, {baseline / elapsed:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
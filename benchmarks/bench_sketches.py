@@ -0,0 +1,161 @@
+"""
+Benchmark dos esboços da análise aproximada (FISCAL_APROXIMADO=1).
+
+Sobre os dados sintéticos, para cada par de erros configurados:
+
+- atualiza os esboços em blocos, como na ingestão em streaming, e mede a
+  vazão (linhas de itens por segundo) e o tamanho serializado;
+- divide os blocos em partições, combina os esboços de cada uma e confere
+  que o resultado é idêntico ao da passada única;
+- compara as contagens de documentos de venda/compra por mês e no ano com
+  as exatas (erro relativo e se o valor exato caiu no intervalo de 95%);
+- compara o top 10 de fornecedores de cada trimestre com o exato
+  (quantos coincidem e se o esboço garantiu a ordem).
+
+Uso:
+    python benchmarks/bench_sketches.py --items 1000000 --data-dir /tmp/nfe_1m
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+sys.path.insert(0, BENCH_DIR)
+
+from aggregates import (
+    PURCHASE_CFOP_PREFIXES, SALES_CFOP_PREFIXES, DatasetSketches, _item_notes, _note_months, _prefix_mask,
+)
+from dataset import FiscalDataset
+from periods import month_keys
+from synthetic import generate
+
+# Pares (erro das contagens de distintos, erro dos rankings)
+DEFAULT_ERRORS = "0.05:0.01,0.02:0.005,0.01:0.001"
+TOP_N = 10
+
+
+def note_operations(dataset: FiscalDataset):
+    """
+    Chave, mês e operações de cada nota, como a ingestão entrega aos esboços.
+    """
+    _, first_rows, operations = _item_notes(dataset.df_itens)
+    keys = dataset.df_itens['CHAVE DE ACESSO'].iloc[first_rows]
+    return keys, _note_months(dataset.df_cabecalho, dataset.df_itens, first_rows), operations
+
+
+def build(dataset: FiscalDataset, notes, distinct_error: float, topk_error: float, chunk: int, parts=None):
+    """
+    Esboços atualizados em blocos de `chunk` linhas; com `parts`, só os blocos dessas partições.
+    """
+    sketches = DatasetSketches(distinct_error, topk_error)
+    keys, months, operations = notes
+    for index, start in enumerate(range(0, len(dataset.df_cabecalho), chunk)):
+        if parts is None or index % parts[1] == parts[0]:
+            sketches.update_cabecalho(dataset.df_cabecalho.iloc[start:start + chunk])
+    for index, start in enumerate(range(0, len(keys), chunk)):
+        if parts is None or index % parts[1] == parts[0]:
+            block = slice(start, start + chunk)
+            sketches.update_documentos(keys.iloc[block], months[block],
+                                       {name: has[block] for name, has in operations.items()})
+    return sketches
+
+
+def exact_counts(dataset: FiscalDataset):
+    itens = dataset.df_itens
+    months = month_keys(itens['DATA EMISSÃO'])
+    counts = {}
+    for name, prefixes in (('documentos_venda', SALES_CFOP_PREFIXES), ('documentos_compra', PURCHASE_CFOP_PREFIXES)):
+        mask = _prefix_mask(itens['CFOP'], prefixes)
+        keys = itens['CHAVE DE ACESSO'][mask]
+        per_month = keys.groupby(months[mask]).nunique()
+        counts[name] = {int(month): int(value) for month, value in per_month.items()}
+        counts[name][None] = int(keys.nunique())
+    return counts
+
+
+def check_counts(sketches: DatasetSketches, counts) -> dict:
+    errors, inside, total = [], 0, 0
+    for name, per_month in counts.items():
+        for month, exact in per_month.items():
+            sketch = sketches.combined(name, None if month is None else [month])
+            estimate, lower, upper = sketch.interval()
+            errors.append(abs(estimate - exact) / exact)
+            inside += lower <= exact <= upper
+            total += 1
+    return {"erro_medio": round(float(np.mean(errors)), 4), "erro_max": round(float(np.max(errors)), 4),
+            "no_intervalo": round(inside / total, 3)}
+
+
+def check_rankings(dataset: FiscalDataset, sketches: DatasetSketches) -> dict:
+    cabecalho = dataset.df_cabecalho
+    months = month_keys(cabecalho['DATA EMISSÃO'])
+    quarters = sorted({(month // 100, (month % 100 - 1) // 3) for month in np.unique(months)})
+    recall, guaranteed = [], 0
+    for year, quarter in quarters:
+        selected = [month for month in sketches.months
+                    if month // 100 == year and (month % 100 - 1) // 3 == quarter]
+        mask = np.isin(months, selected)
+        exact = cabecalho[mask].groupby('RAZÃO SOCIAL EMITENTE', observed=True)['VALOR NOTA FISCAL'].sum()
+        expected = set(exact.nlargest(TOP_N).index)
+        sketch = sketches.combined('fornecedores', selected)
+        recall.append(len(expected & {name for name, _, _ in sketch.top(TOP_N)}) / len(expected))
+        guaranteed += sketch.guaranteed(TOP_N)
+    return {"recall_top10": float(np.mean(recall)), "garantidos": f"{guaranteed}/{len(quarters)}"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=1_000_000, help="Linhas de itens sintéticas")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", help="Diretório dos CSVs sintéticos (reaproveitados entre execuções)")
+    parser.add_argument("--chunk", type=int, default=50_000, help="Linhas por bloco de atualização")
+    parser.add_argument("--partitions", type=int, default=4, help="Partições combinadas no teste de merge")
+    parser.add_argument("--errors", default=DEFAULT_ERRORS, help="Pares erro_distintos:erro_topk")
+    args = parser.parse_args()
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="nfe_sketches_")
+    os.makedirs(data_dir, exist_ok=True)
+    dataset = FiscalDataset(*generate(data_dir, args.items, args.seed))
+    dataset.load()
+    counts = exact_counts(dataset)
+    notes = note_operations(dataset)
+    print(f"{len(dataset.df_itens)} itens, {len(dataset.df_cabecalho)} notas")
+
+    for pair in args.errors.split(","):
+        distinct_error, topk_error = (float(value) for value in pair.split(":"))
+        start = time.perf_counter()
+        sketches = build(dataset, notes, distinct_error, topk_error, args.chunk)
+        elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        merged = build(dataset, notes, distinct_error, topk_error, args.chunk, (0, args.partitions))
+        for part in range(1, args.partitions):
+            merged.merge(build(dataset, notes, distinct_error, topk_error, args.chunk, (part, args.partitions)))
+        merge_elapsed = time.perf_counter() - start
+        identical = all(
+            np.array_equal(sketch.registers, merged.months[month][name].registers)
+            for month, values in sketches.months.items()
+            for name, sketch in values.items() if name in DatasetSketches.DISTINCT
+        )
+
+        result = {
+            "vazao_itens_s": round(len(dataset.df_itens) / elapsed),
+            "tamanho_kb": round(len(json.dumps(sketches.to_dict())) / 1024, 1),
+            "merge_s": round(merge_elapsed, 3),
+            "merge_identico": identical,
+            **check_counts(sketches, counts),
+            **check_rankings(dataset, sketches),
+        }
+        print(f"erros {distinct_error}/{topk_error}: " + ", ".join(f"{k} {v}" for k, v in result.items()))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""
+Tempo de inicialização a frio da aplicação, com orçamento.
+
+Cada repetição roda em um processo Python novo (sem módulos em cache) e mede:
+
+- a importação de src.main;
+- create_app (modo de inicialização rápida, sem pré-carregamento);
+- a primeira resposta, de um endpoint que não usa dados (/api/examples);
+- a restauração do último conjunto enviado, pela primeira chamada a
+  /api/stats (importação dos agentes, manifesto, agentes e tabelas).
+
+Também informa quais módulos pesados (pandas, langchain, rarfile,
+SQLAlchemy) já estavam carregados antes da primeira resposta. Sem conjunto
+enviado, 202401_NFs.zip é enviado antes da medição e removido ao final.
+O processo termina com erro se a mediana até a primeira resposta
+(importação + create_app + primeira requisição) passar de --budget:
+
+    python benchmarks/cold_start.py --budget 0.75
+
+Uso:
+    python benchmarks/cold_start.py --repeat 5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_ZIP = os.path.join(ROOT_DIR, "202401_NFs.zip")
+LATEST_PATH = os.path.join(ROOT_DIR, "src", "data", "ultimo_conjunto")
+
+# Orçamento padrão, em segundos, até a primeira resposta
+DEFAULT_BUDGET = 0.75
+
+HEAVY_MODULES = ("pandas", "langchain_core", "rarfile", "sqlalchemy")
+
+# Executado em um processo novo a cada repetição
+MEASURE_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {root!r})
+from src.main import create_app
+imported = time.perf_counter()
+client = create_app().test_client()
+created = time.perf_counter()
+assert client.get("/api/examples").status_code == 200
+first = time.perf_counter()
+loaded = [name for name in {heavy!r} if name in sys.modules]
+stats = client.get("/api/stats").get_json()
+restored = time.perf_counter()
+print(json.dumps({{
+    "importacao": imported - start, "create_app": created - imported, "primeira_resposta": first - created,
+    "ate_primeira_resposta": first - start, "restauracao": restored - first,
+    "modulos_carregados": loaded, "dataset_id": stats.get("dataset_id"),
+}}))
+"""
+
+UPLOAD_SCRIPT = """
+import json, sys
+sys.path.insert(0, {root!r})
+from src.main import create_app
+client = create_app().test_client()
+with open({path!r}, "rb") as f:
+    payload = client.post("/api/upload", data={{"file": (f, "202401_NFs.zip")}},
+                          content_type="multipart/form-data").get_json()
+if payload.get("status") != "success":
+    raise SystemExit("Falha no upload: " + str(payload.get("message")))
+client.post("/api/classify", json={{}})
+print(payload["dataset_id"])
+"""
+
+REMOVE_SCRIPT = """
+import sys
+sys.path.insert(0, {root!r})
+from src.main import create_app
+create_app().test_client().delete("/api/datasets/{dataset_id}")
+"""
+
+
+def run_python(script: str) -> str:
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, cwd=ROOT_DIR)
+    if result.returncode != 0:
+        raise SystemExit(result.stderr.strip())
+    return result.stdout.strip().splitlines()[-1]
+
+
+def measure_once() -> dict:
+    return json.loads(run_python(MEASURE_SCRIPT.format(root=ROOT_DIR, heavy=HEAVY_MODULES)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="Processos medidos")
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET,
+                        help="Orçamento (s) da mediana até a primeira resposta")
+    args = parser.parse_args()
+
+    uploaded = None
+    if not os.path.exists(LATEST_PATH):
+        uploaded = run_python(UPLOAD_SCRIPT.format(root=ROOT_DIR, path=SAMPLE_ZIP))
+        print(f"Conjunto {uploaded} enviado para a medição")
+
+    try:
+        runs = [measure_once() for _ in range(args.repeat)]
+    finally:
+        if uploaded:
+            run_python(REMOVE_SCRIPT.format(root=ROOT_DIR, dataset_id=uploaded))
+
+    print(f"{'etapa':<22} {'mediana':>10} {'máx':>10}")
+    for name in ("importacao", "create_app", "primeira_resposta", "ate_primeira_resposta", "restauracao"):
+        values = [run[name] for run in runs]
+        print(f"{name:<22} {statistics.median(values) * 1000:8.1f} ms {max(values) * 1000:8.1f} ms")
+    loaded = sorted({name for run in runs for name in run["modulos_carregados"]})
+    print(f"Módulos pesados antes da primeira resposta: {', '.join(loaded) or 'nenhum'}")
+
+    elapsed = statistics.median(run["ate_primeira_resposta"] for run in runs)
+    if elapsed > args.budget:
+        print(f"Orçamento excedido: {elapsed * 1000:.1f} ms até a primeira resposta (limite {args.budget * 1000:.0f} ms)")
+        sys.exit(1)
+    print(f"Dentro do orçamento: {elapsed * 1000:.1f} ms até a primeira resposta (limite {args.budget * 1000:.0f} ms)")
+
+
+if __name__ == "__main__":
+    main()
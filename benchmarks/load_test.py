@@ -0,0 +1,156 @@
+"""
+Teste de carga dos endpoints /api/stats e /api/query.
+
+Dispara requisições concorrentes durante um tempo fixo e informa as
+requisições por segundo e as latências p50/p99 de cada endpoint. Sem
+--url, a aplicação sobe em um servidor local (um processo com threads) e
+recebe 202401_NFs.zip antes da medição; com --url é medido um servidor já
+em execução, por exemplo o gunicorn com vários workers:
+
+    gunicorn -c gunicorn.conf.py src.wsgi:app
+    python benchmarks/load_test.py --url http://127.0.0.1:5000 --upload
+
+Uso:
+    python benchmarks/load_test.py --concurrency 8 --duration 10
+"""
+
+import argparse
+import http.client
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+import requests
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_ZIP = os.path.join(ROOT_DIR, "202401_NFs.zip")
+
+QUESTIONS = [
+    "Qual é o fornecedor com maior valor total de notas?",
+    "Qual item teve maior volume de compra?",
+    "Qual o valor médio por nota fiscal?",
+    "Quantos documentos são de venda?",
+    "Top 5 fornecedores em SP no mês de janeiro",
+]
+
+
+def start_local_server() -> str:
+    """
+    Sobe a aplicação em uma porta livre, em uma thread deste processo.
+    """
+    from werkzeug.serving import make_server
+
+    sys.path.insert(0, ROOT_DIR)
+    from src.main import create_app
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, create_app(), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.port}"
+
+
+def upload_sample(base_url: str) -> str:
+    with open(SAMPLE_ZIP, "rb") as f:
+        response = requests.post(f"{base_url}/api/upload", files={"file": ("202401_NFs.zip", f)})
+    payload = response.json()
+    if payload.get("status") != "success":
+        raise SystemExit(f"Falha no upload: {payload.get('message')}")
+    return payload["dataset_id"]
+
+
+def build_request(endpoint: str, dataset_id: str, index: int):
+    """
+    Método, caminho e corpo da `index`-ésima requisição ao endpoint.
+    """
+    params = f"?{urlencode({'dataset_id': dataset_id})}" if dataset_id else ""
+    if endpoint == "stats":
+        return "GET", f"/api/stats{params}", None
+    body = {"question": QUESTIONS[index % len(QUESTIONS)]}
+    if dataset_id:
+        body["dataset_id"] = dataset_id
+    return "POST", "/api/query", json.dumps(body).encode()
+
+
+def worker(base_url: str, endpoint: str, dataset_id: str, deadline: float, latencies: list, errors: list):
+    """
+    Envia requisições em sequência por uma conexão persistente até o prazo.
+    """
+    parts = urlsplit(base_url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+    index = 0
+    while time.perf_counter() < deadline:
+        method, path, body = build_request(endpoint, dataset_id, index)
+        headers = {"Content-Type": "application/json"} if body else {}
+        start = time.perf_counter()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            if response.status >= 400:
+                errors.append(response.status)
+            else:
+                latencies.append(time.perf_counter() - start)
+            if response.getheader("Connection", "").lower() == "close":
+                conn.close()
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(type(e).__name__)
+            conn.close()
+        index += 1
+    conn.close()
+
+
+def percentile(ordered: list, fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run(base_url: str, endpoint: str, dataset_id: str, concurrency: int, duration: float):
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    threads = [
+        threading.Thread(target=worker, args=(base_url, endpoint, dataset_id, deadline, latencies, errors))
+        for _ in range(concurrency)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    if not latencies:
+        print(f"{endpoint:>6}: nenhuma requisição bem-sucedida ({len(errors)} erros)")
+        return
+    ordered = sorted(latencies)
+    print(f"{endpoint:>6}: {len(ordered) / elapsed:8.1f} req/s | "
+          f"p50 {percentile(ordered, 0.50) * 1000:7.2f} ms | "
+          f"p99 {percentile(ordered, 0.99) * 1000:7.2f} ms | "
+          f"máx {ordered[-1] * 1000:7.2f} ms | "
+          f"{len(ordered)} requisições, {len(errors)} erros")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Servidor a medir (sem ele, sobe um servidor local)")
+    parser.add_argument("--upload", action="store_true", help="Envia 202401_NFs.zip ao servidor antes de medir")
+    parser.add_argument("--dataset-id", help="Conjunto consultado (padrão: o enviado ou o último carregado)")
+    parser.add_argument("--endpoints", default="stats,query", help="Endpoints medidos, separados por vírgula")
+    parser.add_argument("--concurrency", type=int, default=8, help="Conexões simultâneas")
+    parser.add_argument("--duration", type=float, default=10.0, help="Segundos de medição por endpoint")
+    args = parser.parse_args()
+
+    base_url = (args.url or start_local_server()).rstrip("/")
+    dataset_id = args.dataset_id
+    if args.upload or not args.url:
+        dataset_id = upload_sample(base_url)
+
+    print(f"{base_url}: {args.concurrency} conexões, {args.duration:.0f}s por endpoint")
+    for endpoint in args.endpoints.split(","):
+        run(base_url, endpoint.strip(), dataset_id, args.concurrency, args.duration)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,402 @@
+"""
+Suíte de benchmarks sobre dados sintéticos em escala.
+
+Gera (ou reaproveita) notas sintéticas com benchmarks/synthetic.py e mede,
+etapa por etapa, o tempo, a vazão (linhas por segundo) e o pico de memória
+residente (RSS):
+
+- carga do CSV (com conversão para o formato colunar) e do arquivo colunar;
+- merge, classificação e gravação na base de documentos classificados,
+  na tabela fato de itens e no índice de busca textual;
+- cálculo dos agregados;
+- cada regra de consulta do registro de intenções, com latências p50/p99
+  (o cache de respostas é limpo antes de cada pergunta);
+- os endpoints HTTP (upload, stats, search, documents, export, query e classify) pelo cliente de
+  testes do Flask, sem rede.
+
+O resultado é gravado em JSON com o commit, o ambiente e os parâmetros dos
+dados. Com --baseline, cada etapa é comparada com um resultado anterior e o
+processo termina com erro se alguma ficar mais lenta que a tolerância:
+
+    python benchmarks/suite.py --items 1000000 --output base.json
+    python benchmarks/suite.py --items 1000000 --baseline base.json
+
+Uso:
+    python benchmarks/suite.py --items 1000000 --data-dir /tmp/nfe_1m
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+sys.path.insert(0, BENCH_DIR)
+
+from aggregates import DatasetAggregates, invalidate_aggregates
+from answer_cache import get_answer_cache
+from csv_query_agent import CSVQueryAgent
+from dataset import FiscalDataset
+from fiscal_agent import CFOPClassifier, DocumentOrganizer, FiscalDocumentAgent, classify_merged_documents, merge_documents
+from intents import TARGET_QUERY, get_intent_registry
+from rules import get_default_rules
+from synthetic import GENERATOR_VERSION, generate
+
+# Versão do formato do resultado
+RESULT_VERSION = 1
+
+# Uma pergunta de exemplo por intenção
+QUESTIONS = {
+    "top_fornecedores": "Quais os top 10 fornecedores em SP no mês de março?",
+    "fornecedor_maior": "Qual é o fornecedor com maior valor total de notas?",
+    "item_maior_volume": "Qual item teve maior volume de compra?",
+    "valor_total": "Qual o valor total das notas?",
+    "valor_medio": "Qual o valor médio por nota fiscal?",
+    "documentos_venda": "Quantos documentos são de venda?",
+    "documentos_compra": "Quantos documentos são de compra?",
+    "setores": "Quais setores aparecem nos dados?",
+    "total_notas": "Quantas notas foram emitidas no 1º trimestre?",
+    "analise_geral": "Me fale sobre os dados",
+    "classificacao_venda": "Quantos documentos de venda foram classificados?",
+    "classificacao_compra": "Quantos documentos de compra foram classificados?",
+    "classificacao_setores": "Quais setores foram classificados?",
+    "classificacao_nao_reconhecida": "Como está a classificação?",
+    "busca_compras": "Quanto compramos de dipirona?",
+    "busca_vendas": "Quanto vendemos de livros em março?",
+    "busca_notas_parceiro": "Notas do fornecedor chemyunion",
+    "busca_textual": "Buscar editora",
+}
+
+# Métrica comparada com a linha de base: latência p50 nas etapas repetidas, tempo total nas demais
+LATENCY_METRIC = "p50_ms"
+DURATION_METRIC = "segundos"
+
+# Intervalo (segundos) entre leituras da memória residente
+RSS_INTERVAL = 0.01
+
+
+def current_rss() -> int:
+    """
+    Memória residente do processo, em bytes.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # Sem /proc (macOS): o máximo do processo é o melhor disponível
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+class PeakRSS:
+    """
+    Acompanha o pico de memória residente enquanto um bloco executa.
+    """
+
+    def __init__(self, interval: float = RSS_INTERVAL):
+        self.interval = interval
+        self.start = 0
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> "PeakRSS":
+        self.start = self.peak = current_rss()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+def percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+class BenchmarkSuite:
+    """
+    Executa as etapas e acumula os resultados no formato gravado em JSON.
+    """
+
+    def __init__(self, cab_path: str, itens_path: str, workdir: str, repeat: int):
+        self.cab_path = cab_path
+        self.itens_path = itens_path
+        self.workdir = workdir
+        self.repeat = repeat
+        self.results: Dict[str, Dict] = {}
+
+    @contextmanager
+    def stage(self, name: str, rows: Optional[int] = None):
+        """
+        Mede tempo e pico de memória do bloco; `rows` (ou o valor atribuído a
+        result["linhas"] dentro do bloco) vira a vazão da etapa.
+        """
+        result = {"linhas": rows}
+        with PeakRSS() as rss:
+            start = time.perf_counter()
+            yield result
+            elapsed = time.perf_counter() - start
+        result["segundos"] = round(elapsed, 6)
+        if result["linhas"]:
+            result["linhas_por_segundo"] = round(result["linhas"] / elapsed, 1) if elapsed else None
+        result["pico_rss_mb"] = round(rss.peak / 1024 / 1024, 1)
+        result["delta_rss_mb"] = round((rss.peak - rss.start) / 1024 / 1024, 1)
+        self.results[name] = result
+        print(f"{name:>40}: {elapsed:9.3f}s  pico RSS {result['pico_rss_mb']:8.1f} MB")
+
+    def measure(self, name: str, fn, prepare=None):
+        """
+        Executa `fn` uma vez a frio e `repeat` vezes em seguida, registrando as latências.
+        """
+        latencies = []
+        with PeakRSS() as rss:
+            if prepare:
+                prepare()
+            start = time.perf_counter()
+            fn()
+            cold = time.perf_counter() - start
+            for _ in range(self.repeat):
+                if prepare:
+                    prepare()
+                start = time.perf_counter()
+                fn()
+                latencies.append(time.perf_counter() - start)
+        result = {
+            "fria_ms": round(cold * 1000, 3),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+            "max_ms": round(max(latencies) * 1000, 3) if latencies else 0.0,
+            "repeticoes": len(latencies),
+            "pico_rss_mb": round(rss.peak / 1024 / 1024, 1),
+        }
+        self.results[name] = result
+        print(f"{name:>40}: p50 {result['p50_ms']:9.3f}ms  p99 {result['p99_ms']:9.3f}ms  "
+              f"fria {result['fria_ms']:9.3f}ms")
+
+    def run_pipeline(self) -> FiscalDataset:
+        cache_dir = os.path.join(self.workdir, "colunar")
+        os.makedirs(cache_dir, exist_ok=True)
+
+        dataset = FiscalDataset(self.cab_path, self.itens_path, cache_dir=cache_dir)
+        with self.stage("carga_csv") as result:
+            dataset.load()
+            result["linhas"] = len(dataset.df_cabecalho) + len(dataset.df_itens)
+
+        dataset = FiscalDataset(self.cab_path, self.itens_path, cache_dir=cache_dir)
+        with self.stage("carga_colunar") as result:
+            dataset.load()
+            result["linhas"] = len(dataset.df_cabecalho) + len(dataset.df_itens)
+
+        with self.stage("merge", len(dataset.df_itens)):
+            merged = merge_documents(dataset.df_cabecalho, dataset.df_itens)
+
+        with self.stage("classificacao", len(merged)):
+            classified = classify_merged_documents(merged, CFOPClassifier())
+        del merged
+
+        organizer = DocumentOrganizer(os.path.join(self.workdir, "bench.db"))
+        with self.stage("gravacao", len(classified)):
+            organizer.store_classified_documents(classified.itertuples(index=False, name=None))
+        del classified
+
+        with self.stage("gravacao_itens", len(dataset.df_itens)):
+            organizer.items.bulk_load(dataset.df_itens, get_default_rules())
+
+        with self.stage("indice_busca"):
+            organizer.search.refresh()
+
+        invalidate_aggregates()
+        with self.stage("agregados", len(dataset.df_cabecalho) + len(dataset.df_itens)):
+            DatasetAggregates.from_dataset(dataset)
+        return dataset
+
+    def run_queries(self, dataset: FiscalDataset):
+        """
+        Latência de cada regra de consulta, sem o cache de respostas.
+        """
+        query_agent = CSVQueryAgent(self.cab_path, self.itens_path, dataset)
+        classification_agent = FiscalDocumentAgent(self.cab_path, self.itens_path, dataset,
+                                                   os.path.join(self.workdir, "bench.db"))
+        registry = get_intent_registry()
+        cache = get_answer_cache()
+
+        for intent in registry.intents():
+            question = QUESTIONS.get(intent.name)
+            if question is None:
+                print(f"{'consulta_' + intent.name:>40}: sem pergunta de exemplo")
+                continue
+            match = registry.match(question, target=intent.target)
+            if match is None or match.intent.name != intent.name:
+                raise SystemExit(f"A pergunta de exemplo de '{intent.name}' não é reconhecida por essa intenção")
+            if intent.target == TARGET_QUERY:
+                fn = lambda: query_agent.query_data(question, match)
+            else:
+                fn = lambda: classification_agent.query_documents(question, match)
+            self.measure(f"consulta_{intent.name}", fn, prepare=cache.invalidate)
+
+    def run_http(self):
+        """
+        Endpoints HTTP pelo cliente de testes do Flask, com o conjunto enviado como ZIP.
+        """
+        sys.path.insert(0, ROOT_DIR)
+        from src.main import create_app
+
+        client = create_app().test_client()
+        archive = os.path.join(self.workdir, "sintetico_NFs.zip")
+        if not os.path.exists(archive):
+            with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+                zf.write(self.cab_path, os.path.basename(self.cab_path))
+                zf.write(self.itens_path, os.path.basename(self.itens_path))
+
+        with self.stage("http_upload") as result:
+            with open(archive, "rb") as f:
+                response = client.post("/api/upload", data={"file": (f, "sintetico_NFs.zip")},
+                                       content_type="multipart/form-data")
+            payload = response.get_json()
+            if payload.get("status") != "success":
+                raise SystemExit(f"Falha no upload: {payload.get('message')}")
+        dataset_id = payload["dataset_id"]
+
+        try:
+            with self.stage("http_classify") as result:
+                payload = client.post("/api/classify", json={"dataset_id": dataset_id}).get_json()
+                result["linhas"] = payload.get("documentos_processados")
+
+            self.measure("http_stats", lambda: client.get(f"/api/stats?dataset_id={dataset_id}"))
+            self.measure("http_search", lambda: client.get(f"/api/search?dataset_id={dataset_id}&q=livro"))
+            self.measure("http_documents", lambda: client.get(f"/api/documents?dataset_id={dataset_id}&limite=100"))
+            with self.stage("http_export") as result:
+                response = client.get(f"/api/documents/export?dataset_id={dataset_id}&formato=ndjson")
+                result["linhas"] = sum(chunk.count(b"\n") for chunk in response.response)
+            cache = get_answer_cache()
+            for name in ("top_fornecedores", "valor_medio", "classificacao_venda"):
+                body = {"dataset_id": dataset_id, "question": QUESTIONS[name]}
+                self.measure(f"http_query_{name}", lambda: client.post("/api/query", json=body),
+                             prepare=cache.invalidate)
+        finally:
+            client.delete(f"/api/datasets/{dataset_id}")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> Dict:
+    return {
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "plataforma": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """
+    Etapas mais lentas que a linha de base além da tolerância (fração).
+    """
+    if baseline.get("dados") != results["dados"]:
+        print(f"Aviso: dados diferentes da linha de base ({baseline.get('dados')}); a comparação não é confiável.")
+
+    regressions = []
+    print(f"\nComparação com {baseline.get('commit') or 'linha de base'} (tolerância {tolerance:.0%}):")
+    for name, current in results["etapas"].items():
+        previous = baseline.get("etapas", {}).get(name)
+        if previous is None:
+            continue
+        metric = LATENCY_METRIC if LATENCY_METRIC in current else DURATION_METRIC
+        before, after = previous.get(metric), current.get(metric)
+        if not before or after is None:
+            continue
+        change = after / before - 1
+        flag = "REGRESSÃO" if change > tolerance else ""
+        print(f"{name:>40}: {before:12.3f} -> {after:12.3f} {metric:<9} {change:+7.1%} {flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=1_000_000, help="linhas de itens dos dados sintéticos")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=20, help="repetições das consultas e endpoints")
+    parser.add_argument("--data-dir", help="diretório dos dados gerados (reaproveitados entre execuções)")
+    parser.add_argument("--skip-http", action="store_true", help="não mede os endpoints HTTP")
+    parser.add_argument("--output", help="arquivo JSON do resultado")
+    parser.add_argument("--baseline", help="resultado anterior para detectar regressões")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="piora aceita em relação à linha de base")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="fiscal-bench-")
+    data_dir = args.data_dir or os.path.join(workdir, "dados")
+    try:
+        start = time.perf_counter()
+        cab_path, itens_path = generate(data_dir, args.items, args.seed)
+        print(f"Dados sintéticos prontos em {time.perf_counter() - start:.1f}s: {data_dir}")
+
+        suite = BenchmarkSuite(cab_path, itens_path, workdir, args.repeat)
+        dataset = suite.run_pipeline()
+        suite.run_queries(dataset)
+        if not args.skip_http:
+            suite.run_http()
+
+        results = {
+            "versao": RESULT_VERSION,
+            "commit": git_commit(),
+            "data": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "ambiente": environment(),
+            "dados": {
+                "gerador": GENERATOR_VERSION,
+                "semente": args.seed,
+                "notas": len(dataset.df_cabecalho),
+                "itens": len(dataset.df_itens),
+            },
+            "etapas": suite.results,
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"Resultado gravado em {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} etapa(s) com regressão: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
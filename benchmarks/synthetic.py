@@ -0,0 +1,289 @@
+"""
+Gerador determinístico de notas fiscais sintéticas.
+
+Produz arquivos de cabeçalho e itens com as mesmas colunas de
+202401_NFs.zip, em qualquer escala (1M ou 10M linhas de itens), seguindo
+as distribuições observadas na amostra:
+
+- cada nota copia os atributos de uma nota da amostra (modelo, natureza da
+  operação, destinatário, indicadores), de forma que o CFOP por nota (o que
+  a classificação usa) segue a distribuição da amostra;
+- os itens são sorteados entre os itens da amostra (descrição, NCM, tipo de
+  produto, unidade, quantidade e preço juntos), mantendo a distribuição de
+  NCM por item; o preço unitário recebe uma variação aleatória;
+- o número de itens por nota segue a distribuição da amostra;
+- os emitentes vêm de um conjunto proporcional ao número de notas, com
+  frequência de cauda longa (Zipf), para que os rankings de fornecedores
+  tenham a cardinalidade de dados reais;
+- as datas de emissão se espalham pelos meses do ano informado.
+
+A mesma semente e o mesmo número de notas geram arquivos idênticos, o que
+torna comparáveis os resultados dos benchmarks entre commits.
+
+Uso:
+    python benchmarks/synthetic.py --items 1000000 --output /tmp/nfe_1m
+"""
+
+import argparse
+import os
+import sys
+import time
+import zipfile
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_ZIP = os.path.join(ROOT_DIR, "202401_NFs.zip")
+
+# Versão do gerador: muda sempre que a mesma semente passar a gerar dados diferentes
+GENERATOR_VERSION = 1
+
+CABECALHO_FILENAME = "sintetico_Cabecalho.csv"
+ITENS_FILENAME = "sintetico_Itens.csv"
+
+# Notas geradas por bloco (memória limitada em qualquer escala)
+CHUNK_NOTES = 100_000
+
+# Emitentes distintos por nota e expoente da distribuição de Zipf
+SUPPLIERS_PER_NOTE = 0.05
+ZIPF_EXPONENT = 1.1
+
+# Desvio (log-normal) aplicado ao preço unitário dos itens da amostra
+PRICE_SIGMA = 0.15
+
+# Código IBGE das UFs, usado na chave de acesso
+UF_CODES = {
+    "RO": 11, "AC": 12, "AM": 13, "RR": 14, "PA": 15, "AP": 16, "TO": 17, "MA": 21, "PI": 22,
+    "CE": 23, "RN": 24, "PB": 25, "PE": 26, "AL": 27, "SE": 28, "BA": 29, "MG": 31, "ES": 32,
+    "RJ": 33, "SP": 35, "PR": 41, "SC": 42, "RS": 43, "MS": 50, "MT": 51, "GO": 52, "DF": 53,
+}
+
+# Colunas do cabeçalho copiadas da nota modelo da amostra
+TEMPLATE_COLUMNS = (
+    "MODELO", "NATUREZA DA OPERAÇÃO", "EVENTO MAIS RECENTE", "CNPJ DESTINATÁRIO", "NOME DESTINATÁRIO",
+    "UF DESTINATÁRIO", "INDICADOR IE DESTINATÁRIO", "DESTINO DA OPERAÇÃO", "CONSUMIDOR FINAL",
+    "PRESENÇA DO COMPRADOR",
+)
+
+# Colunas dos itens sorteadas em conjunto a partir de um item da amostra
+PRODUCT_COLUMNS = (
+    "DESCRIÇÃO DO PRODUTO/SERVIÇO", "CÓDIGO NCM/SH", "NCM/SH (TIPO DE PRODUTO)", "QUANTIDADE", "UNIDADE",
+)
+
+
+def read_sample(sample_zip: str = SAMPLE_ZIP) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Lê cabeçalho e itens da amostra como texto, sem conversões.
+    """
+    with zipfile.ZipFile(sample_zip) as zf:
+        names = zf.namelist()
+        cab_name = next(n for n in names if "cabecalho" in n.lower())
+        itens_name = next(n for n in names if "itens" in n.lower())
+        with zf.open(cab_name) as f:
+            df_cab = pd.read_csv(f, dtype=str, keep_default_na=False)
+        with zf.open(itens_name) as f:
+            df_itens = pd.read_csv(f, dtype=str, keep_default_na=False)
+    return df_cab, df_itens
+
+
+def access_key_check_digits(keys: np.ndarray) -> np.ndarray:
+    """
+    Dígito verificador (módulo 11) de chaves de acesso com 43 dígitos.
+    """
+    digits = np.frombuffer("".join(keys).encode("ascii"), dtype=np.uint8).reshape(len(keys), 43) - ord("0")
+    weights = np.resize(np.arange(2, 10), 43)[::-1]
+    remainder = (digits.astype(np.int64) * weights).sum(axis=1) % 11
+    return np.where(remainder < 2, 0, 11 - remainder)
+
+
+class SyntheticNFeGenerator:
+    """
+    Gera notas fiscais sintéticas a partir das distribuições da amostra.
+    """
+
+    def __init__(self, seed: int = 0, year: int = 2024, months: int = 12, sample_zip: str = SAMPLE_ZIP):
+        self.seed = seed
+        self.year = year
+        self.months = months
+        sample_cab, sample_itens = read_sample(sample_zip)
+        self.header_columns = list(sample_cab.columns)
+        self.item_columns = list(sample_itens.columns)
+
+        # Nota modelo: atributos do cabeçalho e CFOP do primeiro item
+        first_items = sample_itens.drop_duplicates("CHAVE DE ACESSO").set_index("CHAVE DE ACESSO")
+        self.templates = {column: sample_cab[column].to_numpy() for column in TEMPLATE_COLUMNS}
+        self.templates["CFOP"] = first_items["CFOP"].reindex(sample_cab["CHAVE DE ACESSO"]).fillna("5102").to_numpy()
+        self.template_series = sample_cab["SÉRIE"].to_numpy()
+
+        # Emitentes da amostra (nome, UF e município juntos) usados como base dos emitentes sintéticos
+        issuers = sample_cab.drop_duplicates("CPF/CNPJ Emitente")
+        self.issuer_names = issuers["RAZÃO SOCIAL EMITENTE"].to_numpy()
+        self.issuer_ufs = issuers["UF EMITENTE"].to_numpy()
+        self.issuer_cities = issuers["MUNICÍPIO EMITENTE"].to_numpy()
+
+        self.products = {column: sample_itens[column].to_numpy() for column in PRODUCT_COLUMNS}
+        self.unit_prices = sample_itens["VALOR UNITÁRIO"].astype(float).to_numpy()
+        self.items_per_note = sample_itens.groupby("CHAVE DE ACESSO").size().to_numpy()
+
+    @property
+    def mean_items_per_note(self) -> float:
+        return float(self.items_per_note.mean())
+
+    def notes_for_items(self, items: int) -> int:
+        """
+        Número de notas que gera aproximadamente `items` linhas de itens.
+        """
+        return max(1, int(round(items / self.mean_items_per_note)))
+
+    def _rng(self, *stream: int) -> np.random.Generator:
+        return np.random.default_rng([self.seed, GENERATOR_VERSION, *stream])
+
+    def _suppliers(self, notes: int) -> Dict[str, np.ndarray]:
+        """
+        Emitentes sintéticos e os pesos (Zipf) com que aparecem nas notas.
+        """
+        rng = self._rng(0)
+        count = max(1, int(notes * SUPPLIERS_PER_NOTE))
+        ids = np.arange(count)
+        base = rng.integers(0, len(self.issuer_names), count)
+        weights = 1.0 / np.power(ids + 1, ZIPF_EXPONENT)
+        return {
+            "cnpj": np.char.add(np.char.zfill((10_000_000 + ids).astype(str), 8),
+                                np.char.add("0001", np.char.zfill((ids % 100).astype(str), 2))),
+            "nome": np.char.add(self.issuer_names[base].astype(str), np.char.add(" ", np.char.zfill(ids.astype(str), 6))),
+            "ie": rng.integers(100_000_000, 9_999_999_999, count).astype(str),
+            "uf": self.issuer_ufs[base],
+            "municipio": self.issuer_cities[base],
+            "peso": weights / weights.sum(),
+        }
+
+    def _emission_dates(self, rng: np.random.Generator, size: int) -> np.ndarray:
+        month = rng.integers(0, self.months, size)
+        start = np.datetime64(f"{self.year}-01", "M") + month
+        month_start = start.astype("datetime64[s]")
+        month_seconds = ((start + 1).astype("datetime64[s]") - month_start).astype(np.int64)
+        return month_start + (rng.random(size) * month_seconds).astype(np.int64)
+
+    def generate_chunk(self, chunk_index: int, start: int, size: int,
+                       suppliers: Dict[str, np.ndarray]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Cabeçalho e itens das notas `start` a `start + size - 1`.
+        """
+        rng = self._rng(1, chunk_index)
+        template = rng.integers(0, len(self.template_series), size)
+        supplier = rng.choice(len(suppliers["peso"]), size, p=suppliers["peso"])
+        numbers = start + np.arange(size) + 1
+
+        emission = self._emission_dates(rng, size)
+        event = emission + rng.integers(1, 120, size)
+        emission_text = pd.Series(np.datetime_as_string(emission)).str.replace("T", " ", regex=False)
+        event_text = pd.Series(np.datetime_as_string(event)).str.replace("T", " ", regex=False)
+
+        uf = suppliers["uf"][supplier]
+        cnpj = suppliers["cnpj"][supplier]
+        series = self.template_series[template]
+        key_prefix = (
+            pd.Series(uf).map(UF_CODES).fillna(35).astype(int).astype(str).str.zfill(2)
+            + emission_text.str[2:4] + emission_text.str[5:7]
+            + cnpj + "55" + pd.Series(series).str.zfill(3).str[-3:]
+            + pd.Series(numbers.astype(str)).str.zfill(9) + "1"
+            + pd.Series(rng.integers(0, 100_000_000, size).astype(str)).str.zfill(8)
+        ).to_numpy()
+        keys = key_prefix + access_key_check_digits(key_prefix).astype(str)
+
+        # Itens: quantidade por nota, produto sorteado na amostra e preço com variação
+        counts = rng.choice(self.items_per_note, size)
+        note_of_item = np.repeat(np.arange(size), counts)
+        item_number = np.arange(len(note_of_item)) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+        product = rng.integers(0, len(self.unit_prices), len(note_of_item))
+        unit_price = np.maximum(
+            np.round(self.unit_prices[product] * rng.lognormal(0.0, PRICE_SIGMA, len(product)), 2), 0.01
+        )
+        quantity = self.products["QUANTIDADE"][product].astype(float)
+        item_total = np.round(quantity * unit_price, 2)
+        note_total = np.round(np.bincount(note_of_item, weights=item_total, minlength=size), 2)
+
+        header = {
+            "CHAVE DE ACESSO": keys,
+            "SÉRIE": series,
+            "NÚMERO": numbers,
+            "DATA EMISSÃO": emission_text.to_numpy(),
+            "DATA/HORA EVENTO MAIS RECENTE": event_text.to_numpy(),
+            "CPF/CNPJ Emitente": cnpj,
+            "RAZÃO SOCIAL EMITENTE": suppliers["nome"][supplier],
+            "INSCRIÇÃO ESTADUAL EMITENTE": suppliers["ie"][supplier],
+            "UF EMITENTE": uf,
+            "MUNICÍPIO EMITENTE": suppliers["municipio"][supplier],
+            "VALOR NOTA FISCAL": note_total,
+            **{column: values[template] for column, values in self.templates.items() if column != "CFOP"},
+        }
+        df_cab = pd.DataFrame(header, columns=self.header_columns)
+
+        items = {column: values[note_of_item] for column, values in header.items()
+                 if column in self.item_columns}
+        items.update({column: values[product] for column, values in self.products.items()})
+        items.update({
+            "NÚMERO PRODUTO": item_number,
+            "CFOP": self.templates["CFOP"][template][note_of_item],
+            "QUANTIDADE": quantity,
+            "VALOR UNITÁRIO": unit_price,
+            "VALOR TOTAL": item_total,
+        })
+        df_itens = pd.DataFrame(items, columns=self.item_columns)
+        return df_cab, df_itens
+
+    def write(self, output_dir: str, notes: int) -> Tuple[str, str]:
+        """
+        Grava os CSVs de cabeçalho e itens com `notes` notas, em blocos.
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        cab_path = os.path.join(output_dir, CABECALHO_FILENAME)
+        itens_path = os.path.join(output_dir, ITENS_FILENAME)
+        suppliers = self._suppliers(notes)
+
+        for chunk_index, start in enumerate(range(0, notes, CHUNK_NOTES)):
+            df_cab, df_itens = self.generate_chunk(chunk_index, start, min(CHUNK_NOTES, notes - start), suppliers)
+            mode, header = ("w", True) if chunk_index == 0 else ("a", False)
+            df_cab.to_csv(cab_path, mode=mode, header=header, index=False)
+            df_itens.to_csv(itens_path, mode=mode, header=header, index=False)
+        return cab_path, itens_path
+
+
+def generate(output_dir: str, items: int, seed: int = 0) -> Tuple[str, str]:
+    """
+    Gera (ou reaproveita, se já gerados com os mesmos parâmetros) os CSVs
+    sintéticos com aproximadamente `items` linhas de itens.
+    """
+    generator = SyntheticNFeGenerator(seed)
+    notes = generator.notes_for_items(items)
+    marker = os.path.join(output_dir, f".gerado_v{GENERATOR_VERSION}_s{seed}_n{notes}")
+    cab_path = os.path.join(output_dir, CABECALHO_FILENAME)
+    itens_path = os.path.join(output_dir, ITENS_FILENAME)
+    if os.path.exists(marker) and os.path.exists(cab_path) and os.path.exists(itens_path):
+        return cab_path, itens_path
+
+    paths = generator.write(output_dir, notes)
+    with open(marker, "w"):
+        pass
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=1_000_000, help="linhas de itens (aproximado)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", required=True, help="diretório dos CSVs gerados")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    cab_path, itens_path = generate(args.output, args.items, args.seed)
+    elapsed = time.perf_counter() - start
+    for path in (cab_path, itens_path):
+        print(f"{path}: {os.path.getsize(path) / 1024 / 1024:.1f} MB")
+    print(f"Gerado em {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
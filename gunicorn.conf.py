@@ -0,0 +1,30 @@
+# Configuração de produção do gunicorn
+#
+#   gunicorn -c gunicorn.conf.py src.wsgi:app
+#
+# Todas as opções podem ser ajustadas por variáveis de ambiente.
+
+import multiprocessing
+import os
+
+bind = os.environ.get("FISCAL_BIND", "0.0.0.0:5000")
+
+# Processos pré-criados (fork) a partir do mestre, que importa a aplicação e
+# pré-carrega os conjuntos de dados uma única vez (preload_app)
+workers = int(os.environ.get("FISCAL_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+preload_app = True
+
+# Threads por worker: os fluxos de eventos (SSE) e as consultas ao banco
+# liberam o GIL enquanto esperam
+worker_class = "gthread"
+threads = int(os.environ.get("FISCAL_THREADS", 4))
+
+# Uploads e classificações síncronas de arquivos grandes
+timeout = int(os.environ.get("FISCAL_TIMEOUT", 300))
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = os.environ.get("FISCAL_ACCESS_LOG", "-")
+errorlog = "-"
+loglevel = os.environ.get("FISCAL_LOG_LEVEL", "info")
+
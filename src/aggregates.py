@@ -0,0 +1,476 @@
+# Agregados pré-calculados sobre o conjunto de dados carregado
+
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from dataset import FiscalDataset
+from fiscal_agent import CFOPClassifier
+from metrics import span
+from periods import NO_MONTH, month_keys
+from rules import UNCLASSIFIED_SECTOR
+from sketches import HeavyHitters, HyperLogLog, approximate_mode, configured_errors, hash_values
+
+SALES_CFOP_PREFIXES = ('5', '6', '7')
+PURCHASE_CFOP_PREFIXES = ('1', '2', '3')
+
+
+def _prefix_mask(cfops: pd.Series, prefixes: Tuple[str, ...]) -> np.ndarray:
+    """
+    Linhas cujo CFOP começa com um dos prefixos (testando só as categorias distintas).
+    """
+    if isinstance(cfops.dtype, pd.CategoricalDtype):
+        matches = cfops.cat.categories.astype(str).str.startswith(prefixes)
+        codes = cfops.cat.codes.to_numpy()
+        return np.append(matches, False)[codes]
+    return cfops.astype(str).str.startswith(prefixes).to_numpy()
+
+
+def _item_notes(df_itens: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray, Dict[str, np.ndarray]]:
+    """
+    Numera as notas dos itens: código da nota em cada linha (-1 sem chave),
+    primeira linha de cada nota e, por nota, se algum item tem CFOP de venda
+    ou de compra.
+    """
+    codes, keys = pd.factorize(df_itens['CHAVE DE ACESSO'])
+    # factorize numera as chaves na ordem em que aparecem pela primeira vez
+    seen = np.maximum.accumulate(codes) if len(codes) else codes
+    first_rows = np.flatnonzero(codes > np.concatenate(([-1], seen[:-1])))
+    operations = {}
+    for name, prefixes in (('documentos_venda', SALES_CFOP_PREFIXES),
+                           ('documentos_compra', PURCHASE_CFOP_PREFIXES)):
+        has = np.zeros(len(keys), dtype=bool)
+        matched = codes[_prefix_mask(df_itens['CFOP'], prefixes)]
+        has[matched[matched >= 0]] = True
+        operations[name] = has
+    return codes, first_rows, operations
+
+
+def _header_months(df_cabecalho: pd.DataFrame, keys: pd.Series) -> np.ndarray:
+    """
+    Mês de emissão de cada chave de acesso segundo o cabeçalho (NO_MONTH
+    para chaves que não estão nele).
+    """
+    header = df_cabecalho.drop_duplicates('CHAVE DE ACESSO')
+    positions = pd.Index(header['CHAVE DE ACESSO'].astype(str)).get_indexer(keys.astype(str))
+    return np.append(month_keys(header['DATA EMISSÃO']), NO_MONTH)[positions]
+
+
+def _note_months(df_cabecalho: pd.DataFrame, df_itens: pd.DataFrame, first_rows: np.ndarray) -> np.ndarray:
+    """
+    Mês de emissão de cada nota dos itens (pela primeira linha de cada uma),
+    lido do cabeçalho quando os itens não têm data de emissão.
+    """
+    if 'DATA EMISSÃO' in df_itens:
+        return month_keys(df_itens['DATA EMISSÃO'].iloc[first_rows])
+    return _header_months(df_cabecalho, df_itens['CHAVE DE ACESSO'].iloc[first_rows])
+
+
+def _monthly_rollup(df_cabecalho: pd.DataFrame, df_itens: pd.DataFrame,
+                    item_notes: Optional[Tuple]) -> Dict[int, Dict[str, float]]:
+    """
+    Totais por mês de emissão: notas e valor pelo cabeçalho; itens e
+    documentos de venda/compra (notas distintas por CFOP) pelos itens, com
+    o mês da nota no cabeçalho quando os itens não têm data de emissão.
+    """
+    meses = month_keys(df_cabecalho['DATA EMISSÃO'])
+    if 'VALOR NOTA FISCAL' in df_cabecalho:
+        valores = df_cabecalho['VALOR NOTA FISCAL'].to_numpy()
+    else:
+        valores = np.zeros(len(df_cabecalho))
+    notas = pd.DataFrame({'mes': meses, 'valor': valores}).groupby('mes')['valor'].agg(['size', 'sum'])
+    mensal = {
+        int(month): {'notas': int(row['size']), 'valor_total': float(row['sum']), 'itens': 0}
+        for month, row in notas.iterrows()
+    }
+    operations = {}
+    if item_notes is not None:
+        # Os itens de uma nota têm a data de emissão da nota: basta o mês da primeira linha de cada uma
+        codes, first_rows, operations = item_notes
+        note_months = _note_months(df_cabecalho, df_itens, first_rows)
+        item_months = np.append(note_months, NO_MONTH)[codes]
+    elif 'DATA EMISSÃO' in df_itens:
+        item_months = month_keys(df_itens['DATA EMISSÃO'])
+    else:
+        return mensal
+
+    empty = {'notas': 0, 'valor_total': 0.0, 'itens': 0, **{name: 0 for name in operations}}
+    for entry in mensal.values():
+        entry.update({name: 0 for name in operations})
+    for month, total in zip(*np.unique(item_months, return_counts=True)):
+        mensal.setdefault(int(month), dict(empty))['itens'] = int(total)
+    for name, has in operations.items():
+        for month, total in zip(*np.unique(note_months[has], return_counts=True)):
+            mensal.setdefault(int(month), dict(empty))[name] = int(total)
+    return dict(sorted(mensal.items()))
+
+
+class DatasetSketches:
+    """
+    Esboços da análise aproximada por mês de emissão (AAAAMM, sempre o da
+    nota no cabeçalho): documentos distintos de venda e de compra
+    (HyperLogLog) e maiores fornecedores por valor das notas (HeavyHitters).
+    São atualizados bloco a bloco durante a ingestão e combinados sob
+    demanda para qualquer período, sem reler as linhas; esboços de outro
+    worker ou partição se somam com `merge`.
+    """
+
+    DISTINCT = ('documentos_venda', 'documentos_compra')
+
+    def __init__(self, distinct_error: Optional[float] = None, topk_error: Optional[float] = None):
+        default_distinct, default_topk = configured_errors()
+        self.distinct_error = distinct_error or default_distinct
+        self.topk_error = topk_error or default_topk
+        self.months: Dict[int, Dict[str, object]] = {}
+
+    def _sketch(self, month: int, name: str):
+        sketches = self.months.setdefault(int(month), {})
+        sketch = sketches.get(name)
+        if sketch is None:
+            factory = HyperLogLog if name in self.DISTINCT else HeavyHitters
+            sketch = sketches[name] = factory.for_error(
+                self.distinct_error if name in self.DISTINCT else self.topk_error)
+        return sketch
+
+    @staticmethod
+    def _months(chunk: pd.DataFrame) -> np.ndarray:
+        if 'DATA EMISSÃO' in chunk:
+            return month_keys(chunk['DATA EMISSÃO'])
+        return np.full(len(chunk), NO_MONTH, dtype=np.int64)
+
+    def _add_weights(self, name: str, months: np.ndarray, names: pd.Series, weights: pd.Series):
+        totals = pd.DataFrame({'mes': months, 'nome': names.to_numpy(), 'peso': weights.to_numpy()}) \
+            .groupby(['mes', 'nome'], observed=True, sort=False)['peso'].sum()
+        for month, month_totals in totals.groupby(level=0, sort=False):
+            self._sketch(month, name).update(month_totals.droplevel(0))
+
+    def update_cabecalho(self, chunk: pd.DataFrame):
+        if {'RAZÃO SOCIAL EMITENTE', 'VALOR NOTA FISCAL'} <= set(chunk.columns) and len(chunk):
+            self._add_weights('fornecedores', self._months(chunk), chunk['RAZÃO SOCIAL EMITENTE'],
+                              chunk['VALOR NOTA FISCAL'])
+
+    def update_documentos(self, keys: pd.Series, months: np.ndarray, operations: Dict[str, np.ndarray]):
+        """
+        Chaves das notas com o mês de emissão (do cabeçalho) e, por operação
+        de DISTINCT, se a nota tem algum item dela.
+        """
+        hashes = hash_values(keys.to_numpy(dtype=object))
+        for name, has in operations.items():
+            matched, matched_months = hashes[has], months[has]
+            for month in np.unique(matched_months):
+                self._sketch(month, name).add_hashes(matched[matched_months == month])
+
+    def combined(self, name: str, months: Optional[Iterable[int]] = None):
+        """
+        Esboço `name` dos meses pedidos (todos, sem `months`) combinados em
+        uma cópia; None se nenhum mês tiver esse esboço.
+        """
+        selected = self.months if months is None else {month: self.months[month] for month in months
+                                                       if month in self.months}
+        result = None
+        for sketches in selected.values():
+            sketch = sketches.get(name)
+            if sketch is not None:
+                result = sketch.copy() if result is None else result.merge(sketch)
+        return result
+
+    def merge(self, other: "DatasetSketches") -> "DatasetSketches":
+        for month, sketches in other.months.items():
+            for name, sketch in sketches.items():
+                current = self.months.setdefault(month, {}).get(name)
+                self.months[month][name] = sketch.copy() if current is None else current.merge(sketch)
+        return self
+
+    def to_dict(self) -> Dict:
+        return {
+            "erro_distintos": self.distinct_error,
+            "erro_topk": self.topk_error,
+            "meses": {str(month): {name: sketch.to_dict() for name, sketch in sketches.items()}
+                      for month, sketches in self.months.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "DatasetSketches":
+        sketches = cls(data["erro_distintos"], data["erro_topk"])
+        for month, values in data["meses"].items():
+            sketches.months[int(month)] = {
+                name: (HyperLogLog if name in cls.DISTINCT else HeavyHitters).from_dict(value)
+                for name, value in values.items()
+            }
+        return sketches
+
+
+class DatasetAggregates:
+    """
+    Totais, rankings e contagens calculados uma única vez por versão do
+    conjunto de dados. As consultas e o endpoint de estatísticas apenas leem
+    estes valores.
+    """
+
+    def __init__(self, version: Optional[str] = None, top_n: int = 10):
+        self.version = version
+        self.top_n = top_n
+        self.total_notas = 0
+        self.total_itens = 0
+        self.valor_total = 0.0
+        self.valor_medio = 0.0
+        self.periodo_inicio = None
+        self.periodo_fim = None
+        self.top_fornecedores: Optional[List[Tuple[str, float]]] = None
+        self.top_itens: Optional[List[Tuple[str, float]]] = None
+        self.documentos_venda: Optional[int] = None
+        self.documentos_compra: Optional[int] = None
+        self.setores: Optional[List[str]] = None
+        # Por mês de emissão (AAAAMM): notas, valor_total, itens e, quando
+        # calculados em memória, documentos_venda e documentos_compra
+        self.mensal: Optional[Dict[int, Dict[str, float]]] = None
+        # Esboços da análise aproximada (FISCAL_APROXIMADO=1)
+        self.esbocos: Optional[DatasetSketches] = None
+
+    @classmethod
+    def from_dataset(cls, dataset: FiscalDataset, top_n: int = 10) -> "DatasetAggregates":
+        """
+        Calcula os agregados a partir de um conjunto já carregado em memória.
+        """
+        aggregates = cls(dataset.version, top_n)
+        with span("agregados"):
+            aggregates._compute(dataset)
+        return aggregates
+
+    def _compute(self, dataset: FiscalDataset):
+        df_cabecalho = dataset.df_cabecalho
+        df_itens = dataset.df_itens
+
+        self.total_notas = len(df_cabecalho)
+        self.total_itens = len(df_itens)
+
+        if 'VALOR NOTA FISCAL' in df_cabecalho:
+            valores = df_cabecalho['VALOR NOTA FISCAL']
+            self.valor_total = float(valores.sum())
+            self.valor_medio = float(valores.mean())
+
+        if 'DATA EMISSÃO' in df_cabecalho:
+            self.periodo_inicio = df_cabecalho['DATA EMISSÃO'].min()
+            self.periodo_fim = df_cabecalho['DATA EMISSÃO'].max()
+
+        if {'RAZÃO SOCIAL EMITENTE', 'VALOR NOTA FISCAL'} <= set(df_cabecalho.columns):
+            fornecedores = df_cabecalho.groupby('RAZÃO SOCIAL EMITENTE', observed=True)['VALOR NOTA FISCAL'].sum()
+            self.top_fornecedores = list(fornecedores.nlargest(self.top_n).items())
+
+        if {'DESCRIÇÃO DO PRODUTO/SERVIÇO', 'QUANTIDADE'} <= set(df_itens.columns):
+            produtos = df_itens.groupby('DESCRIÇÃO DO PRODUTO/SERVIÇO', observed=True)['QUANTIDADE'].sum()
+            self.top_itens = list(produtos.nlargest(self.top_n).items())
+
+        item_notes = None
+        if {'CFOP', 'CHAVE DE ACESSO'} <= set(df_itens.columns):
+            item_notes = _item_notes(df_itens)
+            operations = item_notes[2]
+            self.documentos_venda = int(operations['documentos_venda'].sum())
+            self.documentos_compra = int(operations['documentos_compra'].sum())
+
+        if 'DATA EMISSÃO' in df_cabecalho:
+            self.mensal = _monthly_rollup(df_cabecalho, df_itens, item_notes)
+
+        if 'CÓDIGO NCM/SH' in df_itens:
+            setores = CFOPClassifier().classify_sector_column(df_itens['CÓDIGO NCM/SH'])
+            self.setores = [s for s in setores.unique() if s != UNCLASSIFIED_SECTOR]
+
+        if approximate_mode():
+            # As tabelas inteiras entram como um único bloco
+            with span("esbocos"):
+                self.esbocos = DatasetSketches()
+                self.esbocos.update_cabecalho(df_cabecalho)
+                if item_notes is not None and ('DATA EMISSÃO' in df_itens or 'DATA EMISSÃO' in df_cabecalho):
+                    _, first_rows, operations = item_notes
+                    self.esbocos.update_documentos(df_itens['CHAVE DE ACESSO'].iloc[first_rows],
+                                                   _note_months(df_cabecalho, df_itens, first_rows), operations)
+
+    def to_dict(self) -> Dict:
+        """
+        Agregados serializáveis em JSON, para que outros processos os restaurem sem recalcular.
+        """
+        data = dict(vars(self))
+        if self.esbocos is not None:
+            data['esbocos'] = self.esbocos.to_dict()
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "DatasetAggregates":
+        aggregates = cls()
+        for name, value in data.items():
+            if name in ('top_fornecedores', 'top_itens') and value is not None:
+                value = [tuple(pair) for pair in value]
+            if name == 'mensal' and value is not None:
+                # O JSON guarda as chaves como texto
+                value = {int(month): totals for month, totals in value.items()}
+            if name == 'esbocos' and value is not None:
+                value = DatasetSketches.from_dict(value)
+            setattr(aggregates, name, value)
+        return aggregates
+
+    def stats(self) -> Dict:
+        """
+        Estatísticas gerais no formato do endpoint /api/stats.
+        """
+        return {
+            "total_notas": self.total_notas,
+            "total_itens": self.total_itens,
+            "valor_total": self.valor_total,
+            "valor_medio": self.valor_medio,
+        }
+
+
+# Contadores dos maiores fornecedores e produtos na ingestão em streaming:
+# exatos até esse número de nomes distintos e, acima dele, aproximados pelo
+# HeavyHitters (erro de no máximo total/(TOP_CAPACITY+1))
+TOP_CAPACITY = 1000
+
+
+class IncrementalAggregates:
+    """
+    Acumula os agregados bloco a bloco durante a ingestão em streaming,
+    sem manter as tabelas completas em memória (nem todos os nomes de
+    fornecedores e produtos).
+    """
+
+    def __init__(self, version: str, top_n: int = 10):
+        self.version = version
+        self.top_n = top_n
+        self.classifier = CFOPClassifier()
+        self.total_notas = 0
+        self.total_itens = 0
+        self.valor_total = 0.0
+        self.valor_count = 0
+        self.periodo_inicio = None
+        self.periodo_fim = None
+        self.fornecedores = HeavyHitters(TOP_CAPACITY)
+        self.produtos = HeavyHitters(TOP_CAPACITY)
+        self.setores: Dict[str, None] = {}  # dict preserva a ordem de aparição
+        self.mensal: Dict[int, Dict[str, float]] = {}
+        self.esbocos = DatasetSketches() if approximate_mode() else None
+
+    def _add_monthly(self, name: str, totals: pd.Series):
+        for month, value in totals.items():
+            entry = self.mensal.setdefault(int(month), {'notas': 0, 'valor_total': 0.0, 'itens': 0})
+            entry[name] = entry.get(name, 0) + (value.item() if hasattr(value, 'item') else value)
+
+    def update_cabecalho(self, chunk: pd.DataFrame):
+        self.total_notas += len(chunk)
+
+        if 'VALOR NOTA FISCAL' in chunk:
+            valores = chunk['VALOR NOTA FISCAL']
+            self.valor_total += float(valores.sum())
+            self.valor_count += int(valores.count())
+
+        if 'DATA EMISSÃO' in chunk and not chunk.empty:
+            inicio, fim = chunk['DATA EMISSÃO'].min(), chunk['DATA EMISSÃO'].max()
+            self.periodo_inicio = inicio if self.periodo_inicio is None else min(self.periodo_inicio, inicio)
+            self.periodo_fim = fim if self.periodo_fim is None else max(self.periodo_fim, fim)
+
+        if {'RAZÃO SOCIAL EMITENTE', 'VALOR NOTA FISCAL'} <= set(chunk.columns):
+            parcial = chunk.groupby('RAZÃO SOCIAL EMITENTE', observed=True)['VALOR NOTA FISCAL'].sum()
+            self.fornecedores.update(parcial)
+
+        if 'DATA EMISSÃO' in chunk:
+            meses = month_keys(chunk['DATA EMISSÃO'])
+            self._add_monthly('notas', pd.Series(meses).value_counts())
+            if 'VALOR NOTA FISCAL' in chunk:
+                valores = chunk['VALOR NOTA FISCAL'].to_numpy()
+                self._add_monthly('valor_total', pd.Series(valores).groupby(meses).sum())
+
+        if self.esbocos is not None:
+            self.esbocos.update_cabecalho(chunk)
+
+    def update_itens(self, chunk: pd.DataFrame):
+        self.total_itens += len(chunk)
+
+        if {'DESCRIÇÃO DO PRODUTO/SERVIÇO', 'QUANTIDADE'} <= set(chunk.columns):
+            parcial = chunk.groupby('DESCRIÇÃO DO PRODUTO/SERVIÇO', observed=True)['QUANTIDADE'].sum()
+            self.produtos.update(parcial)
+
+        if 'CÓDIGO NCM/SH' in chunk:
+            for setor in self.classifier.classify_sector_column(chunk['CÓDIGO NCM/SH']).unique():
+                if setor != UNCLASSIFIED_SECTOR:
+                    self.setores.setdefault(setor)
+
+    def update_notas(self, chunk: pd.DataFrame):
+        """
+        Itens e documentos de venda/compra por mês de emissão, a partir de um
+        bloco do cabeçalho junto aos itens consolidados da nota (colunas
+        'itens', 'has_venda' e 'has_compra'): o mês vem sempre do cabeçalho,
+        tenham os itens data de emissão ou não.
+        """
+        if 'DATA EMISSÃO' not in chunk or chunk.empty:
+            return
+        meses = month_keys(chunk['DATA EMISSÃO'])
+        for name, column in (('itens', 'itens'), ('documentos_venda', 'has_venda'),
+                             ('documentos_compra', 'has_compra')):
+            self._add_monthly(name, chunk[column].fillna(0).astype(np.int64).groupby(meses).sum())
+        if self.esbocos is not None:
+            self.esbocos.update_documentos(chunk['CHAVE DE ACESSO'], meses, {
+                'documentos_venda': chunk['has_venda'].fillna(0).to_numpy() > 0,
+                'documentos_compra': chunk['has_compra'].fillna(0).to_numpy() > 0,
+            })
+
+    def result(self, documentos_venda: Optional[int] = None,
+               documentos_compra: Optional[int] = None) -> DatasetAggregates:
+        """
+        Produz os agregados finais no mesmo formato do cálculo em memória.
+        """
+        aggregates = DatasetAggregates(self.version, self.top_n)
+        aggregates.total_notas = self.total_notas
+        aggregates.total_itens = self.total_itens
+        aggregates.valor_total = self.valor_total
+        aggregates.valor_medio = self.valor_total / self.valor_count if self.valor_count else 0.0
+        aggregates.periodo_inicio = self.periodo_inicio
+        aggregates.periodo_fim = self.periodo_fim
+        aggregates.top_fornecedores = [(name, value) for name, value, _ in self.fornecedores.top(self.top_n)]
+        aggregates.top_itens = [(name, value) for name, value, _ in self.produtos.top(self.top_n)]
+        aggregates.documentos_venda = documentos_venda
+        aggregates.documentos_compra = documentos_compra
+        aggregates.setores = list(self.setores)
+        aggregates.mensal = dict(sorted(self.mensal.items()))
+        aggregates.esbocos = self.esbocos
+        return aggregates
+
+
+_cache: Dict[str, DatasetAggregates] = {}
+_cache_lock = threading.Lock()
+
+
+def get_aggregates(dataset: FiscalDataset) -> DatasetAggregates:
+    """
+    Retorna os agregados da versão atual do conjunto, calculando-os na primeira chamada.
+    """
+    dataset.load()
+    aggregates = _cache.get(dataset.version)
+    if aggregates is not None:
+        return aggregates
+
+    with _cache_lock:
+        aggregates = _cache.get(dataset.version)
+        if aggregates is None:
+            aggregates = DatasetAggregates.from_dataset(dataset)
+            _cache[dataset.version] = aggregates
+        return aggregates
+
+
+def register_aggregates(aggregates: DatasetAggregates):
+    """
+    Registra agregados calculados fora da memória (ingestão em streaming).
+    """
+    with _cache_lock:
+        _cache[aggregates.version] = aggregates
+
+
+def invalidate_aggregates(version: Optional[str] = None):
+    """
+    Descarta os agregados de uma versão ou, sem argumento, de todas.
+    """
+    with _cache_lock:
+        if version is None:
+            _cache.clear()
+        else:
+            _cache.pop(version, None)
@@ -0,0 +1,127 @@
+# Cache de respostas das perguntas em linguagem natural
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Tuple
+
+from intents import normalize_question
+from metrics import COUNTER, GAUGE, get_metrics
+
+# Tamanho máximo e validade (segundos) do cache, configuráveis por variável de ambiente
+CACHE_SIZE_ENV = "FISCAL_ANSWER_CACHE_SIZE"
+CACHE_TTL_ENV = "FISCAL_ANSWER_CACHE_TTL"
+DEFAULT_CACHE_SIZE = 1024
+DEFAULT_CACHE_TTL = 600.0
+
+CacheKey = Tuple[str, Hashable, str]
+
+
+class AnswerCache:
+    """
+    Cache LRU com validade (TTL) de respostas, indexado pela pergunta
+    normalizada e pela versão dos dados que a respondem. Uma nova versão
+    (novo upload ou nova gravação de documentos) nunca reaproveita respostas
+    antigas; `invalidate` libera as entradas de uma versão descartada.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_CACHE_SIZE, ttl: float = DEFAULT_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[CacheKey, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def key(scope: str, version: Hashable, question: str) -> CacheKey:
+        """
+        Chave da resposta: quem responde, versão dos dados e a pergunta sem
+        acentos, maiúsculas, espaços repetidos ou pontuação final.
+        """
+        return scope, version, normalize_question(question).rstrip("?!. ")
+
+    def get(self, key: CacheKey) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: CacheKey, answer: str):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, answer)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, version: Optional[Hashable] = None, scope: Optional[str] = None):
+        """
+        Descarta as respostas de uma versão dos dados e/ou de um escopo ou, sem argumentos, todas.
+        """
+        with self._lock:
+            if version is None and scope is None:
+                self._entries.clear()
+                return
+            stale = [
+                key for key in self._entries
+                if (version is None or key[1] == version) and (scope is None or key[0] == scope)
+            ]
+            for key in stale:
+                del self._entries[key]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "entradas": len(self._entries),
+                "capacidade": self.max_entries,
+                "ttl_segundos": self.ttl,
+                "acertos": self.hits,
+                "falhas": self.misses,
+                "taxa_acerto": self.hits / requests if requests else 0.0,
+                "descartes_lru": self.evictions,
+                "expiradas": self.expirations,
+            }
+
+
+_answer_cache = AnswerCache(
+    int(os.environ.get(CACHE_SIZE_ENV, DEFAULT_CACHE_SIZE)),
+    float(os.environ.get(CACHE_TTL_ENV, DEFAULT_CACHE_TTL)),
+)
+
+
+def get_answer_cache() -> AnswerCache:
+    """
+    Cache de respostas compartilhado pelos agentes do processo.
+    """
+    return _answer_cache
+
+
+def _collect_metrics():
+    stats = _answer_cache.stats()
+    return [
+        ("fiscal_cache_respostas_acertos_total", COUNTER, stats["acertos"], {}),
+        ("fiscal_cache_respostas_falhas_total", COUNTER, stats["falhas"], {}),
+        ("fiscal_cache_respostas_descartes_total", COUNTER, stats["descartes_lru"] + stats["expiradas"], {}),
+        ("fiscal_cache_respostas_entradas", GAUGE, stats["entradas"], {}),
+    ]
+
+
+_metrics = get_metrics()
+_metrics.describe("fiscal_cache_respostas_acertos_total", "Perguntas respondidas pelo cache de respostas")
+_metrics.describe("fiscal_cache_respostas_falhas_total", "Perguntas não encontradas no cache de respostas")
+_metrics.describe("fiscal_cache_respostas_descartes_total", "Respostas descartadas do cache (LRU ou validade)")
+_metrics.describe("fiscal_cache_respostas_entradas", "Respostas no cache")
+_metrics.register_collector(_collect_metrics)
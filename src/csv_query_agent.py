@@ -1,176 +1,459 @@
+import datetime
 import pandas as pd
-import os
-from langchain.llms.base import LLM
-from langchain.callbacks.manager import CallbackManagerForLLMRun
-from typing import Optional, List, Any
+from typing import TYPE_CHECKING, Dict, Optional
 
-class MockLLM(LLM):
+from aggregates import DatasetAggregates, get_aggregates
+from answer_cache import get_answer_cache
+from dataset import FiscalDataset
+from intents import (
+    MONTHS, TARGET_QUERY, UFS, IntentMatch, any_of, contains, get_intent_registry, method, parse_month, register_intent,
+)
+from metrics import count, span
+from periods import NO_MONTH, Period
+from sketches import CONFIDENCE
+
+# O motor de LLM (e com ele o langchain) só é importado na primeira pergunta livre
+if TYPE_CHECKING:
+    from llm_agent import LLMQueryEngine
+
+
+class UncachedAnswer(Exception):
     """
-    Mock LLM para demonstração sem necessidade de API keys.
+    Resposta devolvida ao usuário sem entrar no cache (orçamento do LLM excedido).
     """
-    @property
-    def _llm_type(self) -> str:
-        return "mock"
-    
-    def _call(
-        self,
-        prompt: str,
-        stop: Optional[List[str]] = None,
-        run_manager: Optional[CallbackManagerForLLMRun] = None,
-        **kwargs: Any,
-    ) -> str:
-        return "Análise genérica..."
+
 
 class CSVQueryAgent:
     """
     Agente para responder perguntas sobre dados CSV usando lógica baseada em regras.
     """
     
-    def __init__(self, cabecalho_path: str, itens_path: str):
+    def __init__(self, cabecalho_path: str, itens_path: str, dataset: FiscalDataset = None,
+                 aggregates: DatasetAggregates = None):
         self.cabecalho_path = cabecalho_path
         self.itens_path = itens_path
+        self.dataset = dataset or FiscalDataset(cabecalho_path, itens_path)
+        # Agregados fornecidos pela ingestão em streaming dispensam carregar as tabelas
+        self._aggregates = aggregates
         self.df_cabecalho = None
         self.df_itens = None
-        self.df_consolidated = None
-        self.llm = MockLLM()
+        self._df_consolidated = None
+        self._llm_engine: Optional["LLMQueryEngine"] = None
 
     def load_data(self):
         """
         Carrega os dados dos arquivos CSV somente se ainda não foram carregados.
         """
+        if self._aggregates is not None:
+            return
+
         if self.df_cabecalho is not None and self.df_itens is not None:
             return
 
-        if os.path.exists(self.cabecalho_path):
-            self.df_cabecalho = pd.read_csv(self.cabecalho_path, sep=',', decimal='.')
-        else:
+        try:
+            self.dataset.load()
+            self.df_cabecalho = self.dataset.df_cabecalho
+            self.df_itens = self.dataset.df_itens
+        except FileNotFoundError:
             self.df_cabecalho = pd.DataFrame()
-
-        if os.path.exists(self.itens_path):
-            self.df_itens = pd.read_csv(self.itens_path, sep=',', decimal='.')
-        else:
             self.df_itens = pd.DataFrame()
-        
-        if not self.df_cabecalho.empty and not self.df_itens.empty:
-            self.df_consolidated = pd.merge(
-                self.df_cabecalho, self.df_itens,
-                on='CHAVE DE ACESSO', how='inner', suffixes=('_cab', '_item')
-            )
-        else:
-            self.df_consolidated = self.df_cabecalho.copy()
+
+    def release_data(self):
+        """
+        Solta as referências às tabelas para que possam ser liberadas da memória.
+        """
+        self.df_cabecalho = None
+        self.df_itens = None
+        self._df_consolidated = None
+
+    @property
+    def df_consolidated(self) -> pd.DataFrame:
+        """
+        Junção de cabeçalho e itens, construída apenas quando for usada.
+        """
+        if self._df_consolidated is None:
+            self.load_data()
+            if self._aggregates is not None:
+                raise ValueError("Dados ingeridos em streaming não ficam disponíveis em memória.")
+            if not self.df_cabecalho.empty and not self.df_itens.empty:
+                with span("merge"):
+                    self._df_consolidated = pd.merge(
+                        self.df_cabecalho, self.df_itens,
+                        on='CHAVE DE ACESSO', how='inner', suffixes=('_cab', '_item')
+                    )
+            else:
+                self._df_consolidated = self.df_cabecalho.copy()
+        return self._df_consolidated
+
+    @property
+    def version(self) -> str:
+        """
+        Versão dos dados que respondem às perguntas (chave do cache de respostas).
+        """
+        if self._aggregates is not None:
+            return self._aggregates.version
+        if self.dataset.version is None:
+            self.dataset.load()
+        return self.dataset.version
+
+    def _has_data(self) -> bool:
+        if self._aggregates is not None:
+            return self._aggregates.total_notas > 0
+        return not self.df_cabecalho.empty
             
-    def query_data(self, question: str) -> str:
+    def query_data(self, question: str, match: IntentMatch = None) -> str:
         """
-        Responde a uma pergunta sobre os dados usando uma série de regras.
+        Responde a uma pergunta sobre os dados pela intenção reconhecida no
+        registro (ou pela intenção já reconhecida no roteamento, em `match`).
         """
+        # Respostas em cache dispensam até carregar as tabelas
+        cache = get_answer_cache()
+        try:
+            cache_key = cache.key(TARGET_QUERY, self.version, question)
+        except FileNotFoundError:
+            cache_key = None
+        answer = cache.get(cache_key) if cache_key else None
+        if answer is not None:
+            return answer
+
         self.load_data()
 
-        if self.df_cabecalho.empty:
+        if not self._has_data():
             return "Nenhum dado para analisar. Por favor, faça o upload de um arquivo primeiro."
-            
+
         try:
-            question_lower = question.lower()
-            
-            if "fornecedor" in question_lower and "maior" in question_lower:
-                return self._get_top_supplier()
-            elif "item" in question_lower and ("maior volume" in question_lower or "mais entregue" in question_lower):
-                return self._get_top_item_by_volume()
-            elif "valor total" in question_lower:
-                return self._get_total_invoice_value()
-            elif "valor médio" in question_lower:
-                return self._get_average_invoice_value()
-            elif "quantos documentos" in question_lower and "venda" in question_lower:
-                return self._get_sales_document_count()
-            elif "quantos documentos" in question_lower and "compra" in question_lower:
-                return self._get_purchase_document_count()
-            elif "setores" in question_lower:
-                return self._get_unique_sectors()
-            else:
-                return self._general_analysis(question)
-                
+            with span("consulta"):
+                if match is None or match.intent.target != TARGET_QUERY:
+                    match = get_intent_registry().match(question, target=TARGET_QUERY)
+                if match is None:
+                    answer = self._free_form_answer(question)
+                else:
+                    answer = match.dispatch(self)
+            if cache_key:
+                cache.put(cache_key, answer)
+            return answer
+
+        except UncachedAnswer as e:
+            # Não vai para o cache: a próxima tentativa pode caber no orçamento
+            return str(e)
         except Exception as e:
             return f"Erro ao processar a pergunta: {str(e)}"
     
-    def _get_top_supplier(self) -> str:
-        fornecedores = self.df_cabecalho.groupby('RAZÃO SOCIAL EMITENTE')['VALOR NOTA FISCAL'].sum().sort_values(ascending=False)
-        top_supplier = fornecedores.head(1)
-        if top_supplier.empty:
+    @property
+    def aggregates(self) -> DatasetAggregates:
+        """
+        Agregados pré-calculados da versão atual do conjunto de dados.
+        """
+        if self._aggregates is not None:
+            return self._aggregates
+        return get_aggregates(self.dataset)
+
+    def _default_year(self) -> int:
+        """
+        Ano das perguntas que citam só o mês ou o trimestre: o mais recente dos dados.
+        """
+        months = [month for month in (self.aggregates.mensal or {}) if month != NO_MONTH]
+        if months:
+            return max(months) // 100
+        fim = str(self.aggregates.periodo_fim or "")
+        return int(fim[:4]) if fim[:4].isdigit() else datetime.date.today().year
+
+    def _period_rollup(self, periodo: Period) -> Optional[Dict[str, float]]:
+        """
+        Soma dos agregados mensais pré-calculados dentro do período.
+        """
+        mensal = self.aggregates.mensal
+        if mensal is None:
+            return None
+        start, end = periodo.months(self._default_year())
+        totals: Dict[str, float] = {}
+        for month, values in mensal.items():
+            if start <= month < end:
+                for name, value in values.items():
+                    totals[name] = totals.get(name, 0) + value
+        for name in ('notas', 'valor_total', 'itens'):
+            totals.setdefault(name, 0)
+        return totals
+
+    def _period_label(self, periodo: Period) -> str:
+        return periodo.label(self._default_year())
+
+    def _sketch_months(self, mes: int = None, periodo: Period = None):
+        """
+        Meses com esboços dentro do mês de emissão (de qualquer ano) ou do período.
+        """
+        months = self.aggregates.esbocos.months
+        if mes is not None:
+            return [month for month in months if month != NO_MONTH and month % 100 == mes]
+        start, end = periodo.months(self._default_year())
+        return [month for month in months if start <= month < end]
+
+    @staticmethod
+    def _approximate_value(lower: float, upper: float) -> str:
+        if upper == lower:
+            return f"R$ {lower:,.2f}"
+        return f"entre R$ {lower:,.2f} e R$ {upper:,.2f}"
+
+    @staticmethod
+    def _ranking_note(sketch, n: int) -> str:
+        if sketch.offset == 0:
+            return "Ranking calculado pelos esboços da análise aproximada, sem erro neste período."
+        if sketch.guaranteed(n):
+            return "Valores aproximados; a ordem do ranking é exata."
+        return f"Valores aproximados; a ordem pode diferir em até R$ {sketch.offset:,.2f} por fornecedor."
+
+    def _approximate_top_supplier(self, periodo: Period) -> str:
+        count("fiscal_respostas_aproximadas_total", consulta="maior_fornecedor")
+        sketch = self.aggregates.esbocos.combined('fornecedores', self._sketch_months(periodo=periodo))
+        top_suppliers = sketch.top(1) if sketch is not None else []
+        if not top_suppliers:
+            return f"Nenhuma nota fiscal foi emitida {self._period_label(periodo)}."
+        name, lower, upper = top_suppliers[0]
+        return (f"O fornecedor com maior montante recebido {self._period_label(periodo)} é {name} "
+                f"com um total {'de ' if upper == lower else ''}{self._approximate_value(lower, upper)}. "
+                f"{self._ranking_note(sketch, 1)}")
+
+    def _get_top_supplier(self, periodo: Period = None) -> str:
+        if periodo is not None and self.aggregates.esbocos is not None:
+            return self._approximate_top_supplier(periodo)
+        if periodo is not None:
+            if self._aggregates is not None:
+                return "Consultas por período não estão disponíveis para dados ingeridos em streaming."
+            top_suppliers = self._suppliers_in_months(1, months=self._months_in(periodo))
+            if not top_suppliers:
+                return f"Nenhuma nota fiscal foi emitida {self._period_label(periodo)}."
+            name, total = top_suppliers[0]
+            return (f"O fornecedor com maior montante recebido {self._period_label(periodo)} é {name} "
+                    f"com um total de R$ {total:,.2f}.")
+
+        top_suppliers = self.aggregates.top_fornecedores
+        if not top_suppliers:
             return "Não foi possível encontrar o fornecedor com maior montante."
-        return f"O fornecedor com maior montante recebido é {top_supplier.index[0]} com um total de R$ {top_supplier.iloc[0]:,.2f}."
+        name, total = top_suppliers[0]
+        return f"O fornecedor com maior montante recebido é {name} com um total de R$ {total:,.2f}."
+
+    def _months_in(self, periodo: Period):
+        start, end = periodo.months(self._default_year())
+        return [month for month in self.dataset.month_partitions() if start <= month < end]
+
+    def _suppliers_in_months(self, n: int, uf: str = None, months=None):
+        """
+        Ranking calculado só sobre as linhas dos meses pedidos (todas, sem `months`);
+        None em streaming, quando as linhas não ficam em memória.
+        """
+        if self._aggregates is not None:
+            return None
+        df = self.df_cabecalho if months is None else self.dataset.header_rows(months)
+        if uf is not None:
+            df = df[df['UF EMITENTE'] == uf]
+        fornecedores = df.groupby('RAZÃO SOCIAL EMITENTE', observed=True)['VALOR NOTA FISCAL'].sum()
+        return list(fornecedores.nlargest(n).items())
+
+    def _get_top_suppliers(self, n: int, uf: str = None, mes: int = None, periodo: Period = None) -> str:
+        """
+        Os N fornecedores de maior valor, opcionalmente filtrados por UF do
+        emitente e por mês de emissão (de qualquer ano) ou período.
+        """
+        if mes is not None:
+            periodo = None
+        filtered = uf is not None or mes is not None or periodo is not None
+        if uf is None and (filtered or n > self.aggregates.top_n) and self.aggregates.esbocos is not None:
+            return self._approximate_top_suppliers(n, mes, periodo)
+        if self._aggregates is not None or (not filtered and n <= self.aggregates.top_n):
+            if filtered:
+                return "Filtros por UF, mês ou período não estão disponíveis para dados ingeridos em streaming."
+            top_suppliers = self.aggregates.top_fornecedores or []
+        else:
+            months = None
+            if mes is not None:
+                months = [month for month in self.dataset.month_partitions() if month % 100 == mes]
+            elif periodo is not None:
+                months = self._months_in(periodo)
+            top_suppliers = self._suppliers_in_months(n, uf, months)
+
+        filters = "".join([
+            f" em {uf}" if uf else "",
+            f" no mês {mes}" if mes else "",
+            f" {self._period_label(periodo)}" if periodo is not None else "",
+        ])
+        if not top_suppliers:
+            return f"Nenhum fornecedor encontrado{filters}."
+        lines = [f"{i}. {name}: R$ {total:,.2f}" for i, (name, total) in enumerate(top_suppliers[:n], 1)]
+        return f"Top {n} fornecedores{filters}:\n" + "\n".join(lines)
+
+    def _approximate_top_suppliers(self, n: int, mes: int = None, periodo: Period = None) -> str:
+        """
+        Ranking pelos esboços dos meses pedidos, sem reler as linhas: cada
+        valor vem como intervalo [mínimo, máximo].
+        """
+        count("fiscal_respostas_aproximadas_total", consulta="fornecedores")
+        months = None if mes is None and periodo is None else self._sketch_months(mes, periodo)
+        sketch = self.aggregates.esbocos.combined('fornecedores', months)
+        filters = "".join([
+            f" no mês {mes}" if mes else "",
+            f" {self._period_label(periodo)}" if periodo is not None else "",
+        ])
+        top_suppliers = sketch.top(n) if sketch is not None else []
+        if not top_suppliers:
+            return f"Nenhum fornecedor encontrado{filters}."
+        lines = [f"{i}. {name}: {self._approximate_value(lower, upper)}"
+                 for i, (name, lower, upper) in enumerate(top_suppliers, 1)]
+        return (f"Top {n} fornecedores{filters}:\n" + "\n".join(lines)
+                + f"\n{self._ranking_note(sketch, len(top_suppliers))}")
 
     def _get_top_item_by_volume(self) -> str:
-        if self.df_itens.empty:
+        if self.aggregates.total_itens == 0:
             return "Não há dados de itens para analisar o volume."
-        produtos = self.df_itens.groupby('DESCRIÇÃO DO PRODUTO/SERVIÇO')['QUANTIDADE'].sum().sort_values(ascending=False)
-        top_product = produtos.head(1)
-        if top_product.empty:
+        top_items = self.aggregates.top_itens
+        if not top_items:
             return "Não foi possível encontrar o item com maior volume."
-        return f"O item com maior volume entregue é {top_product.index[0]} com um total de {int(top_product.iloc[0])} unidades."
+        name, quantity = top_items[0]
+        return f"O item com maior volume entregue é {name} com um total de {int(quantity)} unidades."
 
-    def _get_total_invoice_value(self) -> str:
-        total_value = self.df_cabecalho['VALOR NOTA FISCAL'].sum()
-        return f"O valor total de todas as notas fiscais é de R$ {total_value:,.2f}."
+    def _get_invoice_count(self, periodo: Period = None) -> str:
+        if periodo is None:
+            return f"Foram encontradas {self.aggregates.total_notas} notas fiscais."
+        totals = self._period_rollup(periodo)
+        if totals is None:
+            return "Não há datas de emissão para consultar por período."
+        return f"Foram encontradas {totals['notas']} notas fiscais emitidas {self._period_label(periodo)}."
 
-    def _get_average_invoice_value(self) -> str:
-        mean_value = self.df_cabecalho['VALOR NOTA FISCAL'].mean()
-        return f"O valor médio por nota fiscal é de R$ {mean_value:,.2f}."
+    def _get_total_invoice_value(self, periodo: Period = None) -> str:
+        if periodo is None:
+            total_value = self.aggregates.valor_total
+            return f"O valor total de todas as notas fiscais é de R$ {total_value:,.2f}."
+        totals = self._period_rollup(periodo)
+        if totals is None:
+            return "Não há datas de emissão para consultar por período."
+        return f"O valor total das notas fiscais emitidas {self._period_label(periodo)} é de R$ {totals['valor_total']:,.2f}."
 
-    def _get_sales_document_count(self) -> str:
-        if self.df_itens.empty:
-            return "Não há dados de itens para classificar as operações."
-        sales_cfops = self.df_itens['CFOP'].astype(str).str.startswith(('5', '6', '7'))
-        unique_invoices = self.df_itens[sales_cfops]['CHAVE DE ACESSO'].nunique()
-        return f"Foram encontrados {unique_invoices} documentos de venda."
+    def _get_average_invoice_value(self, periodo: Period = None) -> str:
+        if periodo is None:
+            mean_value = self.aggregates.valor_medio
+            return f"O valor médio por nota fiscal é de R$ {mean_value:,.2f}."
+        totals = self._period_rollup(periodo)
+        if totals is None:
+            return "Não há datas de emissão para consultar por período."
+        if not totals['notas']:
+            return f"Nenhuma nota fiscal foi emitida {self._period_label(periodo)}."
+        mean_value = totals['valor_total'] / totals['notas']
+        return f"O valor médio por nota fiscal emitida {self._period_label(periodo)} é de R$ {mean_value:,.2f}."
 
-    def _get_purchase_document_count(self) -> str:
-        if self.df_itens.empty:
+    def _count_operation(self, name: str, kind: str, periodo: Optional[Period]) -> str:
+        """
+        Documentos distintos de venda ou compra, no total ou no período.
+        """
+        unique_invoices = getattr(self.aggregates, name)
+        if self.aggregates.total_itens == 0 or unique_invoices is None:
             return "Não há dados de itens para classificar as operações."
-        purchase_cfops = self.df_itens['CFOP'].astype(str).str.startswith(('1', '2', '3'))
-        unique_invoices = self.df_itens[purchase_cfops]['CHAVE DE ACESSO'].nunique()
-        return f"Foram encontrados {unique_invoices} documentos de compra."
+        if periodo is None:
+            return f"Foram encontrados {unique_invoices} documentos de {kind}."
+        totals = self._period_rollup(periodo)
+        if totals is None:
+            return "Não há datas de emissão para consultar por período."
+        if not any(name in values for values in self.aggregates.mensal.values()):
+            # Sem o mês das notas dos itens, zero seria uma resposta errada
+            if self.aggregates.esbocos is not None:
+                return self._approximate_operation_count(name, kind, periodo)
+            return "A contagem de operações por período não está disponível: não foi possível obter o mês de emissão dos itens."
+        return f"Foram encontrados {totals.get(name, 0)} documentos de {kind} {self._period_label(periodo)}."
+
+    def _approximate_operation_count(self, name: str, kind: str, periodo: Period) -> str:
+        """
+        Contagem de documentos distintos pelo HyperLogLog dos meses do período,
+        com o intervalo de confiança.
+        """
+        count("fiscal_respostas_aproximadas_total", consulta=name)
+        sketch = self.aggregates.esbocos.combined(name, self._sketch_months(periodo=periodo))
+        if sketch is None:
+            return f"Foram encontrados 0 documentos de {kind} {self._period_label(periodo)}."
+        estimate, lower, upper = sketch.interval()
+        return (f"Foram encontrados aproximadamente {estimate} documentos de {kind} {self._period_label(periodo)} "
+                f"(entre {lower} e {upper}, com {CONFIDENCE:.0%} de confiança).")
+
+    def _get_sales_document_count(self, periodo: Period = None) -> str:
+        return self._count_operation('documentos_venda', 'venda', periodo)
+
+    def _get_purchase_document_count(self, periodo: Period = None) -> str:
+        return self._count_operation('documentos_compra', 'compra', periodo)
         
     def _get_unique_sectors(self) -> str:
-        if self.df_itens.empty:
+        sectors = self.aggregates.setores
+        if self.aggregates.total_itens == 0 or sectors is None:
             return "Não há dados de itens para classificar os setores."
         
-        sector_rules = {
-            "49": "Editorial/Gráfico", "85": "Eletrônicos/Elétricos", "73": "Metalúrgico",
-            "39": "Plásticos", "84": "Máquinas e Equipamentos", "87": "Veículos",
-            "90": "Instrumentos de Precisão"
-        }
-        
-        def classify_sector(ncm_code: str) -> str:
-            ncm_str = str(ncm_code)
-            for prefix, sector in sector_rules.items():
-                if ncm_str.startswith(prefix):
-                    return sector
-            return None
-
-        sectors = self.df_itens['CÓDIGO NCM/SH'].apply(classify_sector).dropna().unique()
-        
         if len(sectors) == 0:
             return "Nenhum setor conhecido foi identificado nos produtos."
             
         return f"Os setores encontrados nos documentos são: {', '.join(sectors)}."
 
+    @property
+    def llm_engine(self) -> "LLMQueryEngine":
+        if self._llm_engine is None:
+            from llm_agent import get_llm_engine
+            self._llm_engine = get_llm_engine()
+        return self._llm_engine
+
+    def _free_form_answer(self, question: str) -> str:
+        """
+        Pergunta sem intenção reconhecida: o LLM gera e executa código pandas
+        sobre as tabelas; sem resposta do modelo (ou em streaming), resumo geral.
+        """
+        if self._aggregates is None:
+            from llm_agent import BudgetExceeded
+            try:
+                answer = self.llm_engine.answer(question, self.version, self.df_cabecalho, self.df_itens)
+            except BudgetExceeded as e:
+                raise UncachedAnswer(str(e)) from e
+            if answer is not None:
+                return answer
+        return self._general_analysis(question)
+
     def _general_analysis(self, question: str) -> str:
-        total_notas = len(self.df_cabecalho)
-        total_itens = len(self.df_itens)
-        valor_total = self.df_cabecalho['VALOR NOTA FISCAL'].sum()
-        periodo_inicio = self.df_cabecalho['DATA EMISSÃO'].min()
-        periodo_fim = self.df_cabecalho['DATA EMISSÃO'].max()
+        aggregates = self.aggregates
 
         return (
             f"Não encontrei uma resposta específica para '{question}', mas aqui está um resumo geral dos dados:\n\n"
-            f"- Total de notas fiscais: {total_notas}\n"
-            f"- Total de itens: {total_itens}\n"
-            f"- Valor total das notas: R$ {valor_total:,.2f}\n"
-            f"- Período: de {periodo_inicio} a {periodo_fim}"
+            f"- Total de notas fiscais: {aggregates.total_notas}\n"
+            f"- Total de itens: {aggregates.total_itens}\n"
+            f"- Valor total das notas: R$ {aggregates.valor_total:,.2f}\n"
+            f"- Período: de {aggregates.periodo_inicio} a {aggregates.periodo_fim}"
         )
 
+# Intenções respondidas pelo agente de consultas (pergunta já normalizada:
+# minúsculas e sem acentos)
+register_intent(
+    "top_fornecedores", method("_get_top_suppliers"), TARGET_QUERY, terms=("fornecedores",),
+    pattern=contains(r"\b(?:top |os |as )?(?P<n>\d+) (?:maiores |principais )?fornecedores")
+    + rf"(?:(?=.*?\bem (?P<uf>{any_of(*UFS)})\b))?"
+    + rf"(?:(?=.*?\b(?:no |em )?mes (?:de )?(?P<mes>\d{{1,2}}|{any_of(*MONTHS)})\b))?",
+    priority=200, converters={"n": int, "uf": str.upper, "mes": parse_month}, periods=True,
+)
+register_intent("fornecedor_maior", method("_get_top_supplier"), TARGET_QUERY,
+                terms=("fornecedor", "maior"), priority=210, periods=True)
+register_intent("item_maior_volume", method("_get_top_item_by_volume"), TARGET_QUERY,
+                terms=("item",), pattern=contains(any_of("maior volume", "mais entregue")), priority=220)
+register_intent("valor_total", method("_get_total_invoice_value"), TARGET_QUERY,
+                terms=("valor total",), priority=230, periods=True)
+register_intent("valor_medio", method("_get_average_invoice_value"), TARGET_QUERY,
+                terms=("valor medio",), priority=240, periods=True)
+register_intent("documentos_venda", method("_get_sales_document_count"), TARGET_QUERY,
+                terms=("quantos documentos", "venda"), priority=250, periods=True)
+register_intent("documentos_compra", method("_get_purchase_document_count"), TARGET_QUERY,
+                terms=("quantos documentos", "compra"), priority=260, periods=True)
+register_intent("total_notas", method("_get_invoice_count"), TARGET_QUERY,
+                terms=("quantas notas",), priority=265, periods=True)
+register_intent("setores", method("_get_unique_sectors"), TARGET_QUERY, terms=("setores",), priority=270)
+register_intent("analise_geral", lambda agent, question: agent._free_form_answer(question), TARGET_QUERY,
+                priority=1000)
+
 class IntegratedFiscalAgent:
-    def __init__(self, cabecalho_path: str, itens_path: str):
-        self.csv_agent = CSVQueryAgent(cabecalho_path, itens_path)
+    def __init__(self, cabecalho_path: str, itens_path: str, dataset: FiscalDataset = None,
+                 aggregates: DatasetAggregates = None):
+        self.csv_agent = CSVQueryAgent(cabecalho_path, itens_path, dataset, aggregates)
+
+    def release_data(self):
+        self.csv_agent.release_data()
         
-    def process_query(self, query: str) -> str:
-        return self.csv_agent.query_data(query)
\ No newline at end of file
+    def process_query(self, query: str, match: IntentMatch = None) -> str:
+        return self.csv_agent.query_data(query, match)
\ No newline at end of file
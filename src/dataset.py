@@ -0,0 +1,202 @@
+# Conjunto de dados fiscais compartilhado entre os agentes
+
+import hashlib
+import os
+import threading
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+from metrics import count, span
+from periods import month_keys
+
+try:
+    import pyarrow.feather as feather
+except ImportError:  # pragma: no cover - pyarrow é opcional
+    feather = None
+
+# Tipos explícitos das colunas conhecidas. Colunas de texto repetitivas viram
+# categóricas; colunas ausentes no arquivo são simplesmente ignoradas.
+CATEGORICAL_COLUMNS = (
+    'MODELO', 'NATUREZA DA OPERAÇÃO', 'EVENTO MAIS RECENTE',
+    'RAZÃO SOCIAL EMITENTE', 'UF EMITENTE', 'MUNICÍPIO EMITENTE',
+    'NOME DESTINATÁRIO', 'UF DESTINATÁRIO', 'INDICADOR IE DESTINATÁRIO',
+    'DESTINO DA OPERAÇÃO', 'CONSUMIDOR FINAL', 'PRESENÇA DO COMPRADOR',
+    'DESCRIÇÃO DO PRODUTO/SERVIÇO', 'CÓDIGO NCM/SH', 'NCM/SH (TIPO DE PRODUTO)',
+    'CFOP', 'UNIDADE',
+)
+
+COLUMN_DTYPES = {
+    'CHAVE DE ACESSO': str,
+    'CPF/CNPJ Emitente': str,
+    'INSCRIÇÃO ESTADUAL EMITENTE': str,
+    'CNPJ DESTINATÁRIO': str,
+    'DATA EMISSÃO': str,
+    'DATA/HORA EVENTO MAIS RECENTE': str,
+    'VALOR NOTA FISCAL': 'float64',
+    'QUANTIDADE': 'float64',
+    'VALOR UNITÁRIO': 'float64',
+    'VALOR TOTAL': 'float64',
+    **{column: 'category' for column in CATEGORICAL_COLUMNS},
+}
+
+# Sufixo dos arquivos colunares (Arrow IPC/Feather sem compressão, que pode
+# ser mapeado em memória diretamente)
+COLUMNAR_SUFFIX = '.arrow'
+
+
+def read_fiscal_csv(path: str, **kwargs) -> pd.DataFrame:
+    """
+    Lê um CSV de notas fiscais aplicando os tipos explícitos das colunas.
+    """
+    return pd.read_csv(path, sep=',', decimal='.', dtype=COLUMN_DTYPES, **kwargs)
+
+
+def file_fingerprint(path: str) -> str:
+    """
+    Identifica a versão de um arquivo pelo caminho, tamanho e data de modificação.
+    """
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class FiscalDataset:
+    """
+    Cabeçalho e itens das notas fiscais carregados uma única vez e
+    compartilhados por todos os agentes e rotas.
+
+    Na primeira carga os CSVs são convertidos para o formato colunar Arrow
+    ao lado dos arquivos originais; cargas seguintes (reinícios, novas
+    instâncias) mapeiam esses arquivos em memória em vez de ler o CSV.
+    """
+
+    def __init__(self, cabecalho_path: str, itens_path: str, cache_dir: Optional[str] = None):
+        self.cabecalho_path = cabecalho_path
+        self.itens_path = itens_path
+        self.cache_dir = cache_dir
+        self.df_cabecalho = None
+        self.df_itens = None
+        self.version = None
+        self._month_partitions: Optional[Dict[int, np.ndarray]] = None
+        # Memória das tabelas carregadas, medida uma vez por carga
+        self._memory_usage: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self.df_cabecalho is not None and self.df_itens is not None
+
+    def load(self):
+        """
+        Carrega os dados somente se ainda não foram carregados.
+        """
+        if self.loaded:
+            return
+
+        with self._lock:
+            if self.loaded:
+                return
+            if not os.path.exists(self.cabecalho_path) or not os.path.exists(self.itens_path):
+                raise FileNotFoundError(f"Arquivos CSV não encontrados: {self.cabecalho_path} ou {self.itens_path}")
+
+            fingerprints = [file_fingerprint(self.cabecalho_path), file_fingerprint(self.itens_path)]
+            self.version = hashlib.sha1("|".join(fingerprints).encode()).hexdigest()[:16]
+            self.df_itens = self._load_table(self.itens_path, fingerprints[1])
+            self.df_cabecalho = self._load_table(self.cabecalho_path, fingerprints[0])
+
+    def unload(self):
+        """
+        Libera as tabelas da memória; a próxima carga usa os arquivos colunares em disco.
+        """
+        with self._lock:
+            self.df_cabecalho = None
+            self.df_itens = None
+            self._month_partitions = None
+            self._memory_usage = None
+
+    def month_partitions(self) -> Dict[int, np.ndarray]:
+        """
+        Posições das linhas do cabeçalho por mês de emissão (AAAAMM),
+        calculadas uma vez por carga: consultas por período leem apenas as
+        linhas dos meses pedidos.
+        """
+        partitions = self._month_partitions
+        if partitions is None:
+            self.load()
+            df = self.df_cabecalho
+            if 'DATA EMISSÃO' in df:
+                keys = month_keys(df['DATA EMISSÃO'])
+            else:
+                keys = np.zeros(len(df), dtype=np.int64)
+            order = np.argsort(keys, kind='stable')
+            bounds = np.flatnonzero(np.diff(keys[order])) + 1
+            partitions = {int(keys[rows[0]]): rows for rows in np.split(order, bounds) if len(rows)}
+            self._month_partitions = partitions
+        return partitions
+
+    def header_rows(self, months: Iterable[int]) -> pd.DataFrame:
+        """
+        Linhas do cabeçalho emitidas nos meses informados, na ordem original.
+        """
+        partitions = self.month_partitions()
+        selected = [partitions[month] for month in months if month in partitions]
+        if not selected:
+            return self.df_cabecalho.iloc[0:0]
+        return self.df_cabecalho.iloc[np.sort(np.concatenate(selected))]
+
+    def memory_usage(self) -> int:
+        """
+        Memória ocupada pelas tabelas carregadas, em bytes, medida uma vez
+        por carga (a medida percorre as colunas de texto e custa mais que a
+        própria carga do arquivo colunar).
+        """
+        total = self._memory_usage
+        if total is None:
+            total = 0
+            for df in (self.df_cabecalho, self.df_itens):
+                if df is not None:
+                    total += int(df.memory_usage(deep=True).sum())
+            if self.loaded:
+                self._memory_usage = total
+        return total
+
+    def _columnar_path(self, csv_path: str, fingerprint: str) -> str:
+        cache_dir = self.cache_dir or os.path.dirname(os.path.abspath(csv_path))
+        digest = hashlib.sha1(fingerprint.encode()).hexdigest()[:12]
+        base = os.path.splitext(os.path.basename(csv_path))[0]
+        return os.path.join(cache_dir, f"{base}.{digest}{COLUMNAR_SUFFIX}")
+
+    def _load_table(self, csv_path: str, fingerprint: str) -> pd.DataFrame:
+        """
+        Lê a tabela do arquivo colunar se existir, senão do CSV (gerando o arquivo colunar).
+        """
+        if feather is None:
+            return self._read_csv(csv_path)
+
+        columnar_path = self._columnar_path(csv_path, fingerprint)
+        if os.path.exists(columnar_path):
+            try:
+                with span("carga_colunar"):
+                    df = feather.read_table(columnar_path, memory_map=True).to_pandas()
+                count("fiscal_linhas_lidas_total", len(df), fonte="colunar")
+                return df
+            except Exception as e:
+                print(f"Arquivo colunar inválido {columnar_path}, relendo o CSV: {e}")
+
+        df = self._read_csv(csv_path)
+        try:
+            os.makedirs(os.path.dirname(columnar_path), exist_ok=True)
+            tmp_path = columnar_path + ".tmp"
+            feather.write_feather(df, tmp_path, compression='uncompressed')
+            os.replace(tmp_path, columnar_path)
+        except Exception as e:
+            print(f"Não foi possível gravar o arquivo colunar {columnar_path}: {e}")
+        return df
+
+    @staticmethod
+    def _read_csv(csv_path: str) -> pd.DataFrame:
+        with span("carga_csv"):
+            df = read_fiscal_csv(csv_path)
+        count("fiscal_linhas_lidas_total", len(df), fonte="csv")
+        return df
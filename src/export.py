@@ -0,0 +1,134 @@
+# Exportação em fluxo dos documentos classificados (NDJSON, CSV e Parquet)
+
+import csv
+import io
+import json
+from typing import Dict, Iterator, List, Tuple
+
+from fiscal_agent import LISTED_COLUMNS, DocumentOrganizer
+from metrics import count, span
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - pyarrow é opcional
+    pa = pq = None
+
+# Formato -> (tipo MIME, extensão do arquivo)
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+# Linhas lidas do cursor por vez; no Parquet, cada lote vira um row group
+EXPORT_BATCH_SIZE = 5000
+PARQUET_BATCH_SIZE = 50000
+
+
+def _rows(organizer: DocumentOrganizer, criteria: Dict, batch_size: int) -> Iterator[List[Tuple]]:
+    """
+    Lotes de linhas com as colunas de LISTED_COLUMNS.
+    """
+    for _, rows in organizer.iter_documents(criteria, batch_size=batch_size):
+        yield [row[1:1 + len(LISTED_COLUMNS)] for row in rows]
+
+
+def _ndjson(organizer: DocumentOrganizer, criteria: Dict) -> Iterator[bytes]:
+    for rows in _rows(organizer, criteria, EXPORT_BATCH_SIZE):
+        lines = [json.dumps(dict(zip(LISTED_COLUMNS, row)), ensure_ascii=False) for row in rows]
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+        count("fiscal_documentos_exportados_total", len(rows), formato="ndjson")
+
+
+def _csv(organizer: DocumentOrganizer, criteria: Dict) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(LISTED_COLUMNS)
+    # O cabeçalho sai de imediato, antes da primeira leitura
+    yield buffer.getvalue().encode("utf-8")
+    for rows in _rows(organizer, criteria, EXPORT_BATCH_SIZE):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue().encode("utf-8")
+        count("fiscal_documentos_exportados_total", len(rows), formato="csv")
+
+
+class _StreamSink:
+    """
+    Destino de escrita do Parquet que guarda só os bytes ainda não enviados.
+    A posição (tell) continua crescendo, pois o rodapé do arquivo registra
+    o deslocamento de cada row group.
+    """
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _parquet_schema():
+    return pa.schema([
+        (column, pa.float64() if column == 'valor_total' else pa.string())
+        for column in LISTED_COLUMNS
+    ])
+
+
+def _parquet(organizer: DocumentOrganizer, criteria: Dict) -> Iterator[bytes]:
+    schema = _parquet_schema()
+    sink = _StreamSink()
+    writer = pq.ParquetWriter(sink, schema, compression="snappy")
+    try:
+        for rows in _rows(organizer, criteria, PARQUET_BATCH_SIZE):
+            columns = list(zip(*rows))
+            arrays = [
+                pa.array([None if value is None else str(value) for value in values], pa.string())
+                if field.type == pa.string() else pa.array(values, field.type)
+                for field, values in zip(schema, columns)
+            ]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            yield sink.take()
+            count("fiscal_documentos_exportados_total", len(rows), formato="parquet")
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+def export_documents(organizer: DocumentOrganizer, criteria: Dict, fmt: str) -> Iterator[bytes]:
+    """
+    Documentos que atendem aos critérios no formato pedido, como um fluxo de
+    blocos de bytes: a leitura segue o cursor da base em lotes, de modo que
+    a memória é constante e o primeiro bloco sai antes do fim da consulta.
+    O formato é validado já na chamada, antes do início da resposta.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Formato de exportação não suportado: {fmt}")
+    if fmt == 'parquet' and pq is None:
+        raise ValueError("A exportação em Parquet exige o pacote pyarrow")
+    generator = {'ndjson': _ndjson, 'csv': _csv, 'parquet': _parquet}[fmt]
+
+    def stream() -> Iterator[bytes]:
+        with span(f"exportacao_{fmt}"):
+            yield from generator(organizer, criteria)
+    return stream()
@@ -1,232 +1,959 @@
 # Agente de Classificação e Organização de Documentos Fiscais
 
+import multiprocessing
+import time
+import numpy as np
 import pandas as pd
-import sqlite3
-import os
-from typing import Dict, List, Tuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from answer_cache import get_answer_cache
+from dataset import FiscalDataset
+from intents import (
+    CLASSIFICATION_TERMS, TARGET_CLASSIFICATION, IntentMatch, get_intent_registry, method, register_intent,
+)
+from item_facts import ISSUERS, RECIPIENTS, ItemFactStore
+from metrics import count, span
+from periods import NO_MONTH, Period, month_key, month_start, overlapping_months, strip_period
+from rules import FiscalRules, get_default_rules
+from search_index import SearchIndex, search_terms
+from storage import get_pool
+
+# Ordem das colunas usada nas inserções em documentos_classificados
+DOCUMENT_COLUMNS = (
+    'chave_acesso', 'cfop', 'tipo_operacao', 'centro_custo', 'setor',
+    'razao_social_emitente', 'nome_destinatario', 'valor_total', 'data_emissao'
+)
+
+# Etapas informadas ao callback de progresso: progress(etapa, quantidade)
+PROGRESS_PARSED = 'linhas_lidas'
+PROGRESS_CLASSIFIED = 'documentos_classificados'
+PROGRESS_STORED = 'documentos_gravados'
+
+ProgressCallback = Optional[Callable[[str, int], None]]
+
+
+class DeferredProgress:
+    """
+    Repassa o progresso, mas guarda a exceção do callback (o cancelamento da
+    tarefa) até `check()`. Usado a partir do momento em que os documentos
+    estão gravados: itens e índice de busca são atualizados até o fim e a
+    base nunca fica com documentos novos e itens antigos.
+    """
+
+    def __init__(self, progress: ProgressCallback):
+        self.progress = progress
+        self.error: Optional[Exception] = None
+
+    def __call__(self, stage: str, amount: int = 0):
+        if self.progress is None or self.error is not None:
+            return
+        try:
+            self.progress(stage, amount)
+        except Exception as e:
+            self.error = e
+
+    def check(self):
+        if self.error is not None:
+            raise self.error
+
+# Partições por processo no modo paralelo (equilibra notas de tamanhos diferentes)
+PARTITIONS_PER_WORKER = 4
+
+# Nomes gravados como chave inteira da dimensão: coluna do id, dimensão e
+# apelido da dimensão nas leituras que devolvem o nome
+NAME_COLUMNS = {
+    'razao_social_emitente': ('emitente_id', ISSUERS, 'e'),
+    'nome_destinatario': ('destinatario_id', RECIPIENTS, 'd'),
+}
+
+# Colunas das partições na ordem de DOCUMENT_COLUMNS
+STORED_COLUMNS = tuple(NAME_COLUMNS[column][0] if column in NAME_COLUMNS else column for column in DOCUMENT_COLUMNS)
+
+# Índices de cada partição de documentos_classificados. Os filtros incluem
+# valor_total para que contagens e somas sejam respondidas apenas pelo índice
+# (covering index).
+DOCUMENT_INDEXES = {
+    'idx_documentos_tipo_operacao': ('tipo_operacao', 'valor_total'),
+    'idx_documentos_centro_custo': ('centro_custo', 'valor_total'),
+    'idx_documentos_setor': ('setor', 'valor_total'),
+    'idx_documentos_data_emissao': ('data_emissao', 'valor_total'),
+}
+
+# Colunas aceitas como agrupamento em aggregate_documents ('mes' é o mês de emissão AAAAMM)
+GROUPABLE_COLUMNS = ('tipo_operacao', 'centro_custo', 'setor', 'cfop', 'razao_social_emitente', 'mes')
+
+# Critérios aceitos por _build_where (listagem, exportação e contagens)
+DOCUMENT_FILTERS = ('tipo_operacao', 'centro_custo', 'setor', 'data_inicio', 'data_fim')
+
+# Colunas devolvidas na listagem e na exportação dos documentos
+LISTED_COLUMNS = DOCUMENT_COLUMNS + ('created_at',)
+
+# Hash do conteúdo de origem de cada documento, usado na classificação incremental
+HASH_COLUMN = 'hash_conteudo'
+
+# Colunas de origem que determinam o documento classificado
+HASHED_SOURCE_COLUMNS = (
+    'CHAVE DE ACESSO', 'CFOP', 'CÓDIGO NCM/SH', 'RAZÃO SOCIAL EMITENTE',
+    'NOME DESTINATÁRIO', 'VALOR TOTAL', 'DATA EMISSÃO'
+)
+
+# Os documentos ficam particionados por mês de emissão, uma tabela por mês
+# (documentos_classificados_AAAAMM; _0 para datas inválidas). A view
+# documentos_classificados reúne todas as partições para leitura.
+DOCUMENTS_VIEW = 'documentos_classificados'
+PARTITION_PREFIX = 'documentos_classificados_'
+# Meses com partição e se o resumo mensal do mês precisa ser recalculado
+PARTITIONS_TABLE = 'documentos_particoes'
+# Partição de cada chave de acesso (uma nota cuja data mudou troca de partição)
+KEYS_TABLE = 'documentos_chaves'
+# Quantidade e valor por mês, tipo de operação, centro de custo e setor
+SUMMARY_TABLE = 'documentos_resumo_mensal'
+SUMMARY_COLUMNS = ('tipo_operacao', 'centro_custo', 'setor')
+
+# Mês AAAAMM de data_emissao em SQL, equivalente a periods.month_key
+MONTH_SQL = (
+    "CASE WHEN data_emissao GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]*' "
+    "AND CAST(substr(data_emissao, 6, 2) AS INTEGER) BETWEEN 1 AND 12 "
+    "THEN CAST(substr(data_emissao, 1, 4) AS INTEGER) * 100 + CAST(substr(data_emissao, 6, 2) AS INTEGER) "
+    f"ELSE {NO_MONTH} END"
+)
+
+
+def partition_table(month: int) -> str:
+    return f"{PARTITION_PREFIX}{int(month)}"
+
+
+def _document_select(table: str) -> str:
+    """
+    Leitura de uma partição com as colunas de DOCUMENT_COLUMNS, trazendo os
+    nomes das dimensões.
+    """
+    columns = ['p.id'] + [
+        f"{NAME_COLUMNS[column][2]}.nome AS {column}" if column in NAME_COLUMNS else f"p.{column}"
+        for column in DOCUMENT_COLUMNS
+    ] + ['p.created_at', f'p.{HASH_COLUMN}']
+    joins = "".join(
+        f" LEFT JOIN {dimension.table} {alias} ON {alias}.id = p.{id_column}"
+        for id_column, dimension, alias in NAME_COLUMNS.values()
+    )
+    return f"SELECT {', '.join(columns)} FROM {table} p{joins}"
+
+
+def parse_document_cursor(cursor: str) -> Tuple[int, int]:
+    """
+    Chave (mês, id) de um cursor de paginação 'AAAAMM:id'.
+    """
+    try:
+        month, row_id = cursor.split(":")
+        return int(month), int(row_id)
+    except ValueError:
+        raise ValueError(f"Cursor inválido: {cursor}") from None
+
+
+def _insert_sql(table: str, columns: Tuple[str, ...]) -> str:
+    return (
+        f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) "
+        f"VALUES ({', '.join('?' for _ in columns)})"
+    )
 
 class CFOPClassifier:
     """
     Classe para classificação de documentos fiscais baseada no CFOP.
+
+    As tabelas de regras ficam compiladas em FiscalRules (compartilhadas por
+    todo o processo); cfop_rules e sector_rules expõem as tabelas em uso.
     """
     
-    def __init__(self):
-        self.cfop_rules = {
-            # Vendas
-            "5": "Venda",
-            "6": "Venda Interestadual", 
-            "7": "Venda para Exterior",
-            
-            # Compras
-            "1": "Compra",
-            "2": "Compra Interestadual",
-            "3": "Compra do Exterior",
-            
-            # Específicos por CFOP
-            "5101": "Venda de produção do estabelecimento",
-            "5102": "Venda de mercadoria adquirida ou recebida de terceiros",
-            "5403": "Venda de mercadoria sujeita ao regime de substituição tributária",
-            "6101": "Venda de produção do estabelecimento",
-            "6102": "Venda de mercadoria adquirida ou recebida de terceiros",
-            "6403": "Venda de mercadoria sujeita ao regime de substituição tributária",
-            "1101": "Compra para industrialização",
-            "1102": "Compra para comercialização",
-            "2101": "Compra para industrialização",
-            "2102": "Compra para comercialização",
-            "2949": "Outra entrada de mercadoria ou prestação de serviço não especificada",
-        }
-        
-        self.sector_rules = {
-            # Baseado em NCM/SH
-            "49": "Editorial/Gráfico",
-            "85": "Eletrônicos/Elétricos", 
-            "73": "Metalúrgico",
-            "39": "Plásticos",
-            "84": "Máquinas e Equipamentos",
-            "87": "Veículos",
-            "90": "Instrumentos de Precisão",
-        }
+    def __init__(self, rules: FiscalRules = None):
+        self.rules = rules or get_default_rules()
+        self.cfop_rules = self.rules.cfop.rules
+        self.sector_rules = self.rules.sector.rules
     
     def classify_by_cfop(self, cfop: str) -> Dict[str, str]:
         """
-        Classifica um documento baseado no CFOP.
+        Classifica um documento baseado no CFOP (regra de prefixo mais longo:
+        código específico antes do primeiro dígito).
         """
-        cfop_str = str(cfop)
-        
-        # Verifica regras específicas primeiro
-        if cfop_str in self.cfop_rules:
-            operation_type = self.cfop_rules[cfop_str]
-        else:
-            # Verifica pelo primeiro dígito
-            first_digit = cfop_str[0]
-            operation_type = self.cfop_rules.get(first_digit, "Operação não classificada")
-        
-        # Determina centro de custo baseado no tipo de operação
-        if "Venda" in operation_type:
-            cost_center = "Receitas"
-        elif "Compra" in operation_type:
-            cost_center = "Custos"
-        else:
-            cost_center = "Outros"
+        operation_type, cost_center = self.rules.classify_cfop(cfop)
             
         return {
             "tipo_operacao": operation_type,
             "centro_custo": cost_center,
-            "cfop": cfop_str
+            "cfop": str(cfop)
         }
     
     def classify_by_sector(self, ncm_code: str) -> str:
         """
         Classifica o setor baseado no código NCM.
         """
-        ncm_str = str(ncm_code)
-        
-        # Verifica os dois primeiros dígitos do NCM
-        for prefix, sector in self.sector_rules.items():
-            if ncm_str.startswith(prefix):
-                return sector
-                
-        return "Setor não classificado"
+        return self.rules.sector.lookup(ncm_code)
+
+    def classify_cfop_column(self, cfops: pd.Series) -> pd.DataFrame:
+        """
+        Classifica uma coluna inteira de CFOPs de uma só vez.
+        Cada CFOP distinto é classificado uma única vez e o resultado é
+        propagado para todas as linhas.
+        """
+        cfop_str = cfops.astype(str)
+        operation_types, cost_centers = self.rules.classify_cfop_column(cfop_str)
+
+        return pd.DataFrame({
+            'cfop': cfop_str.values,
+            'tipo_operacao': operation_types,
+            'centro_custo': cost_centers,
+        }, index=cfops.index)
+
+    def classify_sector_column(self, ncm_codes: pd.Series) -> pd.Series:
+        """
+        Classifica o setor de uma coluna inteira de códigos NCM.
+        """
+        return pd.Series(self.rules.sector.lookup_column(ncm_codes), index=ncm_codes.index)
+
+def classify_merged_documents(merged_data: pd.DataFrame, classifier: CFOPClassifier) -> pd.DataFrame:
+    """
+    Classifica notas já consolidadas (cabeçalho + CFOP, NCM e valor dos itens)
+    e devolve as colunas na ordem de DOCUMENT_COLUMNS.
+    """
+    with span("classificacao"):
+        classified = _classify_columns(merged_data, classifier)
+    count("fiscal_documentos_classificados_total", len(classified))
+    return classified
+
+def _classify_columns(merged_data: pd.DataFrame, classifier: CFOPClassifier) -> pd.DataFrame:
+    cfop_classification = classifier.classify_cfop_column(merged_data['CFOP'])
+    sectors = classifier.classify_sector_column(merged_data['CÓDIGO NCM/SH'])
+
+    return pd.DataFrame({
+        'chave_acesso': merged_data['CHAVE DE ACESSO'],
+        'cfop': cfop_classification['cfop'],
+        'tipo_operacao': cfop_classification['tipo_operacao'],
+        'centro_custo': cfop_classification['centro_custo'],
+        'setor': sectors,
+        'razao_social_emitente': merged_data['RAZÃO SOCIAL EMITENTE'].astype(object),
+        'nome_destinatario': merged_data['NOME DESTINATÁRIO'].astype(object),
+        'valor_total': merged_data['VALOR TOTAL'].astype(float),
+        'data_emissao': merged_data['DATA EMISSÃO'],
+    }, columns=list(DOCUMENT_COLUMNS))
+
+def document_hashes(merged_data: pd.DataFrame, rules: FiscalRules) -> np.ndarray:
+    """
+    Hash de 64 bits do conteúdo de origem de cada nota consolidada. A
+    impressão digital das regras entra como chave do hash, de forma que uma
+    mudança nas regras invalida todos os documentos.
+    """
+    hashes = pd.util.hash_pandas_object(
+        merged_data[list(HASHED_SOURCE_COLUMNS)], index=False, hash_key=rules.fingerprint
+    ).to_numpy()
+    # O SQLite guarda inteiros com sinal
+    return hashes.view(np.int64)
+
+def merge_documents(df_cabecalho: pd.DataFrame, df_itens: pd.DataFrame) -> pd.DataFrame:
+    """
+    Consolida os itens por chave de acesso e junta com o cabeçalho.
+    O resultado tem uma linha por linha do cabeçalho, na mesma ordem.
+    """
+    with span("merge"):
+        # Agrupa itens por chave de acesso para obter informações consolidadas
+        itens_grouped = df_itens.groupby('CHAVE DE ACESSO', observed=True).agg({
+            # CFOP e NCM do primeiro item; a classificação exata, item a item, fica em fato_itens
+            'CFOP': 'first',
+            'CÓDIGO NCM/SH': 'first',
+            'VALOR TOTAL': 'sum'  # Soma todos os valores dos itens
+        }).reset_index()
+
+        # Merge com dados do cabeçalho
+        return pd.merge(
+            df_cabecalho,
+            itens_grouped,
+            on='CHAVE DE ACESSO',
+            how='left'
+        )
+
+def partition_by_key(df: pd.DataFrame, partitions: int) -> List[pd.DataFrame]:
+    """
+    Divide as linhas em partições pelo hash da chave de acesso, de forma que
+    cabeçalho e itens de uma mesma nota caiam sempre na mesma partição.
+    """
+    keys = pd.util.hash_pandas_object(df['CHAVE DE ACESSO'].astype(str), index=False).to_numpy()
+    buckets = keys % partitions
+    return [df[buckets == i] for i in range(partitions)]
+
+def classify_partition(df_cabecalho: pd.DataFrame, df_itens: pd.DataFrame, rules: FiscalRules = None) -> pd.DataFrame:
+    """
+    Consolida e classifica uma partição (executada nos processos do pool),
+    com o hash de conteúdo usado pelas execuções incrementais seguintes.
+    O índice do cabeçalho é preservado para a junção determinística dos resultados.
+    """
+    merged_data = merge_documents(df_cabecalho, df_itens)
+    merged_data.index = df_cabecalho.index
+    classifier = CFOPClassifier(rules)
+    classified = classify_merged_documents(merged_data, classifier)
+    # Inteiros do Python: o sqlite3 não aceita numpy.int64 como parâmetro
+    classified[HASH_COLUMN] = pd.Series(
+        document_hashes(merged_data, classifier.rules), index=classified.index
+    ).astype(object)
+    return classified
 
 class DocumentOrganizer:
     """
     Classe para organização e armazenamento de documentos classificados.
+
+    Os documentos são gravados na partição do mês de emissão e as consultas
+    leem apenas as partições que cruzam o intervalo de datas pedido.
+    Contagens e somas por tipo de operação, centro de custo, setor e mês são
+    respondidas pelo resumo mensal, mantido a cada gravação.
     """
     
     def __init__(self, db_path: str = "documentos_fiscais.db"):
         self.db_path = db_path
+        self.pool = get_pool(db_path)
+        # Escopo das respostas desta base no cache de respostas
+        self.cache_scope = f"{TARGET_CLASSIFICATION}:{self.pool.db_path}"
+        self.items = ItemFactStore(self.pool)
+        self.search = SearchIndex(self.pool)
         self.init_database()
     
     def init_database(self):
         """
         Inicializa o banco de dados SQLite.
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS documentos_classificados (
+        with self.pool.transaction() as conn:
+            ItemFactStore.init_schema(conn)
+            SearchIndex.init_schema(conn)
+            conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS {PARTITIONS_TABLE} (
+                    mes INTEGER PRIMARY KEY,
+                    resumo_pendente INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS {KEYS_TABLE} (
+                    chave_acesso TEXT PRIMARY KEY,
+                    mes INTEGER NOT NULL
+                ) WITHOUT ROWID
+            ''')
+            conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS {SUMMARY_TABLE} (
+                    mes INTEGER NOT NULL,
+                    tipo_operacao TEXT,
+                    centro_custo TEXT,
+                    setor TEXT,
+                    quantidade INTEGER NOT NULL,
+                    valor_total REAL
+                )
+            ''')
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_resumo_mensal_mes ON {SUMMARY_TABLE} (mes)")
+
+            # Bases criadas antes do particionamento têm uma única tabela
+            existing = conn.execute("SELECT type FROM sqlite_master WHERE name = ?", (DOCUMENTS_VIEW,)).fetchone()
+            if existing is not None and existing[0] == 'table':
+                self._migrate_single_table(conn)
+            elif existing is None:
+                self._create_view(conn, self._partition_months(conn))
+            else:
+                self._migrate_name_columns(conn)
+
+    @staticmethod
+    def _partition_months(conn) -> List[int]:
+        return [row[0] for row in conn.execute(f"SELECT mes FROM {PARTITIONS_TABLE} ORDER BY mes")]
+
+    @staticmethod
+    def _create_partition(conn, month: int):
+        table = partition_table(month)
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 chave_acesso TEXT UNIQUE,
                 cfop TEXT,
                 tipo_operacao TEXT,
                 centro_custo TEXT,
                 setor TEXT,
-                razao_social_emitente TEXT,
-                nome_destinatario TEXT,
+                emitente_id INTEGER,
+                destinatario_id INTEGER,
                 valor_total REAL,
                 data_emissao TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                {HASH_COLUMN} INTEGER
             )
         ''')
-        
-        conn.commit()
-        conn.close()
-    
+        for index_name, columns in DOCUMENT_INDEXES.items():
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {index_name}_{int(month)} ON {table} ({', '.join(columns)})")
+        conn.execute(f"INSERT OR IGNORE INTO {PARTITIONS_TABLE} (mes) VALUES (?)", (month,))
+
+    @staticmethod
+    def _create_view(conn, months: List[int]):
+        """
+        Recria a view que reúne as partições (usada por leituras que não filtram por data).
+        """
+        conn.execute(f"DROP VIEW IF EXISTS {DOCUMENTS_VIEW}")
+        if months:
+            body = " UNION ALL ".join(_document_select(partition_table(month)) for month in months)
+        else:
+            columns = ('id',) + DOCUMENT_COLUMNS + ('created_at', HASH_COLUMN)
+            body = "SELECT " + ", ".join(f"NULL AS {column}" for column in columns) + " WHERE 0"
+        conn.execute(f"CREATE VIEW {DOCUMENTS_VIEW} AS {body}")
+
+    @staticmethod
+    def _has_name_columns(conn, table: str) -> bool:
+        columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        return set(NAME_COLUMNS) <= columns
+
+    @staticmethod
+    def _encode_name_columns(conn, table: str):
+        """
+        Troca as colunas de nomes de uma tabela gravada antes das dimensões
+        pelas chaves inteiras correspondentes.
+        """
+        for column, (id_column, dimension, _) in NAME_COLUMNS.items():
+            conn.execute(
+                f"INSERT OR IGNORE INTO {dimension.table} (nome) "
+                f"SELECT DISTINCT {column} FROM {table} WHERE {column} IS NOT NULL"
+            )
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {id_column} INTEGER")
+            conn.execute(
+                f"UPDATE {table} SET {id_column} = "
+                f"(SELECT id FROM {dimension.table} WHERE nome = {table}.{column})"
+            )
+            conn.execute(f"ALTER TABLE {table} DROP COLUMN {column}")
+
+    def _migrate_name_columns(self, conn):
+        """
+        Partições gravadas com os nomes por extenso passam a usar as dimensões.
+        """
+        months = self._partition_months(conn)
+        pending = [month for month in months if self._has_name_columns(conn, partition_table(month))]
+        if pending:
+            # A view é validada a cada alteração de coluna: é recriada no fim
+            conn.execute(f"DROP VIEW IF EXISTS {DOCUMENTS_VIEW}")
+            for month in pending:
+                self._encode_name_columns(conn, partition_table(month))
+            self._create_view(conn, months)
+
+    def _migrate_single_table(self, conn):
+        """
+        Move os documentos da tabela única antiga para as partições mensais.
+        """
+        legacy = f"{DOCUMENTS_VIEW}_antiga"
+        conn.execute(f"ALTER TABLE {DOCUMENTS_VIEW} RENAME TO {legacy}")
+        if self._has_name_columns(conn, legacy):
+            self._encode_name_columns(conn, legacy)
+        columns = {row[1] for row in conn.execute(f"PRAGMA table_info({legacy})")}
+        hash_source = HASH_COLUMN if HASH_COLUMN in columns else "NULL"
+        copied = ', '.join(STORED_COLUMNS + ('created_at',))
+
+        months = [row[0] for row in conn.execute(f"SELECT DISTINCT {MONTH_SQL} FROM {legacy}")]
+        for month in months:
+            self._create_partition(conn, month)
+            conn.execute(
+                f"INSERT INTO {partition_table(month)} ({copied}, {HASH_COLUMN}) "
+                f"SELECT {copied}, {hash_source} FROM {legacy} WHERE {MONTH_SQL} = ? ORDER BY id",
+                (month,)
+            )
+        conn.execute(f"INSERT OR REPLACE INTO {KEYS_TABLE} SELECT chave_acesso, {MONTH_SQL} FROM {legacy}")
+        conn.execute(f"DROP TABLE {legacy}")
+        self._create_view(conn, self._partition_months(conn))
+        self._refresh_summary(conn, months)
+
+    @staticmethod
+    def _refresh_summary(conn, months: Iterable[int]):
+        """
+        Recalcula o resumo mensal dos meses informados a partir das partições.
+        """
+        for month in months:
+            conn.execute(f"DELETE FROM {SUMMARY_TABLE} WHERE mes = ?", (month,))
+            conn.execute(
+                f"INSERT INTO {SUMMARY_TABLE} (mes, {', '.join(SUMMARY_COLUMNS)}, quantidade, valor_total) "
+                f"SELECT ?, {', '.join(SUMMARY_COLUMNS)}, COUNT(*), SUM(valor_total) "
+                f"FROM {partition_table(month)} GROUP BY {', '.join(SUMMARY_COLUMNS)}",
+                (month,)
+            )
+            conn.execute(f"UPDATE {PARTITIONS_TABLE} SET resumo_pendente = 0 WHERE mes = ?", (month,))
+
+    def _refresh_pending_summaries(self):
+        """
+        Atualiza o resumo dos meses gravados documento a documento, antes de uma consulta que o usa.
+        """
+        with self.pool.connection() as conn:
+            pending = [row[0] for row in conn.execute(f"SELECT mes FROM {PARTITIONS_TABLE} WHERE resumo_pendente")]
+        if pending:
+            with self.pool.transaction() as conn:
+                self._refresh_summary(conn, pending)
+
+    @staticmethod
+    def _remove_moved(conn, keys: List[Tuple[str, int]]) -> Set[int]:
+        """
+        Apaga da partição antiga as notas do lote que mudaram de mês e
+        retorna os meses afetados.
+        """
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS lote_chaves (chave_acesso TEXT PRIMARY KEY, mes INTEGER)")
+        conn.execute("DELETE FROM temp.lote_chaves")
+        conn.executemany("INSERT OR REPLACE INTO temp.lote_chaves VALUES (?, ?)", keys)
+        moved = conn.execute(
+            f"SELECT c.chave_acesso, c.mes FROM {KEYS_TABLE} c "
+            "JOIN temp.lote_chaves l ON l.chave_acesso = c.chave_acesso WHERE c.mes != l.mes"
+        ).fetchall()
+        by_month: Dict[int, List[Tuple[str]]] = {}
+        for key, month in moved:
+            by_month.setdefault(month, []).append((key,))
+        for month, moved_keys in by_month.items():
+            conn.executemany(f"DELETE FROM {partition_table(month)} WHERE chave_acesso = ?", moved_keys)
+        return set(by_month)
+
     def store_classified_document(self, document_data: Dict):
         """
-        Armazena um documento classificado no banco de dados.
+        Armazena um documento classificado no banco de dados. O resumo mensal
+        é atualizado na próxima consulta que o usar.
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT OR REPLACE INTO documentos_classificados 
-            (chave_acesso, cfop, tipo_operacao, centro_custo, setor, 
-             razao_social_emitente, nome_destinatario, valor_total, data_emissao)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            document_data['chave_acesso'],
-            document_data['cfop'],
-            document_data['tipo_operacao'],
-            document_data['centro_custo'],
-            document_data['setor'],
-            document_data['razao_social_emitente'],
-            document_data['nome_destinatario'],
-            document_data['valor_total'],
-            document_data['data_emissao']
-        ))
-        
-        conn.commit()
-        conn.close()
+        self.store_classified_documents([tuple(document_data[col] for col in DOCUMENT_COLUMNS)],
+                                        refresh_summary=False)
+
+    def store_classified_documents(self, documents: Iterable[Tuple], chunk_size: int = 10000,
+                                   progress: ProgressCallback = None, with_hash: bool = False,
+                                   refresh_summary: bool = True) -> int:
+        """
+        Armazena vários documentos classificados usando uma única conexão e
+        uma única transação, cada um na partição do seu mês de emissão. As
+        tuplas devem seguir a ordem de DOCUMENT_COLUMNS (seguida do hash de
+        conteúdo, se with_hash=True).
+        Se o callback de progresso lançar uma exceção, a transação é desfeita.
+        """
+        columns = STORED_COLUMNS + ((HASH_COLUMN,) if with_hash else ())
+        date_position = DOCUMENT_COLUMNS.index('data_emissao')
+        issuer_position = DOCUMENT_COLUMNS.index('razao_social_emitente')
+        recipient_position = DOCUMENT_COLUMNS.index('nome_destinatario')
+        stored = 0
+        touched: Set[int] = set()
+        with span("gravacao"), self.pool.transaction() as conn:
+            months = set(self._partition_months(conn))
+            known_months = set(months)
+            # Numa base vazia nenhuma nota pode ter mudado de mês
+            check_moves = conn.execute(f"SELECT 1 FROM {KEYS_TABLE} LIMIT 1").fetchone() is not None
+            month_of: Dict = {}
+            iterator = iter(documents)
+            while True:
+                chunk = list(islice(iterator, chunk_size))
+                if not chunk:
+                    break
+                # Só os nomes do bloco são procurados (e os novos inseridos) nas dimensões
+                issuer_id = ISSUERS.value_encoder(conn, (row[issuer_position] for row in chunk))
+                recipient_id = RECIPIENTS.value_encoder(conn, (row[recipient_position] for row in chunk))
+                by_month: Dict[int, List[Tuple]] = {}
+                for row in chunk:
+                    row = (row[:issuer_position] + (issuer_id(row[issuer_position]), recipient_id(row[recipient_position]))
+                           + row[recipient_position + 1:])
+                    date = row[date_position]
+                    # O mês depende só de 'AAAA-MM': calculado uma vez por prefixo
+                    prefix = date[:7] if isinstance(date, str) else date
+                    month = month_of.get(prefix)
+                    if month is None:
+                        month = month_of[prefix] = month_key(prefix)
+                    by_month.setdefault(month, []).append(row)
+                keys = [(row[0], month) for month, rows in by_month.items() for row in rows]
+                if check_moves:
+                    touched |= self._remove_moved(conn, keys)
+                conn.executemany(f"INSERT OR REPLACE INTO {KEYS_TABLE} (chave_acesso, mes) VALUES (?, ?)", keys)
+                for month, rows in by_month.items():
+                    if month not in months:
+                        self._create_partition(conn, month)
+                        months.add(month)
+                    conn.executemany(_insert_sql(partition_table(month), columns), rows)
+                touched.update(by_month)
+                stored += len(chunk)
+                if progress:
+                    progress(PROGRESS_STORED, len(chunk))
+
+            if months != known_months:
+                self._create_view(conn, sorted(months))
+            if refresh_summary:
+                self._refresh_summary(conn, touched)
+            elif touched:
+                conn.executemany(f"UPDATE {PARTITIONS_TABLE} SET resumo_pendente = 1 WHERE mes = ?",
+                                 [(month,) for month in touched])
+        count("fiscal_documentos_gravados_total", stored)
+        return stored
     
-    def get_documents_by_criteria(self, criteria: Dict) -> List[Dict]:
+    def find_unchanged(self, keys: pd.Series, hashes: np.ndarray) -> np.ndarray:
         """
-        Recupera documentos baseado em critérios específicos.
+        Indica quais documentos já estão gravados com o mesmo hash de conteúdo.
+        Só as chaves do lote são procuradas, em cada partição onde estão
+        gravadas: o custo acompanha o lote, não o histórico da base.
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        query = "SELECT * FROM documentos_classificados WHERE 1=1"
+        pairs = list(zip(keys.astype(str).tolist(), hashes.tolist()))
+        with self.pool.connection() as conn:
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS lote_hashes (chave_acesso TEXT, hash INTEGER)")
+            conn.execute("CREATE INDEX IF NOT EXISTS temp.idx_lote_hashes ON lote_hashes (chave_acesso)")
+            conn.execute("DELETE FROM temp.lote_hashes")
+            conn.executemany("INSERT INTO temp.lote_hashes VALUES (?, ?)", pairs)
+            months = [row[0] for row in conn.execute(
+                f"SELECT DISTINCT c.mes FROM {KEYS_TABLE} c "
+                "JOIN temp.lote_hashes l ON l.chave_acesso = c.chave_acesso"
+            )]
+            stored = set()
+            for month in months:
+                stored.update(conn.execute(
+                    f"SELECT l.chave_acesso, l.hash FROM temp.lote_hashes l "
+                    f"JOIN {partition_table(month)} p ON p.chave_acesso = l.chave_acesso "
+                    f"AND p.{HASH_COLUMN} = l.hash"
+                ))
+            conn.execute("DELETE FROM temp.lote_hashes")
+        return np.fromiter((pair in stored for pair in pairs), dtype=bool, count=len(pairs))
+
+    def partition_months(self) -> List[int]:
+        """
+        Meses de emissão (AAAAMM) com documentos gravados.
+        """
+        with self.pool.connection() as conn:
+            return self._partition_months(conn)
+
+    def latest_month(self) -> Optional[int]:
+        months = [month for month in self.partition_months() if month != NO_MONTH]
+        return months[-1] if months else None
+
+    def period_criteria(self, periodo: Period) -> Dict:
+        """
+        Critérios de data de um período; sem ano, vale o ano mais recente gravado.
+        """
+        latest = self.latest_month()
+        inicio, fim = periodo.bounds(latest // 100 if latest else time.localtime().tm_year)
+        return {'data_inicio': inicio, 'data_fim': fim}
+
+    @staticmethod
+    def _build_where(criteria: Dict) -> Tuple[str, List]:
+        """
+        Monta a cláusula WHERE para os critérios suportados.
+        O intervalo de datas usa data_inicio inclusivo e data_fim exclusivo.
+        """
+        where = " WHERE 1=1"
         params = []
         
         if 'tipo_operacao' in criteria:
-            query += " AND tipo_operacao = ?"
+            where += " AND tipo_operacao = ?"
             params.append(criteria['tipo_operacao'])
             
         if 'centro_custo' in criteria:
-            query += " AND centro_custo = ?"
+            where += " AND centro_custo = ?"
             params.append(criteria['centro_custo'])
             
         if 'setor' in criteria:
-            query += " AND setor = ?"
+            where += " AND setor = ?"
             params.append(criteria['setor'])
-        
-        cursor.execute(query, params)
-        results = cursor.fetchall()
-        conn.close()
-        
-        # Converte para lista de dicionários
-        columns = ['id', 'chave_acesso', 'cfop', 'tipo_operacao', 'centro_custo', 
-                  'setor', 'razao_social_emitente', 'nome_destinatario', 
-                  'valor_total', 'data_emissao', 'created_at']
-        
-        return [dict(zip(columns, row)) for row in results]
+
+        if 'data_inicio' in criteria:
+            where += " AND data_emissao >= ?"
+            params.append(criteria['data_inicio'])
+
+        if 'data_fim' in criteria:
+            where += " AND data_emissao < ?"
+            params.append(criteria['data_fim'])
+
+        return where, params
+
+    def _selected_months(self, conn, criteria: Dict) -> List[int]:
+        """
+        Partições que podem ter documentos no intervalo de datas dos critérios.
+        """
+        return overlapping_months(self._partition_months(conn), criteria.get('data_inicio'), criteria.get('data_fim'))
+
+    @staticmethod
+    def _summary_where(criteria: Dict, months: List[int]) -> Optional[Tuple[str, List]]:
+        """
+        Cláusula WHERE equivalente sobre o resumo mensal, ou None quando os
+        critérios exigem ler os documentos (outras colunas ou datas que não
+        caem no início de um mês).
+        """
+        where = " WHERE 1=1"
+        params = []
+        for name, value in criteria.items():
+            if name in SUMMARY_COLUMNS:
+                where += f" AND {name} = ?"
+                params.append(value)
+            elif name in ('data_inicio', 'data_fim'):
+                month = month_key(value)
+                # Datas inválidas só são comparadas como texto, documento a documento
+                if month == NO_MONTH or value not in (month_start(month), month_start(month)[:7]) or NO_MONTH in months:
+                    return None
+                where += " AND mes >= ?" if name == 'data_inicio' else " AND mes < ?"
+                params.append(month)
+            else:
+                return None
+        return where, params
+
+    def iter_documents(self, criteria: Dict, after: Optional[Tuple[int, int]] = None,
+                       batch_size: int = 1000) -> Iterator[Tuple[int, List[Tuple]]]:
+        """
+        Documentos que atendem aos critérios na ordem (mês, id), em lotes
+        (mês, linhas) lidos de um cursor do SQLite: a memória não cresce com
+        o total e o primeiro lote sai sem esperar os demais. Todas as
+        partições são lidas no mesmo retrato da base. `after` é a chave
+        (mês, id) do último documento já entregue (paginação por chave).
+        """
+        where, params = self._build_where(criteria)
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN")
+            for month in self._selected_months(conn, criteria):
+                if after is not None and month < after[0]:
+                    continue
+                query, month_params = f"{_document_select(partition_table(month))}{where}", list(params)
+                if after is not None and month == after[0]:
+                    query += " AND p.id > ?"
+                    month_params.append(after[1])
+                cursor = conn.execute(f"{query} ORDER BY p.id", month_params)
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield month, rows
+
+    def list_documents(self, criteria: Dict, limit: int = 100,
+                       cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Uma página de documentos a partir do cursor ('AAAAMM:id' do último
+        documento da página anterior) e o cursor da página seguinte (None na
+        última). O custo de cada página não depende de quantas vieram antes.
+        """
+        after = parse_document_cursor(cursor) if cursor else None
+        page: List[Tuple[int, Tuple]] = []
+        for month, rows in self.iter_documents(criteria, after, batch_size=limit + 1):
+            page.extend((month, row) for row in rows[:limit + 1 - len(page)])
+            if len(page) > limit:
+                break
+
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            month, row = page[-1]
+            next_cursor = f"{month}:{row[0]}"
+        # Linhas de _document_select: id, DOCUMENT_COLUMNS, created_at e hash
+        documents = [dict(zip(LISTED_COLUMNS, row[1:1 + len(LISTED_COLUMNS)])) for _, row in page]
+        return documents, next_cursor
+
+    def get_documents_by_criteria(self, criteria: Dict) -> List[Dict]:
+        """
+        Recupera documentos baseado em critérios específicos.
+        """
+        columns = ('id',) + LISTED_COLUMNS
+        return [dict(zip(columns, row)) for _, rows in self.iter_documents(criteria) for row in rows]
+
+    def count_documents(self, criteria: Dict) -> int:
+        """
+        Conta os documentos que atendem aos critérios sem carregá-los.
+        """
+        return self.aggregate_documents(criteria)[0]['quantidade']
+
+    def aggregate_documents(self, criteria: Dict, group_by: str = None) -> List[Dict]:
+        """
+        Retorna quantidade e soma de valor_total dos documentos que atendem
+        aos critérios, opcionalmente agrupados por uma coluna. Sempre que os
+        critérios permitem, a resposta vem do resumo mensal; senão, somente
+        as partições do intervalo de datas são lidas.
+        """
+        if group_by is not None and group_by not in GROUPABLE_COLUMNS:
+            raise ValueError(f"Agrupamento não suportado: {group_by}")
+
+        self._refresh_pending_summaries()
+        with self.pool.connection() as conn:
+            months = self._selected_months(conn, criteria)
+            summary = self._summary_where(criteria, months)
+            if summary is not None and group_by in (None, 'mes') + SUMMARY_COLUMNS:
+                where, params = summary
+                select = "COALESCE(SUM(quantidade), 0), COALESCE(SUM(valor_total), 0)"
+                query = f"SELECT {select} FROM {SUMMARY_TABLE}{where}"
+                if group_by is not None:
+                    query = f"SELECT {group_by}, {select} FROM {SUMMARY_TABLE}{where} GROUP BY {group_by} ORDER BY 3 DESC"
+            elif months:
+                where, params = self._build_where(criteria)
+                select = "COUNT(*) AS quantidade, COALESCE(SUM(valor_total), 0) AS valor_total"
+                if group_by is None:
+                    parts = [f"SELECT {select} FROM {partition_table(month)}{where}" for month in months]
+                    query = f"SELECT COALESCE(SUM(quantidade), 0), COALESCE(SUM(valor_total), 0) FROM ({' UNION ALL '.join(parts)})"
+                else:
+                    # Nomes são agrupados pela chave inteira e traduzidos só no fim
+                    group_column = NAME_COLUMNS[group_by][0] if group_by in NAME_COLUMNS else group_by
+                    parts = [
+                        f"SELECT {month if group_by == 'mes' else group_column} AS grupo, {select} "
+                        f"FROM {partition_table(month)}{where} GROUP BY grupo"
+                        for month in months
+                    ]
+                    label, join = "grupo", ""
+                    if group_by in NAME_COLUMNS:
+                        label = "dim.nome"
+                        join = f" LEFT JOIN {NAME_COLUMNS[group_by][1].table} dim ON dim.id = grupo"
+                    query = (
+                        f"SELECT {label}, SUM(quantidade), SUM(valor_total) FROM ({' UNION ALL '.join(parts)}){join} "
+                        "GROUP BY grupo ORDER BY 3 DESC"
+                    )
+                params = params * len(months)
+            else:
+                query = None
+            rows = conn.execute(query, params).fetchall() if query else []
+
+        if group_by is None:
+            quantidade, valor_total = rows[0] if rows else (0, 0.0)
+            return [{'quantidade': quantidade, 'valor_total': valor_total}]
+        return [
+            {group_by: group, 'quantidade': quantidade, 'valor_total': valor_total}
+            for group, quantidade, valor_total in rows
+        ]
+
+    def get_distinct_sectors(self) -> List[str]:
+        """
+        Lista os setores distintos presentes nos documentos classificados.
+        """
+        self._refresh_pending_summaries()
+        with self.pool.connection() as conn:
+            return [row[0] for row in conn.execute(
+                f"SELECT DISTINCT setor FROM {SUMMARY_TABLE} ORDER BY setor"
+            )]
 
 class FiscalDocumentAgent:
     """
     Agente principal para classificação e organização de documentos fiscais.
     """
     
-    def __init__(self, cabecalho_path: str, itens_path: str):
+    def __init__(self, cabecalho_path: str, itens_path: str, dataset: FiscalDataset = None,
+                 db_path: str = "documentos_fiscais.db"):
         self.classifier = CFOPClassifier()
-        self.organizer = DocumentOrganizer()
+        self.organizer = DocumentOrganizer(db_path)
         self.cabecalho_path = cabecalho_path
         self.itens_path = itens_path
+        self.dataset = dataset or FiscalDataset(cabecalho_path, itens_path)
         self.df_cabecalho = None
         self.df_itens = None
         
     def load_data(self):
         """
-        Carrega os dados dos arquivos CSV.
+        Carrega os dados do conjunto compartilhado (lidos uma única vez).
         """
-        if os.path.exists(self.cabecalho_path) and os.path.exists(self.itens_path):
-            self.df_cabecalho = pd.read_csv(self.cabecalho_path)
-            self.df_itens = pd.read_csv(self.itens_path)
-        else:
-            raise FileNotFoundError(f"Arquivos CSV não encontrados: {self.cabecalho_path} ou {self.itens_path}")
+        self.dataset.load()
+        self.df_cabecalho = self.dataset.df_cabecalho
+        self.df_itens = self.dataset.df_itens
+
+    def release_data(self):
+        """
+        Solta as referências às tabelas para que possam ser liberadas da memória.
+        """
+        self.df_cabecalho = None
+        self.df_itens = None
         
-    def process_documents(self):
+    def _merge_documents(self) -> pd.DataFrame:
+        """
+        Consolida os itens por chave de acesso e junta com o cabeçalho.
+        """
+        return merge_documents(self.df_cabecalho, self.df_itens)
+
+    def process_documents(self, vectorized: bool = True, chunk_size: int = 10000,
+                          progress: ProgressCallback = None, workers: int = 1,
+                          incremental: bool = False) -> int:
         """
         Processa e classifica todos os documentos.
+
+        No modo vetorizado (padrão) as colunas de CFOP e NCM são classificadas
+        de uma só vez e o resultado é gravado em lote em uma única transação.
+        Com vectorized=False é usado o processamento linha a linha original.
+        Com workers > 1 as notas são particionadas por chave de acesso e
+        consolidadas/classificadas em um pool de processos.
+        Com incremental=True apenas as notas novas ou alteradas (hash de
+        conteúdo diferente do gravado) são classificadas e gravadas.
+        Em todos os modos os itens das notas gravadas vão também para a
+        tabela fato, classificados item a item, e as descrições e nomes novos
+        entram no índice de busca textual. Um cancelamento pelo callback de
+        progresso desfaz a gravação dos documentos ou, se ela já terminou,
+        só é lançado depois da tabela fato e do índice atualizados.
+        O callback `progress(etapa, quantidade)` recebe o andamento de cada etapa.
         """
         self.load_data()
+        if progress:
+            progress(PROGRESS_PARSED, len(self.df_cabecalho) + len(self.df_itens))
+
+        df_itens = self.df_itens
+        if incremental:
+            changed = self._changed_documents()
+            processed_count = self._process_vectorized(changed, chunk_size, progress)
+            df_itens = df_itens[df_itens['CHAVE DE ACESSO'].isin(changed['CHAVE DE ACESSO'])]
+        elif workers > 1:
+            processed_count = self._process_parallel(workers, chunk_size, progress)
+        elif vectorized:
+            processed_count = self._process_vectorized(self._merge_documents(), chunk_size, progress)
+        else:
+            # Cada documento é gravado em sua transação: o cancelamento espera o fim
+            progress = DeferredProgress(progress)
+            processed_count = self._process_row_by_row(self._merge_documents(), progress)
+
+        # Documentos gravados: um cancelamento daqui em diante só vale depois
+        # de itens e índice de busca atualizados
+        deferred = progress if isinstance(progress, DeferredProgress) else DeferredProgress(progress)
+        self.organizer.items.bulk_load(df_itens, self.classifier.rules, progress=deferred,
+                                       df_cabecalho=self.df_cabecalho)
+        self.organizer.search.refresh()
+        deferred.check()
         
-        # Agrupa itens por chave de acesso para obter informações consolidadas
-        itens_grouped = self.df_itens.groupby('CHAVE DE ACESSO').agg({
-            'CFOP': 'first',  # Pega o primeiro CFOP (pode ser melhorado)
-            'CÓDIGO NCM/SH': 'first',  # Pega o primeiro NCM
-            'VALOR TOTAL': 'sum'  # Soma todos os valores dos itens
-        }).reset_index()
-        
-        # Merge com dados do cabeçalho
-        merged_data = pd.merge(
-            self.df_cabecalho, 
-            itens_grouped, 
-            on='CHAVE DE ACESSO', 
-            how='left'
-        )
-        
+        print(f"Processados {processed_count} documentos com sucesso.")
+        return processed_count
+
+    def _changed_documents(self) -> pd.DataFrame:
+        """
+        Notas consolidadas cuja chave é nova ou cujo conteúdo mudou desde a última gravação.
+        """
+        merged_data = self._merge_documents()
+        hashes = document_hashes(merged_data, self.classifier.rules)
+        unchanged = self.organizer.find_unchanged(merged_data['CHAVE DE ACESSO'], hashes)
+        print(f"Classificação incremental: {int((~unchanged).sum())} de {len(merged_data)} documentos novos ou alterados.")
+        return merged_data[~unchanged]
+
+    def _process_parallel(self, workers: int, chunk_size: int, progress: ProgressCallback = None) -> int:
+        """
+        Distribui as partições entre processos e grava o resultado em um único escritor,
+        na ordem original do cabeçalho.
+        """
+        partitions = workers * PARTITIONS_PER_WORKER
+        cabecalho_parts = partition_by_key(self.df_cabecalho, partitions)
+        itens_parts = partition_by_key(self.df_itens, partitions)
+
+        results = [None] * partitions
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        try:
+            futures = {
+                pool.submit(classify_partition, cabecalho_parts[i], itens_parts[i], self.classifier.rules): i
+                for i in range(partitions)
+            }
+            for future in as_completed(futures):
+                part = future.result()
+                results[futures[future]] = part
+                if progress:
+                    progress(PROGRESS_CLASSIFIED, len(part))
+        except BaseException:
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+        pool.shutdown()
+
+        classified = pd.concat(results).sort_index()
+        rows = classified.itertuples(index=False, name=None)
+        return self.organizer.store_classified_documents(rows, chunk_size=chunk_size, progress=progress,
+                                                         with_hash=True)
+
+    def _process_vectorized(self, merged_data: pd.DataFrame, chunk_size: int,
+                            progress: ProgressCallback = None) -> int:
+        """
+        Classifica as colunas inteiras e grava o resultado em lote, junto com o
+        hash de conteúdo usado pelas execuções incrementais seguintes.
+        """
+        classified = classify_merged_documents(merged_data, self.classifier)
+        # Inteiros do Python: o sqlite3 não aceita numpy.int64 como parâmetro
+        classified[HASH_COLUMN] = pd.Series(
+            document_hashes(merged_data, self.classifier.rules), index=classified.index
+        ).astype(object)
+        if progress:
+            progress(PROGRESS_CLASSIFIED, len(classified))
+        rows = classified.itertuples(index=False, name=None)
+        return self.organizer.store_classified_documents(rows, chunk_size=chunk_size, progress=progress,
+                                                         with_hash=True)
+
+    def _process_row_by_row(self, merged_data: pd.DataFrame, progress: ProgressCallback = None) -> int:
+        """
+        Classifica e grava um documento por vez (modo original).
+        """
         processed_count = 0
         
         for _, row in merged_data.iterrows():
@@ -257,34 +984,142 @@ class FiscalDocumentAgent:
             except Exception as e:
                 print(f"Erro ao processar documento {row['CHAVE DE ACESSO']}: {e}")
                 continue
+
+            if progress:
+                progress(PROGRESS_CLASSIFIED, 1)
+                progress(PROGRESS_STORED, 1)
         
-        print(f"Processados {processed_count} documentos com sucesso.")
+        return processed_count
         
-    def query_documents(self, query_text: str) -> str:
+    def query_documents(self, query_text: str, match: IntentMatch = None) -> str:
         """
-        Responde a consultas sobre os documentos classificados.
+        Responde a consultas sobre os documentos classificados. As respostas
+        ficam em cache até a próxima gravação na base de documentos.
         """
-        query_lower = query_text.lower()
-        
-        if "venda" in query_lower:
-            docs = self.organizer.get_documents_by_criteria({'tipo_operacao': 'Venda'})
-            return f"Encontrados {len(docs)} documentos de venda."
-            
-        elif "compra" in query_lower:
-            docs = self.organizer.get_documents_by_criteria({'centro_custo': 'Custos'})
-            return f"Encontrados {len(docs)} documentos de compra."
-            
-        elif "setor" in query_lower:
-            # Lista todos os setores únicos
-            conn = sqlite3.connect(self.organizer.db_path)
-            cursor = conn.cursor()
-            cursor.execute("SELECT DISTINCT setor FROM documentos_classificados")
-            setores = [row[0] for row in cursor.fetchall()]
-            conn.close()
-            return f"Setores encontrados: {', '.join(setores)}"
-            
-        else:
-            return "Consulta não reconhecida. Tente perguntas sobre 'venda', 'compra' ou 'setor'."
+        cache = get_answer_cache()
+        cache_key = cache.key(self.organizer.cache_scope, self.organizer.pool.generation, query_text)
+        answer = cache.get(cache_key)
+        if answer is not None:
+            return answer
+
+        with span("consulta_classificacao"):
+            if match is None or match.intent.target != TARGET_CLASSIFICATION:
+                match = get_intent_registry().match(query_text, target=TARGET_CLASSIFICATION)
+            answer = self._unrecognized_query() if match is None else match.dispatch(self)
+        cache.put(cache_key, answer)
+        return answer
+
+    def _count_sales(self, periodo: Period = None) -> str:
+        return self._count_with_period({'tipo_operacao': 'Venda'}, "venda", periodo)
+
+    def _count_purchases(self, periodo: Period = None) -> str:
+        return self._count_with_period({'centro_custo': 'Custos'}, "compra", periodo)
+
+    def _document_counter(self):
+        """
+        Contagens pela tabela fato (classificação por item) quando os itens
+        foram gravados; sem eles (itens sem as colunas necessárias), pelos documentos.
+        """
+        return self.organizer.items if self.organizer.items.has_items() else self.organizer
+
+    def _count_with_period(self, criteria: Dict, kind: str, periodo: Period = None) -> str:
+        counter = self._document_counter()
+        if periodo is None:
+            return f"Encontrados {counter.count_documents(criteria)} documentos de {kind}."
+        period_criteria = self.organizer.period_criteria(periodo)
+        total = counter.count_documents({**criteria, **period_criteria})
+        label = periodo.label(int(period_criteria['data_inicio'][:4]))
+        return f"Encontrados {total} documentos de {kind} {label}."
+
+    def _list_sectors(self) -> str:
+        # Lista todos os setores únicos
+        setores = self._document_counter().get_distinct_sectors()
+        return f"Setores encontrados: {', '.join(setores)}"
+
+    def _search_totals(self, termo: str, kind: str, criteria: Dict, periodo: Period = None) -> Tuple:
+        """
+        Totais dos itens cujo texto contém `termo`, o termo sem o trecho do
+        período citado e o rótulo do período.
+        """
+        label = ""
+        if periodo is not None:
+            period_criteria = self.organizer.period_criteria(periodo)
+            criteria = {**criteria, **period_criteria}
+            label = f" {periodo.label(int(period_criteria['data_inicio'][:4]))}"
+            termo = strip_period(termo)
+        terms = search_terms(termo)
+        if not terms:
+            return None, termo, label
+        return self.organizer.search.totals(terms, kind, criteria), " ".join(terms), label
+
+    def _search_purchases(self, termo: str, periodo: Period = None) -> str:
+        # Sem filtro de centro de custo: quem pergunta o que comprou é o
+        # destinatário, e o CFOP é o do emitente (uma venda 6117 também é
+        # uma compra para quem a recebe)
+        return self._search_items(termo, {}, "compra", periodo)
+
+    def _search_sales(self, termo: str, periodo: Period = None) -> str:
+        return self._search_items(termo, {'tipo_operacao': 'Venda'}, "venda", periodo)
+
+    def _search_items(self, termo: str, criteria: Dict, kind: str, periodo: Period = None) -> str:
+        totals, termo, label = self._search_totals(termo, 'produto', criteria, periodo)
+        if not totals or not totals['itens']:
+            return f"Nenhum item de {kind} com '{termo}' na descrição{label}."
+        return (f"Itens de {kind} com '{termo}' na descrição{label}: {totals['itens']} itens em "
+                f"{totals['documentos']} notas, quantidade {totals['quantidade']:,.2f} e total de "
+                f"R$ {totals['valor_total']:,.2f}.")
+
+    def _search_partner_notes(self, papel: str, termo: str, periodo: Period = None) -> str:
+        kind = 'destinatario' if papel in ('cliente', 'destinatario') else 'emitente'
+        totals, termo, label = self._search_totals(termo, kind, {}, periodo)
+        if not totals or not totals['documentos']:
+            return f"Nenhuma nota do {papel} '{termo}'{label}."
+        return (f"Notas do {papel} '{termo}'{label}: {totals['documentos']} notas com "
+                f"{totals['itens']} itens, no total de R$ {totals['valor_total']:,.2f}.")
+
+    def _search_text(self, termo: str) -> str:
+        results = self.organizer.search.search(termo, limit=10, with_totals=True)
+        if not results:
+            return f"Nada encontrado para '{termo}'."
+        lines = [
+            f"{position}. {result['texto']} ({result['tipo']}): {result['documentos']} notas, "
+            f"R$ {result['valor_total']:,.2f}"
+            for position, result in enumerate(results, 1)
+        ]
+        return f"Resultados para '{termo}':\n" + "\n".join(lines)
+
+    def _unrecognized_query(self) -> str:
+        return "Consulta não reconhecida. Tente perguntas sobre 'venda', 'compra' ou 'setor'."
+
+# Intenções respondidas pelo agente de classificação. No roteamento entre
+# agentes elas só valem para perguntas que citam classificação, CFOP, setor
+# ou centro de custo.
+def _classification_intent(name: str, handler: str, terms: Tuple[str, ...], priority: int, periods: bool = False):
+    register_intent(name, method(handler), TARGET_CLASSIFICATION, terms=terms, priority=priority,
+                    context=CLASSIFICATION_TERMS, periods=periods)
+
+_classification_intent("classificacao_venda", "_count_sales", ("venda",), 100, periods=True)
+_classification_intent("classificacao_compra", "_count_purchases", ("compra",), 110, periods=True)
+_classification_intent("classificacao_setores", "_list_sectors", ("setor",), 120)
+_classification_intent("classificacao_nao_reconhecida", "_unrecognized_query", (), 190)
+
+# Buscas pelo índice textual: valem em qualquer pergunta com o formato
+# esperado, sem exigir os termos de classificação, e vêm antes das contagens
+# ("quanto compramos de ..." também cita compra)
+register_intent("busca_compras", method("_search_purchases"), TARGET_CLASSIFICATION, terms=("quanto",),
+                pattern=r".*?\bquanto (?:compramos|gastamos)(?: de| com| em)? (?P<termo>.+?)\??$",
+                priority=60, periods=True)
+register_intent("busca_vendas", method("_search_sales"), TARGET_CLASSIFICATION, terms=("quanto",),
+                pattern=r".*?\bquanto (?:vendemos|faturamos)(?: de| com| em)? (?P<termo>.+?)\??$",
+                priority=70, periods=True)
+register_intent("busca_notas_parceiro", method("_search_partner_notes"), TARGET_CLASSIFICATION, terms=("notas",),
+                pattern=r".*?\bnotas (?:fiscais )?(?:do|da|de) (?P<papel>fornecedor|emitente|cliente|destinatario) "
+                        r"(?P<termo>.+?)\??$",
+                priority=80, periods=True)
+register_intent("busca_textual", method("_search_text"), TARGET_CLASSIFICATION,
+                pattern=r"(?:busca|buscar|busque|procura|procurar|procure|pesquisa|pesquisar|pesquise)"
+                        r"(?: por)? (?P<termo>.+?)\??$",
+                priority=90)
 
 if __name__ == "__main__":
     # Exemplo de uso
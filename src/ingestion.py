@@ -0,0 +1,369 @@
+# Ingestão em streaming de notas fiscais (arquivos maiores que a memória)
+
+import csv
+import hashlib
+import os
+import sqlite3
+import tempfile
+import unicodedata
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import IO, Iterator, List, Optional, Sequence, Tuple, Union
+
+import pandas as pd
+
+from aggregates import (
+    PURCHASE_CFOP_PREFIXES, SALES_CFOP_PREFIXES, DatasetAggregates, IncrementalAggregates,
+)
+from dataset import file_fingerprint, read_fiscal_csv
+from fiscal_agent import (
+    PROGRESS_CLASSIFIED, PROGRESS_PARSED, CFOPClassifier, DeferredProgress, DocumentOrganizer, ProgressCallback,
+    classify_merged_documents,
+)
+from item_facts import NOTE_COLUMNS, with_note_columns
+from metrics import count, span
+
+# Uma fonte é o caminho de um CSV ou o par (arquivo compactado, membro)
+Source = Union[str, Tuple[str, str]]
+
+DEFAULT_CHUNK_SIZE = 100000
+
+# Etapa de progresso da extração (quantidade em bytes)
+PROGRESS_EXTRACTED = 'extraindo_arquivo'
+
+# Bloco de cópia ao extrair membros de arquivos compactados
+EXTRACT_BUFFER_SIZE = 1024 * 1024
+
+# Limite de leitura da primeira linha ao identificar um CSV
+HEADER_SNIFF_BYTES = 64 * 1024
+
+KIND_CABECALHO = 'cabecalho'
+KIND_ITENS = 'itens'
+
+# Colunas (normalizadas) que identificam cada arquivo pela linha de cabeçalho
+ITENS_COLUMNS = {'chave de acesso', 'numero produto', 'cfop'}
+CABECALHO_COLUMNS = {'chave de acesso', 'valor nota fiscal'}
+
+
+def list_archive_members(archive_path: str) -> List[str]:
+    """
+    Lista os arquivos CSV contidos em um arquivo ZIP ou RAR.
+    """
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as zf:
+            names = zf.namelist()
+    else:
+        # O rarfile só é importado quando o arquivo não é ZIP
+        import rarfile
+        if not rarfile.is_rarfile(archive_path):
+            raise ValueError(f"Formato de arquivo não suportado: {archive_path}")
+        with rarfile.RarFile(archive_path) as rf:
+            names = rf.namelist()
+    return [name for name in names if name.lower().endswith(".csv")]
+
+
+def _normalize_column(name: str) -> str:
+    text = unicodedata.normalize('NFKD', name.strip().strip('"').lower())
+    return "".join(ch for ch in text if not unicodedata.combining(ch))
+
+
+def sniff_csv_kind(header: bytes) -> Optional[str]:
+    """
+    Identifica pela linha de cabeçalho se o CSV é de cabeçalho ou de itens das notas.
+    """
+    try:
+        text = header.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        text = header.decode('latin-1')
+    line = text.splitlines()[0] if text else ''
+    delimiter = ';' if line.count(';') > line.count(',') else ','
+    columns = {_normalize_column(name) for name in next(csv.reader([line], delimiter=delimiter), [])}
+    if ITENS_COLUMNS <= columns:
+        return KIND_ITENS
+    if CABECALHO_COLUMNS <= columns:
+        return KIND_CABECALHO
+    return None
+
+
+def _filename_kind(name: str) -> Optional[str]:
+    filename_lower = os.path.basename(name).lower()
+    if "cabecalho" in filename_lower:
+        return KIND_CABECALHO
+    if "itens" in filename_lower:
+        return KIND_ITENS
+    return None
+
+
+def find_fiscal_members(archive_path: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Identifica os membros de cabeçalho e itens de um arquivo compactado pela
+    primeira linha de cada CSV; o nome do arquivo só é usado quando as
+    colunas não são reconhecidas.
+    """
+    found = {}
+    for name in list_archive_members(archive_path):
+        with open_source((archive_path, name)) as f:
+            kind = sniff_csv_kind(f.readline(HEADER_SNIFF_BYTES)) or _filename_kind(name)
+        if kind:
+            found[kind] = name
+    return found.get(KIND_CABECALHO), found.get(KIND_ITENS)
+
+
+def _extract_member(archive_path: str, member: str, target_path: str, progress: ProgressCallback = None) -> str:
+    with open_source((archive_path, member)) as source, open(target_path, "wb") as target:
+        while True:
+            block = source.read(EXTRACT_BUFFER_SIZE)
+            if not block:
+                break
+            target.write(block)
+            if progress:
+                progress(PROGRESS_EXTRACTED, len(block))
+    return target_path
+
+
+def extract_members(archive_path: str, members: Sequence[str], target_dir: str,
+                    progress: ProgressCallback = None) -> List[str]:
+    """
+    Extrai apenas os membros pedidos direto para `target_dir` (sem a
+    estrutura de diretórios do arquivo), um por thread: cada thread abre o
+    arquivo compactado por conta própria e a descompressão e a escrita
+    liberam o GIL. Retorna os caminhos na ordem de `members`.
+    """
+    targets = []
+    for member in members:
+        target = os.path.join(target_dir, os.path.basename(member))
+        if target in targets:
+            target = os.path.join(target_dir, f"{len(targets)}_{os.path.basename(member)}")
+        targets.append(target)
+
+    with span("extracao"), ThreadPoolExecutor(max_workers=max(1, len(members))) as executor:
+        futures = [executor.submit(_extract_member, archive_path, member, target, progress)
+                   for member, target in zip(members, targets)]
+        return [future.result() for future in futures]
+
+
+@contextmanager
+def open_source(source: Source) -> Iterator[IO]:
+    """
+    Abre uma fonte para leitura sem extrair o membro para o disco.
+    """
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            yield f
+        return
+
+    archive_path, member = source
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as zf, zf.open(member) as f:
+            yield f
+    else:
+        import rarfile
+        with rarfile.RarFile(archive_path) as rf, rf.open(member) as f:
+            yield f
+
+
+def source_version(*sources: Source) -> str:
+    """
+    Versão das fontes, no mesmo formato de FiscalDataset.version.
+    """
+    parts = []
+    for source in sources:
+        if isinstance(source, str):
+            parts.append(file_fingerprint(source))
+        else:
+            parts.append(f"{file_fingerprint(source[0])}:{source[1]}")
+    return hashlib.sha1("|".join(parts).encode()).hexdigest()[:16]
+
+
+class StreamingIngestor:
+    """
+    Lê cabeçalho e itens em blocos, classifica e grava cada bloco de notas
+    incrementalmente, mantendo o uso de memória limitado ao tamanho do bloco.
+
+    Os itens são consolidados por chave de acesso em uma base SQLite
+    temporária em disco (primeiro CFOP/NCM e soma dos valores, como no modo
+    em memória), pois os itens de uma nota podem estar em blocos diferentes.
+    As colunas da nota também ficam nessa base, para que uma última leitura
+    dos itens os grave na tabela fato, bloco a bloco, como em
+    process_documents; ao final, o índice de busca é atualizado.
+    """
+
+    def __init__(self, classifier: CFOPClassifier, organizer: DocumentOrganizer,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.classifier = classifier
+        self.organizer = organizer
+        self.chunk_size = chunk_size
+
+    def ingest(self, cabecalho_source: Source, itens_source: Source,
+               progress: ProgressCallback = None) -> DatasetAggregates:
+        """
+        Processa as duas fontes e devolve os agregados calculados durante a leitura.
+        O callback `progress(etapa, quantidade)` é chamado a cada bloco.
+        """
+        aggregates = IncrementalAggregates(source_version(cabecalho_source, itens_source))
+
+        fd, staging_path = tempfile.mkstemp(suffix=".db", prefix="ingest_")
+        os.close(fd)
+        staging = sqlite3.connect(staging_path)
+        try:
+            staging.execute("PRAGMA journal_mode=OFF")
+            staging.execute("PRAGMA synchronous=OFF")
+            staging.execute('''
+                CREATE TABLE itens (
+                    chave TEXT PRIMARY KEY,
+                    cfop TEXT,
+                    ncm TEXT,
+                    valor_total REAL,
+                    itens INTEGER,
+                    has_venda INTEGER,
+                    has_compra INTEGER,
+                    numerados INTEGER DEFAULT 0
+                )
+            ''')
+            staging.execute("CREATE TEMP TABLE chaves (chave TEXT PRIMARY KEY)")
+
+            self._stage_itens(staging, itens_source, aggregates, progress)
+            # A primeira passada só escreve na base temporária; a partir da
+            # gravação dos documentos, um cancelamento espera a tabela fato e
+            # o índice de busca ficarem de acordo com eles
+            deferred = DeferredProgress(progress)
+            self._store_documents(staging, cabecalho_source, aggregates, deferred)
+            self._store_items(staging, itens_source, deferred)
+            self.organizer.search.refresh()
+            deferred.check()
+
+            documentos_venda, documentos_compra = staging.execute(
+                "SELECT COALESCE(SUM(has_venda), 0), COALESCE(SUM(has_compra), 0) FROM itens"
+            ).fetchone()
+        finally:
+            staging.close()
+            os.remove(staging_path)
+
+        return aggregates.result(documentos_venda, documentos_compra)
+
+    def _stage_itens(self, staging: sqlite3.Connection, source: Source, aggregates: IncrementalAggregates,
+                     progress: ProgressCallback = None):
+        """
+        Consolida os itens por chave de acesso, bloco a bloco.
+        """
+        with open_source(source) as f:
+            for chunk in read_fiscal_csv(f, chunksize=self.chunk_size):
+                count("fiscal_linhas_lidas_total", len(chunk), fonte="streaming")
+                if progress:
+                    progress(PROGRESS_PARSED, len(chunk))
+                aggregates.update_itens(chunk)
+
+                cfops = chunk['CFOP'].astype(str)
+                grouped = pd.DataFrame({
+                    'chave': chunk['CHAVE DE ACESSO'],
+                    'cfop': cfops,
+                    'ncm': chunk['CÓDIGO NCM/SH'].astype(str),
+                    'valor_total': chunk['VALOR TOTAL'],
+                    'itens': 1,
+                    'has_venda': cfops.str.startswith(SALES_CFOP_PREFIXES).astype(int),
+                    'has_compra': cfops.str.startswith(PURCHASE_CFOP_PREFIXES).astype(int),
+                }).groupby('chave', sort=False).agg({
+                    'cfop': 'first',
+                    'ncm': 'first',
+                    'valor_total': 'sum',
+                    'itens': 'sum',
+                    'has_venda': 'max',
+                    'has_compra': 'max',
+                }).reset_index()
+                # O primeiro CFOP/NCM visto para a chave é mantido; valores são somados
+                staging.executemany('''
+                    INSERT INTO itens (chave, cfop, ncm, valor_total, itens, has_venda, has_compra)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(chave) DO UPDATE SET
+                        valor_total = valor_total + excluded.valor_total,
+                        itens = itens + excluded.itens,
+                        has_venda = MAX(has_venda, excluded.has_venda),
+                        has_compra = MAX(has_compra, excluded.has_compra)
+                ''', grouped.astype(object).itertuples(index=False, name=None))
+                staging.commit()
+
+    def _store_documents(self, staging: sqlite3.Connection, source: Source, aggregates: IncrementalAggregates,
+                         progress: ProgressCallback = None):
+        """
+        Junta cada bloco do cabeçalho aos itens consolidados, classifica e grava.
+        """
+        with open_source(source) as f:
+            for chunk in read_fiscal_csv(f, chunksize=self.chunk_size):
+                count("fiscal_linhas_lidas_total", len(chunk), fonte="streaming")
+                if progress:
+                    progress(PROGRESS_PARSED, len(chunk))
+                aggregates.update_cabecalho(chunk)
+
+                self._select_keys(staging, chunk['CHAVE DE ACESSO'])
+                itens = pd.read_sql_query('''
+                    SELECT i.chave AS "CHAVE DE ACESSO", i.cfop AS "CFOP",
+                           i.ncm AS "CÓDIGO NCM/SH", i.valor_total AS "VALOR TOTAL",
+                           i.itens, i.has_venda, i.has_compra
+                    FROM itens i JOIN chaves c ON c.chave = i.chave
+                ''', staging)
+
+                with span("merge"):
+                    merged = pd.merge(chunk, itens, on='CHAVE DE ACESSO', how='left')
+                # Os totais mensais dos itens usam o mês da nota no cabeçalho
+                aggregates.update_notas(merged)
+                classified = classify_merged_documents(merged, self.classifier)
+                if progress:
+                    progress(PROGRESS_CLASSIFIED, len(classified))
+                # O resumo mensal é recalculado uma vez, na primeira consulta, e não a cada bloco
+                self.organizer.store_classified_documents(
+                    classified.itertuples(index=False, name=None), chunk_size=self.chunk_size,
+                    progress=progress, refresh_summary=False
+                )
+                notes = ['CHAVE DE ACESSO'] + [column for column in NOTE_COLUMNS if column in chunk]
+                chunk[notes].astype(object).to_sql('notas', staging, if_exists='append', index=False)
+
+    @staticmethod
+    def _select_keys(staging: sqlite3.Connection, keys: pd.Series):
+        staging.execute("DELETE FROM chaves")
+        staging.executemany("INSERT OR IGNORE INTO chaves (chave) VALUES (?)", ((chave,) for chave in keys))
+
+    def _store_items(self, staging: sqlite3.Connection, source: Source, progress: ProgressCallback = None):
+        """
+        Lê os itens de novo e grava cada bloco na tabela fato, com as colunas
+        da nota vindas do cabeçalho guardado na base temporária.
+        """
+        items = self.organizer.items
+        if items.has_items():
+            # Itens gravados antes para estas notas são substituídos pela última leitura
+            cursor = staging.execute("SELECT chave FROM itens")
+            while True:
+                keys = [row[0] for row in cursor.fetchmany(self.chunk_size)]
+                if not keys:
+                    break
+                items.remove_notes(keys)
+        has_notes = staging.execute("SELECT 1 FROM sqlite_master WHERE name = 'notas'").fetchone()
+        if has_notes:
+            staging.execute('CREATE INDEX notas_chave ON notas ("CHAVE DE ACESSO")')
+        with open_source(source) as f:
+            for chunk in read_fiscal_csv(f, chunksize=self.chunk_size):
+                self._select_keys(staging, chunk['CHAVE DE ACESSO'])
+                if has_notes:
+                    notes = pd.read_sql_query(
+                        'SELECT n.* FROM notas n JOIN chaves c ON c.chave = n."CHAVE DE ACESSO"', staging
+                    )
+                    chunk = with_note_columns(chunk, notes)
+                if 'NÚMERO PRODUTO' not in chunk:
+                    chunk = self._number_items(staging, chunk)
+                items.bulk_load(chunk, self.classifier.rules, progress=progress, replace=False)
+
+    @staticmethod
+    def _number_items(staging: sqlite3.Connection, chunk: pd.DataFrame) -> pd.DataFrame:
+        """
+        Numera os itens de cada nota continuando a contagem dos blocos anteriores.
+        """
+        keys = chunk['CHAVE DE ACESSO'].astype(str)
+        numbered = dict(staging.execute(
+            "SELECT i.chave, i.numerados FROM itens i JOIN chaves c ON c.chave = i.chave"
+        ))
+        numbers = keys.groupby(keys, sort=False).cumcount() + 1 + keys.map(numbered).fillna(0).astype(int)
+        staging.executemany(
+            "UPDATE itens SET numerados = numerados + ? WHERE chave = ?",
+            ((int(total), key) for key, total in keys.value_counts().items())
+        )
+        return chunk.assign(**{'NÚMERO PRODUTO': numbers.to_numpy()})
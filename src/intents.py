@@ -0,0 +1,245 @@
+# Registro de intenções das perguntas em linguagem natural
+
+import re
+import threading
+import unicodedata
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from periods import MONTHS, parse_period
+
+# Agentes que respondem às intenções
+TARGET_CLASSIFICATION = "classificacao"
+TARGET_QUERY = "consulta"
+
+# Termos que levam a pergunta ao agente de classificação
+CLASSIFICATION_TERMS = ("classificacao", "cfop", "setor", "centro de custo")
+
+UFS = (
+    "ac", "al", "ap", "am", "ba", "ce", "df", "es", "go", "ma", "mt", "ms", "mg", "pa",
+    "pb", "pr", "pe", "pi", "rj", "rn", "rs", "ro", "rr", "sc", "sp", "se", "to",
+)
+
+# handler(agente, pergunta, **parâmetros) -> resposta
+IntentHandler = Callable[..., str]
+
+
+def normalize_question(question: str) -> str:
+    """
+    Minúsculas, sem acentos e com espaços simples.
+    """
+    text = unicodedata.normalize("NFKD", question.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(text.split())
+
+
+def contains(*terms: str) -> str:
+    """
+    Padrão que exige todas as expressões em qualquer ordem.
+    """
+    return "".join(f"(?=.*?(?:{term}))" for term in terms)
+
+
+def any_of(*terms: str) -> str:
+    return "|".join(f"(?:{term})" for term in terms)
+
+
+def parse_month(value: str) -> int:
+    return MONTHS[value] if value in MONTHS else int(value)
+
+
+def method(name: str) -> IntentHandler:
+    """
+    Handler que chama o método `name` do agente com os parâmetros extraídos.
+    """
+    def handler(agent, question, **params):
+        return getattr(agent, name)(**params)
+    handler.__name__ = name
+    return handler
+
+
+class KeywordAutomaton:
+    """
+    Autômato de Aho–Corasick: encontra todas as palavras-chave presentes em
+    um texto em uma única passada, independentemente de quantas existam.
+    """
+
+    def __init__(self, keywords: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[Set[str]] = [set()]
+
+        for keyword in keywords:
+            state = 0
+            for char in keyword:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(set())
+                state = next_state
+            self._output[state].add(keyword)
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._output[next_state] |= self._output[self._fail[next_state]]
+
+    def search(self, text: str) -> Set[str]:
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            if self._output[state]:
+                found |= self._output[state]
+        return found
+
+
+class Intent:
+    """
+    Um modelo de pergunta. `terms` são trechos literais que devem aparecer
+    na pergunta normalizada (em qualquer ordem); `pattern` é uma regex
+    adicional, ancorada no início, cujos grupos nomeados viram parâmetros
+    (convertidos pelas funções em `converters`).
+
+    `context` são termos dos quais ao menos um é exigido apenas no roteamento
+    entre agentes (target=None): o que faz a pergunta ir para este agente.
+
+    Com `periods=True`, um período citado na pergunta (mês, trimestre,
+    intervalo de meses ou ano) é passado ao handler no parâmetro `periodo`.
+    """
+
+    def __init__(self, name: str, handler: IntentHandler, target: str, terms: Tuple[str, ...] = (),
+                 pattern: str = "", priority: int = 100, converters: Dict[str, Callable] = None,
+                 context: Tuple[str, ...] = (), periods: bool = False):
+        self.name = name
+        self.handler = handler
+        self.target = target
+        self.terms = tuple(terms)
+        self.pattern = pattern
+        self.priority = priority
+        self.converters = converters or {}
+        self.context = tuple(context)
+        self.periods = periods
+        self.regex = re.compile(contains(*map(re.escape, self.terms)) + pattern)
+
+
+class IntentMatch:
+    def __init__(self, intent: Intent, question: str, params: Dict):
+        self.intent = intent
+        self.question = question
+        self.params = params
+
+    def dispatch(self, agent) -> str:
+        return self.intent.handler(agent, self.question, **self.params)
+
+
+class IntentRegistry:
+    """
+    Intenções compiladas em um único autômato com os termos literais de
+    todas elas. Uma passada pela pergunta revela os termos presentes e,
+    portanto, as poucas intenções candidatas; só as candidatas têm a regex
+    verificada, na ordem de prioridade. O custo não cresce com o número de
+    intenções cadastradas.
+    """
+
+    def __init__(self):
+        self._intents: List[Intent] = []
+        self._compiled = None
+        self._lock = threading.Lock()
+
+    def register(self, name: str, handler: IntentHandler, target: str, **options) -> Intent:
+        intent = Intent(name, handler, target, **options)
+        with self._lock:
+            self._intents = [existing for existing in self._intents if existing.name != name]
+            self._intents.append(intent)
+            self._compiled = None
+        return intent
+
+    def intents(self, target: Optional[str] = None) -> List[Intent]:
+        ordered = sorted(self._intents, key=lambda intent: intent.priority)  # sort estável
+        return [intent for intent in ordered if target is None or intent.target == target]
+
+    def _compile(self):
+        """
+        Autômato, índice termo -> intenções, intenções sem termos e ordem de
+        prioridade, montados de uma vez (cadastros seguintes geram outro conjunto).
+        """
+        compiled = self._compiled
+        if compiled is not None:
+            return compiled
+
+        with self._lock:
+            if self._compiled is None:
+                ordered = self.intents()
+                rank = {intent.name: position for position, intent in enumerate(ordered)}
+                by_term: Dict[str, List[Intent]] = {}
+                for intent in ordered:
+                    for term in set(intent.terms):
+                        by_term.setdefault(term, []).append(intent)
+                unconditional = [intent for intent in ordered if not intent.terms]
+                keywords = set(by_term) | {term for intent in ordered for term in intent.context}
+                self._compiled = (KeywordAutomaton(keywords), by_term, unconditional, rank)
+            return self._compiled
+
+    def match(self, question: str, target: Optional[str] = None) -> Optional[IntentMatch]:
+        """
+        Intenção de maior prioridade que casa com a pergunta. Sem `target`, as
+        intenções de todos os agentes concorrem (roteamento).
+        """
+        automaton, by_term, unconditional, rank = self._compile()
+        text = normalize_question(question)
+        found = automaton.search(text)
+
+        hits: Dict[str, int] = {}
+        candidates = list(unconditional)
+        for term in found:
+            for intent in by_term.get(term, ()):
+                hits[intent.name] = hits.get(intent.name, 0) + 1
+                if hits[intent.name] == len(set(intent.terms)):
+                    candidates.append(intent)
+        candidates.sort(key=lambda intent: rank[intent.name])
+
+        for intent in candidates:
+            if target is not None and intent.target != target:
+                continue
+            if target is None and intent.context and found.isdisjoint(intent.context):
+                continue
+            matched = intent.regex.match(text)
+            if matched is None:
+                continue
+            params = {}
+            for param, value in matched.groupdict().items():
+                if value is not None:
+                    converter = intent.converters.get(param)
+                    params[param] = converter(value) if converter else value
+            if intent.periods:
+                period = parse_period(text)
+                if period is not None:
+                    params["periodo"] = period
+            return IntentMatch(intent, question, params)
+        return None
+
+
+_default_registry = IntentRegistry()
+
+
+def get_intent_registry() -> IntentRegistry:
+    """
+    Registro compartilhado em que os agentes cadastram suas intenções.
+    """
+    return _default_registry
+
+
+def register_intent(name: str, handler: IntentHandler, target: str, **options) -> Intent:
+    return _default_registry.register(name, handler, target, **options)
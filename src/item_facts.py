@@ -0,0 +1,466 @@
+# Esquema estrela dos itens: tabela fato por item e dimensões codificadas por dicionário
+
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from metrics import count, span
+from periods import NO_MONTH, month_key, month_keys, month_start
+from rules import FiscalRules
+
+# Etapa informada ao callback de progresso durante a carga dos itens
+PROGRESS_ITEMS_STORED = 'itens_gravados'
+
+# Colunas da nota gravadas com cada item: quando o CSV de itens não as tem,
+# elas vêm do cabeçalho pela chave de acesso
+NOTE_COLUMNS = ('DATA EMISSÃO', 'RAZÃO SOCIAL EMITENTE', 'NOME DESTINATÁRIO', 'NATUREZA DA OPERAÇÃO')
+REQUIRED_COLUMNS = (
+    'CHAVE DE ACESSO', 'DATA EMISSÃO', 'RAZÃO SOCIAL EMITENTE', 'NOME DESTINATÁRIO', 'CÓDIGO NCM/SH',
+    'DESCRIÇÃO DO PRODUTO/SERVIÇO', 'CFOP', 'QUANTIDADE', 'VALOR TOTAL',
+)
+
+FACTS_TABLE = 'fato_itens'
+NOTES_TABLE = 'dim_nota'
+ISSUERS_TABLE = 'dim_emitente'
+RECIPIENTS_TABLE = 'dim_destinatario'
+PRODUCTS_TABLE = 'dim_produto'
+CFOPS_TABLE = 'dim_cfop'
+NATURES_TABLE = 'dim_natureza'
+
+# Cada linha da tabela fato tem só inteiros e números: os textos repetidos
+# (nomes, descrições, CFOP e classificação) ficam uma única vez nas dimensões.
+SCHEMA = (
+    f"CREATE TABLE IF NOT EXISTS {ISSUERS_TABLE} (id INTEGER PRIMARY KEY, nome TEXT UNIQUE)",
+    f"CREATE TABLE IF NOT EXISTS {RECIPIENTS_TABLE} (id INTEGER PRIMARY KEY, nome TEXT UNIQUE)",
+    f"CREATE TABLE IF NOT EXISTS {NATURES_TABLE} (id INTEGER PRIMARY KEY, nome TEXT UNIQUE)",
+    f'''CREATE TABLE IF NOT EXISTS {PRODUCTS_TABLE} (
+        id INTEGER PRIMARY KEY,
+        codigo_ncm TEXT,
+        descricao TEXT,
+        setor TEXT,
+        UNIQUE (codigo_ncm, descricao)
+    )''',
+    f'''CREATE TABLE IF NOT EXISTS {CFOPS_TABLE} (
+        id INTEGER PRIMARY KEY,
+        cfop TEXT UNIQUE,
+        tipo_operacao TEXT,
+        centro_custo TEXT
+    )''',
+    f'''CREATE TABLE IF NOT EXISTS {NOTES_TABLE} (
+        id INTEGER PRIMARY KEY,
+        chave_acesso TEXT UNIQUE,
+        data_emissao TEXT,
+        mes INTEGER
+    )''',
+    f'''CREATE TABLE IF NOT EXISTS {FACTS_TABLE} (
+        nota_id INTEGER NOT NULL,
+        numero_item INTEGER NOT NULL,
+        emitente_id INTEGER,
+        destinatario_id INTEGER,
+        produto_id INTEGER,
+        cfop_id INTEGER,
+        natureza_id INTEGER,
+        mes INTEGER NOT NULL,
+        quantidade REAL,
+        valor_total REAL,
+        PRIMARY KEY (nota_id, numero_item)
+    ) WITHOUT ROWID''',
+)
+
+# Índices cobrindo os agrupamentos e contagens por operação e por setor
+# (numa tabela WITHOUT ROWID cada índice já carrega nota_id e numero_item)
+FACT_INDEXES = {
+    'idx_fato_itens_cfop': ('cfop_id', 'mes', 'valor_total'),
+    'idx_fato_itens_produto': ('produto_id', 'valor_total'),
+}
+
+# Critérios de filtro: coluna da tabela fato e dimensão que resolve o valor
+FILTERS = {
+    'tipo_operacao': ('cfop_id', CFOPS_TABLE),
+    'centro_custo': ('cfop_id', CFOPS_TABLE),
+    'cfop': ('cfop_id', CFOPS_TABLE),
+    'setor': ('produto_id', PRODUCTS_TABLE),
+}
+
+# Agrupamentos: chave estrangeira agrupada na tabela fato e rótulo na dimensão
+GROUPINGS = {
+    'tipo_operacao': ('cfop_id', CFOPS_TABLE, 'tipo_operacao'),
+    'centro_custo': ('cfop_id', CFOPS_TABLE, 'centro_custo'),
+    'cfop': ('cfop_id', CFOPS_TABLE, 'cfop'),
+    'setor': ('produto_id', PRODUCTS_TABLE, 'setor'),
+    'razao_social_emitente': ('emitente_id', ISSUERS_TABLE, 'nome'),
+    'nome_destinatario': ('destinatario_id', RECIPIENTS_TABLE, 'nome'),
+    'natureza_operacao': ('natureza_id', NATURES_TABLE, 'nome'),
+    'mes': ('mes', None, None),
+}
+
+
+def _first_rows(codes: np.ndarray) -> np.ndarray:
+    """
+    Primeira linha de cada código de pd.factorize, que numera os valores na
+    ordem em que aparecem pela primeira vez.
+    """
+    if not len(codes):
+        return codes
+    seen = np.maximum.accumulate(codes)
+    return np.flatnonzero(codes > np.concatenate(([-1], seen[:-1])))
+
+
+def _factorize_rows(frame: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Código de cada linha pela combinação das colunas e a primeira linha de
+    cada combinação, fatorando coluna a coluna em vez de comparar tuplas.
+    """
+    combined = np.zeros(len(frame), dtype=np.int64)
+    for column in frame.columns:
+        codes, uniques = pd.factorize(frame[column], use_na_sentinel=False)
+        combined = combined * (len(uniques) + 1) + codes
+    codes, _ = pd.factorize(combined)
+    return codes, _first_rows(codes)
+
+
+def _text_values(column: pd.Series) -> List[Optional[str]]:
+    """
+    Valores como texto, com os ausentes como None (formato das chaves gravadas).
+    """
+    missing = column.isna().to_numpy()
+    return [None if absent else (value if type(value) is str else str(value))
+            for value, absent in zip(column.astype(object).tolist(), missing)]
+
+
+def _text_value(value) -> Optional[str]:
+    """
+    Valor como texto, com o ausente como None (como em _text_values).
+    """
+    if value is None or pd.isna(value):
+        return None
+    return value if type(value) is str else str(value)
+
+
+def _sql_values(ids: np.ndarray) -> List:
+    """
+    Ids como inteiros do Python (o sqlite3 não aceita numpy.int64); -1 vira NULL.
+    """
+    values = ids.tolist()
+    if len(ids) and ids.min() < 0:
+        values = [None if value < 0 else value for value in values]
+    return values
+
+
+class Dimension:
+    """
+    Tabela de dimensão codificada por dicionário: cada combinação distinta
+    das colunas-chave recebe um id inteiro, e os atributos (classificação)
+    acompanham a chave. Chaves inteiramente nulas viram id NULL.
+    """
+
+    def __init__(self, table: str, keys: Tuple[str, ...], attributes: Tuple[str, ...] = ()):
+        self.table = table
+        self.keys = keys
+        self.attributes = attributes
+
+    def _resolve(self, conn, rows: List[Tuple]) -> List[Tuple]:
+        """
+        Ids das chaves de um bloco, sem ler a dimensão inteira: as linhas
+        (posição, chaves..., atributos...) vão para uma tabela temporária, as
+        chaves novas são inseridas (na ordem das posições) e só as chaves do
+        bloco são procuradas. Retorna (posição, id, atributos gravados,
+        atributos do bloco) de cada linha.
+        """
+        staging = f"chaves_{self.table}"
+        columns = self.keys + self.attributes
+        conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS {staging} (posicao INTEGER PRIMARY KEY, {', '.join(columns)})")
+        conn.execute(f"DELETE FROM temp.{staging}")
+        conn.executemany(f"INSERT INTO temp.{staging} VALUES ({', '.join('?' for _ in range(len(columns) + 1))})", rows)
+
+        # IS em vez de =: chaves compostas com partes nulas também se encontram
+        match = ' AND '.join(f"d.{key} IS t.{key}" for key in self.keys)
+        keys = ', '.join(f"t.{key}" for key in self.keys)
+        conn.execute(
+            f"INSERT INTO {self.table} ({', '.join(columns)}) "
+            f"SELECT {', '.join(f't.{column}' for column in columns)} FROM temp.{staging} t "
+            f"WHERE NOT EXISTS (SELECT 1 FROM {self.table} d WHERE {match}) "
+            f"GROUP BY {keys} ORDER BY MIN(t.posicao)"
+        )
+        stored = ', '.join(f"d.{name}" for name in self.attributes)
+        staged = ', '.join(f"t.{name}" for name in self.attributes)
+        size = len(self.attributes)
+        return [
+            (row[0], row[1], row[2:2 + size], row[2 + size:])
+            for row in conn.execute(
+                f"SELECT t.posicao, d.id{', ' + stored + ', ' + staged if size else ''} "
+                f"FROM temp.{staging} t JOIN {self.table} d ON {match}"
+            )
+        ]
+
+    def encode(self, conn, frame: pd.DataFrame, columns: List[str],
+               attributes: Callable[[pd.DataFrame], List[Tuple]] = None) -> np.ndarray:
+        """
+        Id de cada linha de `frame` pelas colunas `columns` (na ordem de
+        `keys`; -1 para chaves nulas). Chaves novas são inseridas;
+        `attributes(linhas)` calcula os atributos das chaves distintas a
+        partir da primeira linha de cada uma, e atributos que mudaram (regras
+        alteradas) são atualizados. Só as chaves de `frame` são lidas da
+        base: o custo acompanha o bloco, não o tamanho da dimensão.
+        """
+        codes, first = _factorize_rows(frame[columns])
+        sample = frame.iloc[first]
+        values = attributes(sample) if attributes else [()] * len(first)
+
+        ids = np.full(len(first), -1, dtype=np.int64)
+        keys = zip(*(_text_values(sample[column]) for column in columns))
+        rows = [(position,) + key + tuple(attribute)
+                for position, (key, attribute) in enumerate(zip(keys, values))
+                if not all(value is None for value in key)]
+        changed = []
+        if rows:
+            for position, dimension_id, stored, staged in self._resolve(conn, rows):
+                ids[position] = dimension_id
+                if stored != staged:
+                    changed.append(staged + (dimension_id,))
+        if changed:
+            assignments = ', '.join(f"{name} = ?" for name in self.attributes)
+            conn.executemany(f"UPDATE {self.table} SET {assignments} WHERE id = ?", changed)
+        return ids[codes]
+
+    def value_encoder(self, conn, values: Iterable) -> Callable[[object], Optional[int]]:
+        """
+        Tradutor dos valores de um bloco de uma dimensão de coluna única,
+        para gravações linha a linha: os valores distintos do bloco são
+        resolvidos (e os novos inseridos) de uma vez.
+        """
+        texts = list(dict.fromkeys(_text_value(value) for value in values))
+        texts = [text for text in texts if text is not None]
+        ids: Dict[Optional[str], Optional[int]] = {None: None}
+        if texts:
+            ids.update((texts[position], dimension_id)
+                       for position, dimension_id, _, _ in self._resolve(conn, list(enumerate(texts))))
+        return lambda value: ids[_text_value(value)]
+
+    def labels(self, conn, column: str) -> Dict[int, str]:
+        return dict(conn.execute(f"SELECT id, {column} FROM {self.table}"))
+
+
+ISSUERS = Dimension(ISSUERS_TABLE, ('nome',))
+RECIPIENTS = Dimension(RECIPIENTS_TABLE, ('nome',))
+PRODUCTS = Dimension(PRODUCTS_TABLE, ('codigo_ncm', 'descricao'), ('setor',))
+CFOPS = Dimension(CFOPS_TABLE, ('cfop',), ('tipo_operacao', 'centro_custo'))
+NOTES = Dimension(NOTES_TABLE, ('chave_acesso',), ('data_emissao', 'mes'))
+NATURES = Dimension(NATURES_TABLE, ('nome',))
+
+DIMENSIONS = {table.table: table for table in (ISSUERS, RECIPIENTS, PRODUCTS, CFOPS, NOTES, NATURES)}
+
+
+def with_note_columns(df_itens: pd.DataFrame, df_cabecalho: pd.DataFrame) -> pd.DataFrame:
+    """
+    Itens com as colunas de NOTE_COLUMNS que lhes faltam copiadas do
+    cabeçalho pela chave de acesso (nulas para chaves fora do cabeçalho).
+    """
+    missing = [column for column in NOTE_COLUMNS if column not in df_itens and column in df_cabecalho]
+    if not missing or 'CHAVE DE ACESSO' not in df_cabecalho:
+        return df_itens
+    header = df_cabecalho.drop_duplicates('CHAVE DE ACESSO')
+    notes = header[missing].set_axis(header['CHAVE DE ACESSO'].astype(str))
+    joined = notes.reindex(df_itens['CHAVE DE ACESSO'].astype(str))
+    return df_itens.assign(**{column: joined[column].to_numpy() for column in missing})
+
+
+class ItemFactStore:
+    """
+    Itens das notas em uma tabela fato (uma linha por nota e número do item)
+    com chaves inteiras para as dimensões de nota, emitente, destinatário,
+    produto/NCM e CFOP. A classificação é feita por item: uma nota com itens
+    de venda e de compra conta nas duas operações.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    @staticmethod
+    def init_schema(conn):
+        for statement in SCHEMA:
+            conn.execute(statement)
+        # Tabelas fato anteriores à dimensão de natureza da operação
+        columns = {row[1] for row in conn.execute(f"PRAGMA table_info({FACTS_TABLE})")}
+        if 'natureza_id' not in columns:
+            conn.execute(f"ALTER TABLE {FACTS_TABLE} ADD COLUMN natureza_id INTEGER")
+        ItemFactStore._create_indexes(conn)
+
+    @staticmethod
+    def _create_indexes(conn):
+        for index_name, columns in FACT_INDEXES.items():
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {FACTS_TABLE} ({', '.join(columns)})")
+
+    def has_items(self) -> bool:
+        with self.pool.connection() as conn:
+            return conn.execute(f"SELECT 1 FROM {FACTS_TABLE} LIMIT 1").fetchone() is not None
+
+    def remove_notes(self, keys: Iterable[str]):
+        """
+        Apaga os itens gravados das notas com essas chaves de acesso.
+        """
+        with self.pool.transaction() as conn:
+            conn.executemany(
+                f"DELETE FROM {FACTS_TABLE} WHERE nota_id = (SELECT id FROM {NOTES_TABLE} WHERE chave_acesso = ?)",
+                ((str(key),) for key in keys)
+            )
+
+    def bulk_load(self, df_itens: pd.DataFrame, rules: FiscalRules, chunk_size: int = 50000,
+                  progress: Callable[[str, int], None] = None, df_cabecalho: pd.DataFrame = None,
+                  replace: bool = True) -> int:
+        """
+        Codifica as dimensões das colunas inteiras (cada valor distinto é
+        procurado e classificado uma vez) e grava os itens em lote, em uma
+        única transação. Os itens já gravados das notas recebidas são
+        substituídos; numa carga em blocos, em que os itens de uma nota podem
+        vir em blocos diferentes, eles são apagados antes com `remove_notes`
+        e os blocos usam replace=False.
+        As colunas da nota ausentes nos itens vêm de `df_cabecalho`; sem as
+        colunas necessárias, a carga é ignorada (os documentos classificados
+        não dependem dela).
+        """
+        if df_itens.empty:
+            return 0
+        if df_cabecalho is not None:
+            df_itens = with_note_columns(df_itens, df_cabecalho)
+        missing = [column for column in REQUIRED_COLUMNS if column not in df_itens]
+        if missing:
+            print(f"Tabela fato de itens não atualizada: faltam as colunas {', '.join(missing)}.")
+            return 0
+
+        with span("gravacao_itens"), self.pool.transaction() as conn:
+            known_notes = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {NOTES_TABLE}").fetchone()[0] if replace else 0
+            note_ids = NOTES.encode(conn, df_itens, ['CHAVE DE ACESSO'], self._note_attributes)
+            issuer_ids = ISSUERS.encode(conn, df_itens, ['RAZÃO SOCIAL EMITENTE'])
+            recipient_ids = RECIPIENTS.encode(conn, df_itens, ['NOME DESTINATÁRIO'])
+            if 'NATUREZA DA OPERAÇÃO' in df_itens:
+                nature_ids = NATURES.encode(conn, df_itens, ['NATUREZA DA OPERAÇÃO'])
+            else:
+                nature_ids = np.full(len(df_itens), -1, dtype=np.int64)
+            product_ids = PRODUCTS.encode(
+                conn, df_itens, ['CÓDIGO NCM/SH', 'DESCRIÇÃO DO PRODUTO/SERVIÇO'],
+                lambda sample: [(sector,) for sector in rules.sector.lookup_column(sample['CÓDIGO NCM/SH'])]
+            )
+            cfop_ids = CFOPS.encode(
+                conn, df_itens, ['CFOP'],
+                lambda sample: list(zip(*rules.classify_cfop_column(sample['CFOP'].astype(str))))
+            )
+
+            # Notas que já estavam na base têm os itens anteriores apagados
+            reloaded = np.unique(note_ids[(note_ids >= 0) & (note_ids <= known_notes)])
+            if len(reloaded):
+                conn.executemany(f"DELETE FROM {FACTS_TABLE} WHERE nota_id = ?", ((int(i),) for i in reloaded))
+            # Numa tabela vazia, criar os índices depois da carga é mais rápido que mantê-los a cada linha
+            empty = conn.execute(f"SELECT 1 FROM {FACTS_TABLE} LIMIT 1").fetchone() is None
+            if empty:
+                for index_name in FACT_INDEXES:
+                    conn.execute(f"DROP INDEX IF EXISTS {index_name}")
+
+            if 'NÚMERO PRODUTO' in df_itens:
+                item_numbers = df_itens['NÚMERO PRODUTO'].fillna(0).astype(np.int64).to_numpy()
+            else:
+                item_numbers = df_itens.groupby('CHAVE DE ACESSO', observed=True, sort=False).cumcount().to_numpy() + 1
+            months = month_keys(df_itens['DATA EMISSÃO'])
+
+            # Ordem da chave primária: inserções sequenciais na árvore B
+            order = np.lexsort((item_numbers, note_ids))
+            valid = order[note_ids[order] >= 0]
+            columns = [
+                _sql_values(note_ids[valid]), item_numbers[valid].tolist(),
+                _sql_values(issuer_ids[valid]), _sql_values(recipient_ids[valid]),
+                _sql_values(product_ids[valid]), _sql_values(cfop_ids[valid]), _sql_values(nature_ids[valid]),
+                months[valid].tolist(),
+                df_itens['QUANTIDADE'].to_numpy()[valid].tolist(),
+                df_itens['VALOR TOTAL'].to_numpy()[valid].tolist(),
+            ]
+            rows = list(zip(*columns))
+            insert = (
+                f"INSERT OR REPLACE INTO {FACTS_TABLE} (nota_id, numero_item, emitente_id, destinatario_id, "
+                "produto_id, cfop_id, natureza_id, mes, quantidade, valor_total) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+            )
+            for start in range(0, len(rows), chunk_size):
+                chunk = rows[start:start + chunk_size]
+                conn.executemany(insert, chunk)
+                if progress:
+                    progress(PROGRESS_ITEMS_STORED, len(chunk))
+            if empty:
+                self._create_indexes(conn)
+        count("fiscal_itens_gravados_total", len(rows))
+        return len(rows)
+
+    @staticmethod
+    def _note_attributes(sample: pd.DataFrame) -> List[Tuple]:
+        dates = sample['DATA EMISSÃO']
+        return list(zip(_text_values(dates), month_keys(dates).tolist()))
+
+    @staticmethod
+    def _where(criteria: Dict) -> Tuple[str, List]:
+        """
+        Filtros sobre a tabela fato: valores de dimensão viram listas de ids
+        (resolvidas na dimensão, que é pequena) e datas no início de um mês
+        viram o mês inteiro.
+        """
+        where = " WHERE 1=1"
+        params = []
+        for name, value in criteria.items():
+            if name in FILTERS:
+                column, table = FILTERS[name]
+                where += f" AND {column} IN (SELECT id FROM {table} WHERE {name} = ?)"
+                params.append(value)
+            elif name in ('data_inicio', 'data_fim'):
+                month = month_key(value)
+                operator = '>=' if name == 'data_inicio' else '<'
+                if month != NO_MONTH and value in (month_start(month), month_start(month)[:7]):
+                    where += f" AND mes != {NO_MONTH} AND mes {operator} ?"
+                    params.append(month)
+                else:
+                    where += f" AND nota_id IN (SELECT id FROM {NOTES_TABLE} WHERE data_emissao {operator} ?)"
+                    params.append(value)
+            else:
+                raise ValueError(f"Critério não suportado: {name}")
+        return where, params
+
+    def count_documents(self, criteria: Dict) -> int:
+        """
+        Notas com ao menos um item que atende aos critérios.
+        """
+        where, params = self._where(criteria)
+        with self.pool.connection() as conn:
+            return conn.execute(f"SELECT COUNT(DISTINCT nota_id) FROM {FACTS_TABLE}{where}", params).fetchone()[0]
+
+    def aggregate(self, group_by: str, criteria: Dict = None) -> List[Dict]:
+        """
+        Quantidade de itens e soma de valor_total por grupo. O agrupamento é
+        feito sobre a chave inteira da tabela fato e só depois os poucos ids
+        distintos são traduzidos (e somados) pelo rótulo da dimensão.
+        """
+        if group_by not in GROUPINGS:
+            raise ValueError(f"Agrupamento não suportado: {group_by}")
+        column, table, label = GROUPINGS[group_by]
+        where, params = self._where(criteria or {})
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                f"SELECT {column}, COUNT(*), COALESCE(SUM(valor_total), 0) FROM {FACTS_TABLE}{where} GROUP BY {column}",
+                params
+            ).fetchall()
+            labels = DIMENSIONS[table].labels(conn, label) if table else None
+
+        totals: Dict[Optional[str], List] = {}
+        for key, quantity, value in rows:
+            group = labels.get(key) if labels is not None else key
+            entry = totals.setdefault(group, [0, 0.0])
+            entry[0] += quantity
+            entry[1] += value
+        return sorted(
+            ({group_by: group, 'itens': quantity, 'valor_total': value}
+             for group, (quantity, value) in totals.items()),
+            key=lambda entry: entry['valor_total'], reverse=True
+        )
+
+    def get_distinct_sectors(self) -> List[str]:
+        """
+        Setores dos itens gravados, em ordem alfabética.
+        """
+        return sorted(entry['setor'] for entry in self.aggregate('setor') if entry['setor'] is not None)
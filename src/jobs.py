@@ -0,0 +1,294 @@
+# Fila de tarefas em segundo plano (classificação e upload)
+
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+# Estados possíveis de uma tarefa
+PENDING = "pendente"
+RUNNING = "executando"
+DONE = "concluido"
+FAILED = "erro"
+CANCELLED = "cancelado"
+
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+JOB_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+# Sufixo do arquivo que pede o cancelamento de uma tarefa de outro processo
+CANCEL_SUFFIX = ".cancelar"
+
+
+class JobCancelled(Exception):
+    """
+    Lançada dentro da tarefa quando o cancelamento foi solicitado.
+    """
+
+
+class Job:
+    """
+    Uma tarefa submetida à fila, com progresso e pedido de cancelamento.
+
+    A função da tarefa recebe o próprio Job e deve chamar `report` (direta ou
+    indiretamente, via callback de progresso dos agentes) para publicar o
+    andamento; `report` também interrompe a tarefa se ela foi cancelada.
+    """
+
+    def __init__(self, kind: str):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = PENDING
+        self.stage = None
+        self.progress: Dict[str, int] = {}
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel_event = threading.Event()
+        self._lock = threading.Lock()
+        # Revisão incrementada a cada mudança, para quem acompanha a tarefa em tempo real
+        self.revision = 0
+        self._changed = threading.Condition(self._lock)
+        # Chamado após cada mudança (gravação do estado para outros processos)
+        self.on_change: Optional[Callable[["Job"], None]] = None
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def report(self, stage: str, amount: int = 0):
+        """
+        Soma `amount` ao contador da etapa e verifica o cancelamento.
+        """
+        if self._cancel_event.is_set():
+            raise JobCancelled()
+        with self._lock:
+            self.stage = stage
+            self.progress[stage] = self.progress.get(stage, 0) + int(amount)
+            self._notify()
+        if self.on_change:
+            self.on_change(self)
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def update(self, **fields):
+        """
+        Altera estado, resultado ou erro e avisa quem aguarda em `wait_for_change`.
+        """
+        with self._lock:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self._notify()
+        if self.on_change:
+            self.on_change(self)
+
+    def _notify(self):
+        self.revision += 1
+        self._changed.notify_all()
+
+    def wait_for_change(self, revision: int, timeout: float) -> int:
+        """
+        Bloqueia até a tarefa passar da revisão `revision` (ou até `timeout`
+        segundos) e retorna a revisão atual.
+        """
+        with self._lock:
+            self._changed.wait_for(lambda: self.revision != revision, timeout)
+            return self.revision
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "job_id": self.id,
+                "tipo": self.kind,
+                "estado": self.status,
+                "etapa": self.stage,
+                "progresso": dict(self.progress),
+                "resultado": self.result,
+                "erro": self.error,
+                "criado_em": self.created_at,
+                "iniciado_em": self.started_at,
+                "finalizado_em": self.finished_at,
+            }
+
+
+class StoredJob(Job):
+    """
+    Tarefa executada por outro processo, lida do arquivo de estado que ele
+    grava. Acompanhar a tarefa relê o arquivo periodicamente; cancelar grava
+    um pedido que o processo dono verifica.
+    """
+
+    poll_interval = 0.5
+
+    def __init__(self, path: str, data: Dict):
+        super().__init__(data["tipo"])
+        self.path = path
+        self._apply(data)
+
+    def _apply(self, data: Dict):
+        self.id = data["job_id"]
+        self.status = data["estado"]
+        self.stage = data["etapa"]
+        self.progress = data["progresso"]
+        self.result = data["resultado"]
+        self.error = data["erro"]
+        self.created_at = data["criado_em"]
+        self.started_at = data["iniciado_em"]
+        self.finished_at = data["finalizado_em"]
+
+    def refresh(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data != self.to_dict():
+            with self._lock:
+                self._apply(data)
+                self.revision += 1
+
+    def wait_for_change(self, revision: int, timeout: float) -> int:
+        deadline = time.monotonic() + timeout
+        while self.revision == revision and time.monotonic() < deadline:
+            time.sleep(min(self.poll_interval, max(0.0, deadline - time.monotonic())))
+            self.refresh()
+        return self.revision
+
+    def cancel(self):
+        with open(self.path + CANCEL_SUFFIX, "w"):
+            pass
+
+
+class JobManager:
+    """
+    Executa tarefas em um pool de threads local, sem depender de broker externo.
+
+    Com `state_dir`, o estado de cada tarefa é gravado em disco para que
+    outros processos (workers do servidor) possam consultá-la, acompanhá-la
+    e cancelá-la.
+    """
+
+    def __init__(self, max_workers: int = 2, max_finished: int = 100, state_dir: Optional[str] = None,
+                 persist_interval: float = 0.5):
+        self.max_finished = max_finished
+        self.state_dir = state_dir
+        self.persist_interval = persist_interval
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fiscal-job")
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._persisted: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def _state_path(self, job_id: str) -> str:
+        return os.path.join(self.state_dir, f"{job_id}.json")
+
+    def _persist(self, job: Job):
+        """
+        Grava o estado da tarefa: mudanças de estado sempre, progresso no
+        máximo a cada `persist_interval` segundos. Também recebe os pedidos
+        de cancelamento feitos em outros processos.
+        """
+        snapshot = job.to_dict()
+        now = time.monotonic()
+        last = self._persisted.get(job.id)
+        if last is not None and last[1] == snapshot["estado"] and now - last[0] < self.persist_interval:
+            return
+        self._persisted[job.id] = (now, snapshot["estado"])
+
+        path = self._state_path(job.id)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False, default=str)
+        os.replace(tmp_path, path)
+        if not job.finished and os.path.exists(path + CANCEL_SUFFIX):
+            job.cancel()
+
+    def submit(self, kind: str, fn: Callable[[Job], Any]) -> Job:
+        """
+        Agenda `fn(job)` e retorna imediatamente o Job criado.
+        """
+        job = Job(kind)
+        if self.state_dir:
+            # O diretório de estado é criado na primeira tarefa, não na inicialização
+            os.makedirs(self.state_dir, exist_ok=True)
+            job.on_change = self._persist
+            self._persist(job)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job, fn)
+        return job
+
+    def _run(self, job: Job, fn: Callable[[Job], Any]):
+        if job.cancel_requested:
+            job.update(status=CANCELLED, finished_at=time.time())
+            return
+
+        job.update(status=RUNNING, started_at=time.time())
+        try:
+            result = fn(job)
+            job.update(result=result, status=DONE, finished_at=time.time())
+        except JobCancelled:
+            job.update(status=CANCELLED, finished_at=time.time())
+        except Exception as e:
+            job.update(error=str(e), status=FAILED, finished_at=time.time())
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in FINISHED_STATES]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+            self._persisted.pop(job_id, None)
+            if self.state_dir:
+                for path in (self._state_path(job_id), self._state_path(job_id) + CANCEL_SUFFIX):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+    def _load_stored(self, job_id: str) -> Optional[StoredJob]:
+        path = self._state_path(job_id)
+        try:
+            with open(path, encoding="utf-8") as f:
+                return StoredJob(path, json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.state_dir and JOB_ID_PATTERN.fullmatch(job_id):
+            job = self._load_stored(job_id)
+        return job
+
+    def list(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        if self.state_dir and os.path.isdir(self.state_dir):
+            known = {job.id for job in jobs}
+            for name in sorted(os.listdir(self.state_dir)):
+                job_id, ext = os.path.splitext(name)
+                if ext == ".json" and JOB_ID_PATTERN.fullmatch(job_id) and job_id not in known:
+                    stored = self._load_stored(job_id)
+                    if stored is not None:
+                        jobs.append(stored)
+        return jobs
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """
+        Solicita o cancelamento; a tarefa para no próximo ponto de verificação.
+        """
+        job = self.get(job_id)
+        if job is not None and job.status not in FINISHED_STATES:
+            job.cancel()
+        return job
@@ -0,0 +1,455 @@
+# Respostas a perguntas livres com um LLM gerando código pandas
+
+import ast
+import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.llms import LLM
+from langchain_core.tools import Tool
+
+from intents import normalize_question
+from metrics import COUNTER, get_metrics, span
+
+# Modelo real no formato "provedor:modelo" (ex.: "openai:gpt-4o-mini"); sem
+# ele é usado o modelo local determinístico
+LLM_MODEL_ENV = "FISCAL_LLM_MODEL"
+# Orçamento por pergunta: tokens do prompt e tempo total (segundos)
+TOKEN_BUDGET_ENV = "FISCAL_LLM_TOKEN_BUDGET"
+TIME_BUDGET_ENV = "FISCAL_LLM_TIME_BUDGET"
+
+DEFAULT_TOKEN_BUDGET = 2000
+DEFAULT_COMPLETION_TOKENS = 256
+DEFAULT_TIME_BUDGET = 10.0
+DEFAULT_MAX_BATCH = 8
+DEFAULT_BATCH_WINDOW = 0.01
+
+# Resposta do modelo quando a pergunta não pode ser respondida com os dados
+NO_ANSWER = "SEM_RESPOSTA"
+
+PROMPT_PREFIX = f"""Você é um analista fiscal. Responda à pergunta escrevendo UMA única expressão
+Python/pandas sobre os DataFrames `df_cabecalho` (uma linha por nota fiscal) e
+`df_itens` (uma linha por item, ligados pela coluna 'CHAVE DE ACESSO').
+Use apenas `pd` e as funções len, round, sum, min, max, abs e sorted.
+Não importe módulos nem grave arquivos. Se a pergunta não puder ser
+respondida com os dados, responda apenas {NO_ANSWER}.
+"""
+
+SAMPLE_VALUES = 3
+MAX_RESULT_ROWS = 20
+
+ALLOWED_NAMES = {"df_cabecalho", "df_itens", "pd", "len", "round", "sum", "min", "max", "abs", "sorted"}
+# Únicas funções acessíveis a partir de `pd`: nada de módulos internos
+# (pd.io.common.os...), leitura ou gravação de arquivos
+ALLOWED_PANDAS_FUNCTIONS = {"to_datetime", "to_numeric", "NamedAgg", "Grouper", "Timestamp"}
+# Únicos atributos dos DataFrames, Series, agrupamentos e acessores .str/.dt
+ALLOWED_ATTRIBUTES = {
+    "abs", "agg", "aggregate", "all", "any", "astype", "between", "clip", "columns", "contains", "copy",
+    "count", "cumcount", "cumsum", "date", "day", "describe", "diff", "drop", "drop_duplicates", "dropna",
+    "dt", "dtypes", "empty", "endswith", "fillna", "first", "groupby", "head", "idxmax", "idxmin", "iloc",
+    "index", "isin", "isna", "last", "len", "loc", "lower", "max", "mean", "median", "merge", "min", "mode",
+    "month", "name", "nlargest", "notna", "nsmallest", "nunique", "pct_change", "pivot_table", "prod",
+    "quantile", "quarter", "rank", "rename", "replace", "reset_index", "round", "set_index", "shape", "shift",
+    "size", "sort_index", "sort_values", "split", "startswith", "std", "str", "strftime", "strip", "sum", "tail",
+    "to_dict", "to_frame", "to_list", "to_period", "to_string", "unique", "upper", "value_counts", "values",
+    "var", "year",
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimativa de tokens (cerca de 4 caracteres por token).
+    """
+    return len(text) // 4 + 1
+
+
+class BudgetExceeded(Exception):
+    """
+    A consulta ultrapassou o orçamento de tokens ou de tempo.
+    """
+
+
+class LocalFiscalLLM(LLM):
+    """
+    Modelo local determinístico que gera código pandas para perguntas
+    frequentes. Substitui um LLM real em testes e ambientes sem chave de API.
+    """
+
+    @property
+    def _llm_type(self) -> str:
+        return "local-fiscal"
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        question = normalize_question(prompt.rsplit("Pergunta:", 1)[-1].split("\n", 1)[0])
+        numbers = re.findall(r"\b\d+\b", question)
+        n = numbers[0] if numbers else "5"
+
+        by_value = "['VALOR NOTA FISCAL'].sum().sort_values(ascending=False)"
+        if re.search(r"\bpor (uf|estado)", question):
+            return f"df_cabecalho.groupby('UF EMITENTE', observed=True){by_value}"
+        if re.search(r"\bpor municipio", question):
+            return f"df_cabecalho.groupby('MUNICÍPIO EMITENTE', observed=True){by_value}.head({n})"
+        if re.search(r"\bpor natureza", question):
+            return f"df_cabecalho.groupby('NATUREZA DA OPERAÇÃO', observed=True){by_value}"
+        if "destinatario" in question:
+            return f"df_cabecalho.groupby('NOME DESTINATÁRIO', observed=True){by_value}.head({n})"
+        if re.search(r"produtos? mais caros?|maior valor unitario", question):
+            return f"df_itens.nlargest({n}, 'VALOR UNITÁRIO')[['DESCRIÇÃO DO PRODUTO/SERVIÇO', 'VALOR UNITÁRIO']]"
+        if re.search(r"itens por nota", question):
+            return "round(df_itens.groupby('CHAVE DE ACESSO', observed=True).size().mean(), 2)"
+        if re.search(r"quantas notas|numero de notas", question):
+            return "len(df_cabecalho)"
+        if re.search(r"quantos itens|numero de itens", question):
+            return "len(df_itens)"
+        if re.search(r"maior nota|nota de maior valor", question):
+            return "df_cabecalho['VALOR NOTA FISCAL'].max()"
+        if re.search(r"menor nota|nota de menor valor", question):
+            return "df_cabecalho['VALOR NOTA FISCAL'].min()"
+        return NO_ANSWER
+
+
+def get_llm():
+    """
+    Modelo configurado em FISCAL_LLM_MODEL ou, na ausência, o modelo local.
+    """
+    model = os.environ.get(LLM_MODEL_ENV)
+    if not model:
+        return LocalFiscalLLM()
+    try:
+        from langchain.chat_models import init_chat_model
+        return init_chat_model(model, temperature=0, max_tokens=DEFAULT_COMPLETION_TOKENS)
+    except Exception as e:
+        print(f"Não foi possível carregar o modelo {model}, usando o modelo local: {e}")
+        return LocalFiscalLLM()
+
+
+def schema_summary(df_cabecalho: pd.DataFrame, df_itens: pd.DataFrame, samples: int = SAMPLE_VALUES) -> str:
+    """
+    Descrição das tabelas para o prompt: colunas, tipos e alguns valores.
+    """
+    lines = []
+    for name, df in (("df_cabecalho", df_cabecalho), ("df_itens", df_itens)):
+        lines.append(f"{name} ({len(df)} linhas):")
+        for column in df.columns:
+            line = f"  - '{column}' ({df[column].dtype})"
+            if samples:
+                values = df[column].dropna().unique()[:samples]
+                line += ": " + ", ".join(str(value) for value in values)
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def validate_code(code: str) -> ast.Expression:
+    """
+    Aceita apenas uma expressão sobre os DataFrames: nomes, funções de `pd`
+    e atributos de uma lista fechada, sem importações, módulos, arquivos
+    ou avaliação dinâmica.
+    """
+    tree = ast.parse(code, mode="eval")
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id not in ALLOWED_NAMES:
+            raise ValueError(f"Nome não permitido: {node.id}")
+        if isinstance(node, ast.Attribute):
+            from_pandas = isinstance(node.value, ast.Name) and node.value.id == "pd"
+            if node.attr not in (ALLOWED_PANDAS_FUNCTIONS if from_pandas else ALLOWED_ATTRIBUTES):
+                raise ValueError(f"Atributo não permitido: {node.attr}")
+    return tree
+
+
+def format_result(result) -> str:
+    """
+    Converte o resultado do código em texto para a resposta.
+    """
+    if isinstance(result, pd.DataFrame):
+        return result.head(MAX_RESULT_ROWS).to_string(index=False)
+    if isinstance(result, pd.Series):
+        result = result.head(MAX_RESULT_ROWS)
+        return "\n".join(
+            f"{index}: {value:,.2f}" if isinstance(value, (float, np.floating)) else f"{index}: {value}"
+            for index, value in result.items()
+        )
+    if isinstance(result, (float, np.floating)):
+        return f"{result:,.2f}"
+    return str(result)
+
+
+def question_pattern(question: str) -> Tuple[str, List[str]]:
+    """
+    Padrão da pergunta: texto normalizado com os números trocados por marcadores.
+    """
+    values = []
+
+    def placeholder(match):
+        values.append(match.group(0))
+        return f"<{len(values) - 1}>"
+
+    return re.sub(r"\b\d+\b", placeholder, normalize_question(question)), values
+
+
+def code_template(code: str, values: List[str]) -> Optional[str]:
+    """
+    Troca no código os números vindos da pergunta por marcadores, para que o
+    código seja reaproveitado por perguntas do mesmo padrão. Retorna None se
+    algum número não aparece exatamente uma vez no código.
+    """
+    template = code
+    for i, value in enumerate(values):
+        pattern = rf"(?<![\w.]){re.escape(value)}(?![\w.])"
+        if len(re.findall(pattern, template)) != 1:
+            return None
+        template = re.sub(pattern, f"§{i}§", template)
+    return template
+
+
+def fill_template(template: str, values: List[str]) -> str:
+    for i, value in enumerate(values):
+        template = template.replace(f"§{i}§", value)
+    return template
+
+
+class LLMBatcher:
+    """
+    Agrupa os prompts de requisições simultâneas: a primeira requisição
+    espera `window` segundos por outras (até `max_batch`) e todas seguem em
+    uma única chamada `llm.batch`. Prompts idênticos são enviados uma vez.
+    """
+
+    def __init__(self, llm, max_batch: int = DEFAULT_MAX_BATCH, window: float = DEFAULT_BATCH_WINDOW):
+        self.llm = llm
+        self.max_batch = max_batch
+        self.window = window
+        self.batches = 0
+        self.prompts = 0
+        self._queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(self, prompt: str) -> Future:
+        future = Future()
+        self._queue.put((prompt, future))
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="llm-batcher", daemon=True)
+                self._worker.start()
+        return future
+
+    def _run(self):
+        while True:
+            pending = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    pending.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            # Requisições que já desistiram (tempo esgotado) não são enviadas
+            pending = [(prompt, future) for prompt, future in pending if future.set_running_or_notify_cancel()]
+            prompts = list(dict.fromkeys(prompt for prompt, _ in pending))
+            if not prompts:
+                continue
+            self.batches += 1
+            self.prompts += len(prompts)
+            try:
+                outputs = self.llm.batch(prompts)
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+            completions = {prompt: getattr(output, "content", output) for prompt, output in zip(prompts, outputs)}
+            for prompt, future in pending:
+                future.set_result(completions[prompt])
+
+
+class LLMQueryEngine:
+    """
+    Responde perguntas livres pedindo ao LLM uma expressão pandas e
+    executando-a pela ferramenta LangChain `consulta_pandas`.
+
+    - O prefixo do prompt e o resumo do esquema são montados uma vez por
+      versão dos dados, sempre no início do prompt (prefixo estável).
+    - O código gerado é memorizado por padrão de pergunta (números viram
+      parâmetros), dispensando o LLM em perguntas repetidas.
+    - Requisições simultâneas são agrupadas em lotes (LLMBatcher).
+    - Cada requisição tem orçamento de tokens e de tempo.
+    """
+
+    def __init__(self, llm=None, token_budget: int = DEFAULT_TOKEN_BUDGET,
+                 completion_tokens: int = DEFAULT_COMPLETION_TOKENS, time_budget: float = DEFAULT_TIME_BUDGET,
+                 max_batch: int = DEFAULT_MAX_BATCH, batch_window: float = DEFAULT_BATCH_WINDOW):
+        self.llm = llm if llm is not None else get_llm()
+        self.token_budget = token_budget
+        self.completion_tokens = completion_tokens
+        self.time_budget = time_budget
+        self.batcher = LLMBatcher(self.llm, max_batch, batch_window)
+        self._prefixes: Dict[str, str] = {}
+        self._code_memo: Dict[Tuple[Tuple[str, ...], str], str] = {}
+        self._lock = threading.Lock()
+        self.memo_hits = 0
+        self.llm_requests = 0
+        self.budget_exceeded = 0
+
+    def prompt_prefix(self, version: str, df_cabecalho: pd.DataFrame, df_itens: pd.DataFrame) -> str:
+        """
+        Instruções e resumo do esquema, em cache por versão dos dados. Se não
+        couber no orçamento, o resumo é refeito sem os valores de exemplo.
+        """
+        prefix = self._prefixes.get(version)
+        if prefix is None:
+            prefix = PROMPT_PREFIX + "\nTabelas:\n" + schema_summary(df_cabecalho, df_itens)
+            if estimate_tokens(prefix) > self.token_budget - self.completion_tokens:
+                prefix = PROMPT_PREFIX + "\nTabelas:\n" + schema_summary(df_cabecalho, df_itens, samples=0)
+            with self._lock:
+                self._prefixes[version] = prefix
+        return prefix
+
+    def generate_code(self, question: str, version: str, df_cabecalho: pd.DataFrame,
+                      df_itens: pd.DataFrame, deadline: float) -> Optional[str]:
+        """
+        Código pandas para a pergunta (memorizado ou gerado pelo LLM).
+        Retorna None se o modelo não souber responder.
+        """
+        pattern, values = question_pattern(question)
+        columns = tuple(df_cabecalho.columns) + tuple(df_itens.columns)
+        memo_key = (columns, pattern)
+        template = self._code_memo.get(memo_key)
+        if template is not None:
+            self.memo_hits += 1
+            return fill_template(template, values)
+        code = self._code_memo.get((columns, normalize_question(question)))
+        if code is not None:
+            self.memo_hits += 1
+            return code
+
+        prompt = f"{self.prompt_prefix(version, df_cabecalho, df_itens)}\n\nPergunta: {question}\nCódigo:"
+        if estimate_tokens(prompt) > self.token_budget - self.completion_tokens:
+            self.budget_exceeded += 1
+            raise BudgetExceeded("A pergunta excede o orçamento de tokens da consulta.")
+
+        self.llm_requests += 1
+        future = self.batcher.submit(prompt)
+        try:
+            with span("llm_modelo"):
+                completion = future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeout:
+            future.cancel()
+            self.budget_exceeded += 1
+            raise BudgetExceeded("O modelo não respondeu dentro do tempo limite da consulta.")
+
+        code = completion.strip().strip("`").strip()
+        if code.startswith("python"):
+            code = code[len("python"):].strip()
+        if estimate_tokens(code) > self.completion_tokens:
+            self.budget_exceeded += 1
+            raise BudgetExceeded("A resposta do modelo excede o orçamento de tokens da consulta.")
+        if not code or code == NO_ANSWER:
+            return None
+
+        validate_code(code)
+        template = code_template(code, values)
+        with self._lock:
+            if template is not None:
+                self._code_memo[memo_key] = template
+            else:
+                self._code_memo[(columns, normalize_question(question))] = code
+        return code
+
+    def answer(self, question: str, version: str, df_cabecalho: pd.DataFrame,
+               df_itens: pd.DataFrame) -> Optional[str]:
+        """
+        Resposta calculada com os dados, ou None se o modelo não souber
+        responder ou gerar código inválido. Lança BudgetExceeded se o
+        orçamento da requisição for ultrapassado.
+        """
+        deadline = time.monotonic() + self.time_budget
+        try:
+            code = self.generate_code(question, version, df_cabecalho, df_itens, deadline)
+            if code is None:
+                return None
+            with span("llm_execucao"):
+                result = pandas_tool(df_cabecalho, df_itens).invoke(code)
+        except BudgetExceeded:
+            raise
+        except Exception as e:
+            print(f"Código gerado para '{question}' não pôde ser executado: {e}")
+            return None
+
+        if time.monotonic() > deadline:
+            self.budget_exceeded += 1
+            raise BudgetExceeded("A consulta excedeu o tempo limite.")
+        return f"Resultado calculado a partir dos dados:\n{format_result(result)}"
+
+    def stats(self) -> Dict:
+        return {
+            "requisicoes_llm": self.llm_requests,
+            "lotes": self.batcher.batches,
+            "prompts_enviados": self.batcher.prompts,
+            "codigo_memorizado": self.memo_hits,
+            "orcamento_excedido": self.budget_exceeded,
+        }
+
+
+def pandas_tool(df_cabecalho: pd.DataFrame, df_itens: pd.DataFrame) -> Tool:
+    """
+    Ferramenta LangChain que avalia uma expressão pandas validada sobre os DataFrames.
+    """
+    namespace = {"__builtins__": {}, "df_cabecalho": df_cabecalho, "df_itens": df_itens, "pd": pd,
+                 "len": len, "round": round, "sum": sum, "min": min, "max": max, "abs": abs, "sorted": sorted}
+
+    def run(code: str):
+        tree = validate_code(code)
+        return eval(compile(tree, "<consulta>", "eval"), namespace)
+
+    return Tool(name="consulta_pandas", func=run,
+                description="Avalia uma expressão pandas sobre df_cabecalho e df_itens")
+
+
+_engine: Optional[LLMQueryEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_llm_engine() -> LLMQueryEngine:
+    """
+    Motor compartilhado pelo processo (um único agrupador de requisições).
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = LLMQueryEngine(
+                    token_budget=int(os.environ.get(TOKEN_BUDGET_ENV, DEFAULT_TOKEN_BUDGET)),
+                    time_budget=float(os.environ.get(TIME_BUDGET_ENV, DEFAULT_TIME_BUDGET)),
+                )
+    return _engine
+
+
+def _collect_metrics():
+    # Sem motor criado (nenhuma pergunta livre ainda) não há o que exportar
+    if _engine is None:
+        return []
+    return [(f"fiscal_llm_{name}_total", COUNTER, value, {}) for name, value in _engine.stats().items()]
+
+
+_metrics = get_metrics()
+_metrics.describe("fiscal_llm_requisicoes_llm_total", "Perguntas livres enviadas ao modelo de linguagem")
+_metrics.describe("fiscal_llm_lotes_total", "Lotes de prompts enviados ao modelo")
+_metrics.describe("fiscal_llm_prompts_enviados_total", "Prompts distintos enviados ao modelo")
+_metrics.describe("fiscal_llm_codigo_memorizado_total", "Perguntas livres respondidas com código memorizado")
+_metrics.describe("fiscal_llm_orcamento_excedido_total", "Perguntas livres interrompidas pelo orçamento de tokens ou tempo")
+_metrics.register_collector(_collect_metrics)
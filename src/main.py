@@ -1,48 +1,105 @@
 import os
 import sys
+import threading
 # DON'T CHANGE THIS !!!
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+# Módulos de src (métricas, agentes) importados pelo nome, como nas rotas:
+# `metrics` e `src.metrics` seriam dois módulos com métricas separadas
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from flask import Flask, send_from_directory
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from src.models.user import db
-from src.routes.user import user_bp
-from src.routes.fiscal_agents import fiscal_bp
-from flask import Flask, send_from_directory
+from metrics import span
+from src.routes.fiscal_agents import UploadRequest, fiscal_bp, preload_modules, registry
+
+
+class InstrumentedJSONProvider(DefaultJSONProvider):
+    """
+    Serialização JSON das respostas medida como uma etapa nas métricas.
+    """
+
+    def dumps(self, obj, **kwargs):
+        with span("serializacao_json"):
+            return super().dumps(obj, **kwargs)
+
+
+def create_app(preload_datasets: bool = False, restore_latest: bool = False) -> Flask:
+    """
+    Cria a aplicação. Com preload_datasets=True os módulos pesados e os
+    conjuntos já enviados são carregados na criação (no processo mestre do
+    gunicorn, antes do fork). Sem ele a inicialização é rápida: pandas e
+    langchain são importados no primeiro uso, as tabelas de usuários são
+    criadas na primeira requisição e, com restore_latest=True, o último
+    conjunto é restaurado em segundo plano enquanto o servidor já atende.
+    """
+    # O SQLAlchemy é importado aqui, e não na importação deste módulo
+    from src.models.user import create_tables, db
+    from src.routes.user import user_bp
+
+    app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
+    app.json = InstrumentedJSONProvider(app)
+    # Uploads gravados direto no diretório de destino enquanto são recebidos
+    app.request_class = UploadRequest
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'asdf#FGSgvasgf$5$WGT')
+
+    # Enable CORS for all routes
+    CORS(app)
+
+    app.register_blueprint(user_bp, url_prefix='/api')
+    app.register_blueprint(fiscal_bp, url_prefix='/api')
 
-app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
-app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
-
-# Enable CORS for all routes
-CORS(app)
-
-app.register_blueprint(user_bp, url_prefix='/api')
-app.register_blueprint(fiscal_bp, url_prefix='/api')
-
-# uncomment if you need to use database
-app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db.init_app(app)
-with app.app_context():
-    db.create_all()
-
-@app.route('/', defaults={'path': ''})
-@app.route('/<path:path>')
-def serve(path):
-    static_folder_path = app.static_folder
-    if static_folder_path is None:
-            return "Static folder not configured", 404
-
-    if path != "" and os.path.exists(os.path.join(static_folder_path, path)):
-        return send_from_directory(static_folder_path, path)
-    else:
-        index_path = os.path.join(static_folder_path, 'index.html')
-        if os.path.exists(index_path):
-            return send_from_directory(static_folder_path, 'index.html')
+    # uncomment if you need to use database
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+
+    @app.route('/', defaults={'path': ''})
+    @app.route('/<path:path>')
+    def serve(path):
+        static_folder_path = app.static_folder
+        if static_folder_path is None:
+                return "Static folder not configured", 404
+
+        if path != "" and os.path.exists(os.path.join(static_folder_path, path)):
+            return send_from_directory(static_folder_path, path)
         else:
-            return "index.html not found", 404
+            index_path = os.path.join(static_folder_path, 'index.html')
+            if os.path.exists(index_path):
+                return send_from_directory(static_folder_path, 'index.html')
+            else:
+                return "index.html not found", 404
 
+    if preload_datasets:
+        preload_modules()
+        with app.app_context():
+            create_tables()
+        loaded = registry.preload()
+        print(f"{loaded} conjunto(s) de dados pré-carregado(s)")
+    elif restore_latest:
+        threading.Thread(target=registry.get, name="fiscal-restauracao", daemon=True).start()
 
-if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    return app
+
+
+def preload_enabled() -> bool:
+    """
+    FISCAL_PRELOAD (padrão 1) pede a carga antecipada; 0 liga a inicialização rápida.
+    """
+    return os.environ.get("FISCAL_PRELOAD", "1").lower() not in ("0", "false", "nao")
 
+
+def __getattr__(name):
+    # `from src.main import app` (o ponto de entrada original) continua
+    # valendo: a aplicação é criada no primeiro acesso, como em src/wsgi.py,
+    # e importar o módulo segue sem efeitos
+    if name != "app":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    global app
+    preload = preload_enabled()
+    app = create_app(preload_datasets=preload, restore_latest=not preload)
+    return app
+
+
+if __name__ == '__main__':
+    create_app(restore_latest=True).run(host='0.0.0.0', port=5000, debug=True)
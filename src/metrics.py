@@ -0,0 +1,281 @@
+# Instrumentação: spans de tempo, contadores e exportação no formato Prometheus
+
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Limites (segundos) dos histogramas de duração
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+SPAN_METRIC = "fiscal_etapa_segundos"
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+# Rótulos ordenados, usados como chave das séries
+LabelKey = Tuple[Tuple[str, str], ...]
+
+# Amostra devolvida pelos coletores: (nome, tipo, valor, rótulos)
+Sample = Tuple[str, str, float, Dict[str, str]]
+
+HELP = {
+    SPAN_METRIC: "Duração das etapas (carga, merge, classificação, gravação, consulta...)",
+    "fiscal_requisicao_segundos": "Duração das requisições HTTP até o início da resposta",
+    "fiscal_linhas_lidas_total": "Linhas lidas dos arquivos de notas fiscais",
+    "fiscal_documentos_classificados_total": "Documentos classificados",
+    "fiscal_documentos_gravados_total": "Documentos gravados na base de documentos classificados",
+    "fiscal_itens_gravados_total": "Itens gravados na tabela fato de itens",
+    "fiscal_busca_indexados_total": "Descrições e nomes incluídos no índice de busca textual",
+    "fiscal_documentos_exportados_total": "Documentos classificados exportados, por formato",
+    "fiscal_intencoes_total": "Perguntas respondidas, por intenção reconhecida",
+    "fiscal_respostas_aproximadas_total": "Respostas calculadas pelos esboços da análise aproximada, por consulta",
+}
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class MetricsRegistry:
+    """
+    Contadores e histogramas em memória, exportados no formato texto do
+    Prometheus sem depender de coletor externo.
+
+    Com `state_dir`, cada processo grava periodicamente um retrato das suas
+    métricas e a exportação soma os retratos dos processos vivos: com vários
+    workers, qualquer um deles responde pelo servidor inteiro.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.state_dir: Optional[str] = None
+        self.snapshot_interval = 5.0
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        # Por série: contagem em cada faixa (+Inf por último), soma e total
+        self._histograms: Dict[str, Dict[LabelKey, List[float]]] = {}
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+        self._help: Dict[str, str] = dict(HELP)
+        self._lock = threading.Lock()
+        self._writer_pid = None
+        os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def configure(self, state_dir: str, snapshot_interval: float = 5.0):
+        # O diretório é criado pela thread que grava os retratos, no primeiro uso
+        self.state_dir = state_dir
+        self.snapshot_interval = snapshot_interval
+
+    def describe(self, name: str, help_text: str):
+        self._help[name] = help_text
+
+    def register_collector(self, collector: Callable[[], Iterable[Sample]]):
+        """
+        Função chamada a cada exportação, para valores mantidos em outros objetos (caches, conjuntos).
+        """
+        self._collectors.append(collector)
+
+    def _reset_after_fork(self):
+        """
+        Um processo criado por fork herda as métricas do pai, que continua
+        exportando as suas: o filho recomeça do zero (e com um lock novo, que
+        no pai poderia estar ocupado no momento do fork).
+        """
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def _check_process(self):
+        pid = os.getpid()
+        if self.state_dir and self._writer_pid != pid:
+            self._writer_pid = pid
+            threading.Thread(target=self._write_snapshots, name="fiscal-metricas", daemon=True).start()
+
+    def inc(self, name: str, amount: float = 1.0, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._check_process()
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + amount
+
+    def observe(self, name: str, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._check_process()
+            series = self._histograms.setdefault(name, {})
+            counts = series.get(key)
+            if counts is None:
+                counts = series[key] = [0.0] * (len(self.buckets) + 3)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """
+        Mede a duração do bloco no histograma de etapas.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(SPAN_METRIC, time.perf_counter() - start, etapa=name)
+
+    def snapshot(self) -> Dict:
+        """
+        Métricas deste processo, incluindo as dos coletores, em formato serializável.
+        """
+        with self._lock:
+            self._check_process()
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            histograms = {name: {key: list(counts) for key, counts in series.items()}
+                          for name, series in self._histograms.items()}
+        gauges: Dict[str, Dict[LabelKey, float]] = {}
+        for collector in self._collectors:
+            for name, kind, value, labels in collector():
+                target = counters if kind == COUNTER else gauges
+                series = target.setdefault(name, {})
+                key = _label_key(labels)
+                series[key] = series.get(key, 0.0) + value
+        return {"counters": counters, "gauges": gauges, "histograms": histograms}
+
+    def _snapshot_path(self, pid: int) -> str:
+        return os.path.join(self.state_dir, f"{pid}.json")
+
+    def _write_snapshot(self):
+        encoded = {
+            kind: {name: [[list(map(list, key)), value] for key, value in series.items()]
+                   for name, series in metrics.items()}
+            for kind, metrics in self.snapshot().items()
+        }
+        path = self._snapshot_path(os.getpid())
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(encoded, f)
+        os.replace(tmp_path, path)
+
+    def _write_snapshots(self):
+        while self._writer_pid == os.getpid():
+            try:
+                os.makedirs(self.state_dir, exist_ok=True)
+                self._write_snapshot()
+            except OSError as e:
+                print(f"Não foi possível gravar as métricas: {e}")
+            time.sleep(self.snapshot_interval)
+
+    def _other_processes(self) -> Iterator[Dict]:
+        """
+        Retratos gravados pelos outros processos vivos (os de processos encerrados são apagados).
+        """
+        if not os.path.isdir(self.state_dir):
+            return
+        for name in os.listdir(self.state_dir):
+            pid_text, ext = os.path.splitext(name)
+            if ext != ".json" or not pid_text.isdigit() or int(pid_text) == os.getpid():
+                continue
+            path = os.path.join(self.state_dir, name)
+            try:
+                os.kill(int(pid_text), 0)
+            except ProcessLookupError:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            except PermissionError:
+                pass
+            try:
+                with open(path, encoding="utf-8") as f:
+                    encoded = json.load(f)
+            except (OSError, ValueError):
+                continue
+            yield {
+                kind: {name: {tuple(map(tuple, key)): value for key, value in series}
+                       for name, series in metrics.items()}
+                for kind, metrics in encoded.items()
+            }
+
+    def collect(self) -> Dict:
+        """
+        Métricas deste processo somadas às dos demais processos que gravam no mesmo diretório.
+        """
+        merged = self.snapshot()
+        if not self.state_dir:
+            return merged
+        for other in self._other_processes():
+            for kind in ("counters", "gauges"):
+                for name, series in other.get(kind, {}).items():
+                    target = merged[kind].setdefault(name, {})
+                    for key, value in series.items():
+                        target[key] = target.get(key, 0.0) + value
+            for name, series in other.get("histograms", {}).items():
+                target = merged["histograms"].setdefault(name, {})
+                for key, counts in series.items():
+                    current = target.get(key)
+                    target[key] = counts if current is None else [a + b for a, b in zip(current, counts)]
+        return merged
+
+    def render(self) -> str:
+        """
+        Exportação no formato texto do Prometheus (version 0.0.4).
+        """
+        merged = self.collect()
+        lines = []
+
+        def header(name, kind):
+            lines.append(f"# HELP {name} {self._help.get(name, name)}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for kind, metric_type in (("counters", COUNTER), ("gauges", GAUGE)):
+            for name in sorted(merged[kind]):
+                header(name, metric_type)
+                for key, value in sorted(merged[kind][name].items()):
+                    lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+
+        bounds = [_format_value(bound) for bound in self.buckets] + ["+Inf"]
+        for name in sorted(merged["histograms"]):
+            header(name, HISTOGRAM)
+            for key, counts in sorted(merged["histograms"][name].items()):
+                cumulative = 0.0
+                for bound, count in zip(bounds, counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(key, (('le', bound),))} {_format_value(cumulative)}")
+                lines.append(f"{name}_sum{_format_labels(key)} {_format_value(counts[-2])}")
+                lines.append(f"{name}_count{_format_labels(key)} {_format_value(counts[-1])}")
+        return "\n".join(lines) + "\n"
+
+
+_metrics = MetricsRegistry()
+
+
+def get_metrics() -> MetricsRegistry:
+    """
+    Registro de métricas compartilhado pelo processo.
+    """
+    return _metrics
+
+
+def span(name: str):
+    return _metrics.span(name)
+
+
+def count(name: str, amount: float = 1.0, **labels):
+    _metrics.inc(name, amount, **labels)
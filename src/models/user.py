@@ -1,7 +1,14 @@
+import os
+import threading
+
 from flask_sqlalchemy import SQLAlchemy
 
 db = SQLAlchemy()
 
+# Bases cujas tabelas já foram criadas neste processo
+_created_databases = set()
+_create_lock = threading.Lock()
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -16,3 +23,20 @@ class User(db.Model):
             'username': self.username,
             'email': self.email
         }
+
+
+def create_tables():
+    """
+    Cria o diretório da base e as tabelas na primeira requisição que as usa,
+    uma única vez por base (chamada dentro do contexto da aplicação).
+    """
+    url = db.engine.url
+    if str(url) in _created_databases:
+        return
+    with _create_lock:
+        if str(url) in _created_databases:
+            return
+        if url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:'):
+            os.makedirs(os.path.dirname(os.path.abspath(url.database)), exist_ok=True)
+        db.create_all()
+        _created_databases.add(str(url))
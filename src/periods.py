@@ -0,0 +1,187 @@
+# Meses de emissão e períodos citados nas perguntas
+
+import re
+from typing import Iterable, List, Optional, Tuple
+
+MONTHS = {
+    "janeiro": 1, "fevereiro": 2, "marco": 3, "abril": 4, "maio": 5, "junho": 6,
+    "julho": 7, "agosto": 8, "setembro": 9, "outubro": 10, "novembro": 11, "dezembro": 12,
+}
+
+MONTH_NAMES = {number: name for name, number in MONTHS.items()}
+MONTH_NAMES[3] = "março"
+
+QUARTERS = {"primeiro": 1, "segundo": 2, "terceiro": 3, "quarto": 4}
+
+# Chave dos documentos sem data de emissão válida
+NO_MONTH = 0
+
+_MONTH = "|".join(MONTHS)
+_YEAR = r"(?P<ano>(?:19|20)\d{2})"
+
+# Padrões sobre a pergunta normalizada (minúsculas, sem acentos), do mais específico ao mais geral
+_QUARTER_RE = re.compile(
+    rf"\b(?:(?P<numero>[1-4])o?|(?P<ordinal>{'|'.join(QUARTERS)})) trimestre(?: (?:de |do ano de )?{_YEAR})?\b"
+)
+_RANGE_RE = re.compile(rf"\b(?:de|entre) (?P<inicio>{_MONTH}) (?:a|ate|e) (?P<fim>{_MONTH})(?: de {_YEAR})?\b")
+_ISO_RE = re.compile(rf"\b{_YEAR}-(?P<mes>0[1-9]|1[0-2])\b")
+_MONTH_RE = re.compile(rf"\b(?P<mes>{_MONTH})(?:(?: de | do ano de |/| ){_YEAR})?\b")
+_NUMERIC_RE = re.compile(rf"\bmes (?P<mes>0?[1-9]|1[0-2])(?:(?: de |/){_YEAR})?\b")
+_YEAR_RE = re.compile(rf"\b(?:em|de|no ano de|durante) {_YEAR}\b")
+
+
+def month_key(value) -> int:
+    """
+    Mês AAAAMM de uma data no formato 'AAAA-MM-DD ...' (NO_MONTH se inválida).
+    """
+    text = str(value) if value is not None else ""
+    if len(text) >= 7 and text[:4].isdigit() and text[4] == "-" and text[5:7].isdigit():
+        month = int(text[5:7])
+        if 1 <= month <= 12:
+            return int(text[:4]) * 100 + month
+    return NO_MONTH
+
+
+def month_keys(dates: "pd.Series") -> "np.ndarray":
+    """
+    month_key vetorizado sobre uma coluna de datas. O pandas é importado
+    aqui para que as perguntas (intents) sejam interpretadas sem ele.
+    """
+    import numpy as np
+    import pandas as pd
+
+    parsed = pd.to_datetime(dates.astype(object), format="ISO8601", errors="coerce")
+    keys = parsed.dt.year * 100 + parsed.dt.month
+    return keys.fillna(NO_MONTH).astype(np.int64).to_numpy()
+
+
+def add_months(key: int, months: int) -> int:
+    index = (key // 100) * 12 + (key % 100 - 1) + months
+    return (index // 12) * 100 + index % 12 + 1
+
+
+def month_start(key: int) -> str:
+    """
+    Primeiro instante do mês, no formato das datas de emissão.
+    """
+    return f"{key // 100:04d}-{key % 100:02d}-01"
+
+
+def months_between(first: int, last: int) -> List[int]:
+    """
+    Meses de `first` até `last`, inclusive.
+    """
+    months = []
+    while first <= last:
+        months.append(first)
+        first = add_months(first, 1)
+    return months
+
+
+def overlapping_months(months: Iterable[int], start: Optional[str], end: Optional[str]) -> List[int]:
+    """
+    Meses (AAAAMM) que têm algum instante no intervalo [start, end) de datas
+    em texto; NO_MONTH fica sempre, pois datas inválidas não têm mês.
+    """
+    selected = []
+    for key in months:
+        if key != NO_MONTH:
+            if start is not None and month_start(add_months(key, 1)) <= start:
+                continue
+            if end is not None and month_start(key) >= end:
+                continue
+        selected.append(key)
+    return selected
+
+
+class Period:
+    """
+    Intervalo de meses citado em uma pergunta. Sem ano (ex.: "em março"),
+    `year` é None e o período é resolvido contra o ano mais recente dos dados.
+    """
+
+    def __init__(self, first_month: int, last_month: int, year: Optional[int] = None):
+        self.first_month = first_month
+        self.last_month = last_month
+        self.year = year
+
+    def months(self, default_year: int) -> Tuple[int, int]:
+        """
+        Primeiro mês e mês seguinte ao último, em AAAAMM.
+        """
+        year = self.year or default_year
+        return year * 100 + self.first_month, add_months(year * 100 + self.last_month, 1)
+
+    def bounds(self, default_year: int) -> Tuple[str, str]:
+        """
+        Datas de início (inclusiva) e fim (exclusiva) do período.
+        """
+        start, end = self.months(default_year)
+        return month_start(start), month_start(end)
+
+    def label(self, default_year: int) -> str:
+        year = self.year or default_year
+        if (self.first_month, self.last_month) == (1, 12):
+            return f"em {year}"
+        if self.first_month == self.last_month:
+            return f"em {MONTH_NAMES[self.first_month]} de {year}"
+        if self.first_month % 3 == 1 and self.last_month == self.first_month + 2:
+            return f"no {self.last_month // 3}º trimestre de {year}"
+        return f"de {MONTH_NAMES[self.first_month]} a {MONTH_NAMES[self.last_month]} de {year}"
+
+    def __eq__(self, other):
+        return isinstance(other, Period) and vars(self) == vars(other)
+
+    def __repr__(self):
+        return f"Period({self.first_month}, {self.last_month}, {self.year})"
+
+
+def _year(match) -> Optional[int]:
+    return int(match.group("ano")) if match.group("ano") else None
+
+
+def _match_period(text: str) -> Tuple[Optional[Period], Optional[re.Match]]:
+    match = _QUARTER_RE.search(text)
+    if match:
+        quarter = int(match.group("numero")) if match.group("numero") else QUARTERS[match.group("ordinal")]
+        return Period(quarter * 3 - 2, quarter * 3, _year(match)), match
+
+    match = _RANGE_RE.search(text)
+    if match:
+        first, last = MONTHS[match.group("inicio")], MONTHS[match.group("fim")]
+        if first <= last:
+            return Period(first, last, _year(match)), match
+
+    match = _ISO_RE.search(text)
+    if match:
+        month = int(match.group("mes"))
+        return Period(month, month, _year(match)), match
+
+    match = _MONTH_RE.search(text) or _NUMERIC_RE.search(text)
+    if match:
+        value = match.group("mes")
+        month = MONTHS[value] if value in MONTHS else int(value)
+        return Period(month, month, _year(match)), match
+
+    match = _YEAR_RE.search(text)
+    if match:
+        return Period(1, 12, _year(match)), match
+    return None, None
+
+
+def parse_period(text: str) -> Optional[Period]:
+    """
+    Período citado na pergunta normalizada: trimestre, intervalo de meses,
+    mês (por nome, 'mes N' ou AAAA-MM) ou ano inteiro.
+    """
+    return _match_period(text)[0]
+
+
+def strip_period(text: str) -> str:
+    """
+    Texto normalizado sem o trecho que cita o período (o mesmo que parse_period reconhece).
+    """
+    _, match = _match_period(text)
+    if match is None:
+        return text
+    return " ".join((text[:match.start()] + " " + text[match.end():]).split())
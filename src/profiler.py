@@ -0,0 +1,90 @@
+# Profiler por amostragem das requisições
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+# Intervalo padrão entre amostras (segundos)
+DEFAULT_INTERVAL = 0.001
+
+# Profundidade máxima das pilhas registradas
+MAX_DEPTH = 64
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Amostra periodicamente a pilha de uma thread (a que atende a requisição)
+    a partir de outra thread, sem instrumentar as funções: o custo para a
+    thread medida é só a disputa pelo GIL a cada amostra.
+
+    O resultado usa o formato de pilhas "colapsadas" (funções separadas por
+    ';' e o número de amostras), aceito pelas ferramentas de flame graph.
+    """
+
+    def __init__(self, thread_id: Optional[int] = None, interval: float = DEFAULT_INTERVAL):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._started_at = 0.0
+        self.duration = 0.0
+
+    def start(self) -> "SamplingProfiler":
+        self._started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="fiscal-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < MAX_DEPTH:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self) -> "SamplingProfiler":
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.duration = time.perf_counter() - self._started_at
+        return self
+
+    def top_functions(self, limit: int = 20) -> List[Dict]:
+        """
+        Funções com mais amostras no topo da pilha (tempo próprio) e em qualquer posição (tempo total).
+        """
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for stack, samples in self.stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += samples
+            for label in set(frames):
+                total[label] += samples
+        return [
+            {"funcao": label, "amostras_proprias": own[label], "amostras_totais": total[label]}
+            for label, _ in own.most_common(limit)
+        ]
+
+    def to_dict(self, max_stacks: int = 50) -> Dict:
+        return {
+            "amostras": self.samples,
+            "intervalo_ms": self.interval * 1000,
+            "duracao_ms": round(self.duration * 1000, 3),
+            "funcoes": self.top_functions(),
+            "pilhas": [f"{stack} {samples}" for stack, samples in self.stacks.most_common(max_stacks)],
+        }
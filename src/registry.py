@@ -0,0 +1,495 @@
+# Registro de conjuntos de dados enviados (vários usuários e uploads simultâneos)
+
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from answer_cache import get_answer_cache
+from storage import close_pool
+
+# Os agentes (e com eles pandas e langchain) são importados no primeiro
+# conjunto usado, e não na importação: o servidor sobe sem esperar por eles
+if TYPE_CHECKING:
+    from csv_query_agent import IntegratedFiscalAgent
+    from dataset import FiscalDataset
+    from fiscal_agent import FiscalDocumentAgent, ProgressCallback
+
+# Limite de memória dos conjuntos carregados, em MB (variável de ambiente)
+MEMORY_LIMIT_ENV = "FISCAL_DATASET_MEMORY_MB"
+DEFAULT_MEMORY_LIMIT_MB = 1024
+
+# Nome da base de documentos classificados dentro do diretório de cada conjunto
+DB_FILENAME = "documentos_fiscais.db"
+
+# Descrição do conjunto (arquivos de origem e agregados) gravada no seu
+# diretório e id do último conjunto publicado, na raiz dos dados. Com eles
+# qualquer processo (worker) restaura um conjunto enviado a outro.
+MANIFEST_FILENAME = "conjunto.json"
+LATEST_FILENAME = "ultimo_conjunto"
+
+DATASET_ID_PATTERN = re.compile(r"[0-9a-f]{12}")
+
+
+class DatasetInUse(Exception):
+    """
+    O conjunto não pode ser removido: ainda há requisições ou tarefas usando-o.
+    """
+
+
+class DatasetEntry:
+    """
+    Um conjunto de dados enviado, com seus arquivos, agregados e agentes.
+    """
+
+    def __init__(self, dataset_id: str, upload_dir: str, data_dir: str):
+        self.id = dataset_id
+        self.upload_dir = upload_dir
+        self.data_dir = data_dir
+        self.db_path = os.path.join(data_dir, DB_FILENAME)
+        self.manifest_path = os.path.join(data_dir, MANIFEST_FILENAME)
+        self.dataset: Optional["FiscalDataset"] = None
+        self.aggregates = None
+        self.streaming_sources = None
+        self.classification_agent: Optional["FiscalDocumentAgent"] = None
+        self.query_agent: Optional["IntegratedFiscalAgent"] = None
+        self.created_at = time.time()
+        self.last_access = self.created_at
+        # Requisições e tarefas usando o conjunto: com alguma, ele não é descarregado
+        self.leases = 0
+
+    @property
+    def ready(self) -> bool:
+        return self.classification_agent is not None
+
+    @property
+    def loaded(self) -> bool:
+        return self.dataset is not None and self.dataset.loaded
+
+    def memory_usage(self) -> int:
+        return self.dataset.memory_usage() if self.dataset is not None else 0
+
+    def load(self):
+        """
+        Carrega as tabelas (dos arquivos colunares, se já existirem) e entrega aos agentes.
+        """
+        if self.dataset is None or self.loaded:
+            return
+        self.dataset.load()
+        self.classification_agent.load_data()
+
+    def invalidate_answers(self):
+        """
+        Remove do cache de respostas as entradas deste conjunto.
+        """
+        cache = get_answer_cache()
+        if self.aggregates is not None:
+            cache.invalidate(version=self.aggregates.version)
+        if self.classification_agent is not None:
+            cache.invalidate(scope=self.classification_agent.organizer.cache_scope)
+
+    def release(self):
+        """
+        Tira as tabelas da memória; agregados, agentes e arquivos em disco permanecem.
+        """
+        if self.dataset is None:
+            return
+        self.classification_agent.release_data()
+        self.query_agent.release_data()
+        self.dataset.unload()
+
+    def write_manifest(self):
+        """
+        Grava o necessário para outro processo restaurar o conjunto sem reprocessá-lo.
+        """
+        agent = self.classification_agent
+        manifest = {
+            "dataset_id": self.id,
+            "criado_em": self.created_at,
+            "cabecalho": agent.cabecalho_path,
+            "itens": agent.itens_path,
+            "streaming": self.streaming_sources,
+            "agregados": self.aggregates.to_dict(),
+        }
+        _write_atomic(self.manifest_path, json.dumps(manifest, ensure_ascii=False))
+
+    def restore(self, manifest: Dict):
+        """
+        Recria agregados e agentes a partir do manifesto; as tabelas são
+        carregadas dos arquivos colunares apenas quando o conjunto for usado.
+        """
+        from aggregates import DatasetAggregates, register_aggregates
+        from csv_query_agent import IntegratedFiscalAgent
+        from dataset import FiscalDataset
+        from fiscal_agent import FiscalDocumentAgent
+
+        cabecalho_path, itens_path = manifest["cabecalho"], manifest["itens"]
+        self.created_at = self.last_access = manifest["criado_em"]
+        self.aggregates = DatasetAggregates.from_dict(manifest["agregados"])
+        register_aggregates(self.aggregates)
+        if manifest["streaming"]:
+            self.streaming_sources = tuple(tuple(source) for source in manifest["streaming"])
+            self.classification_agent = FiscalDocumentAgent(cabecalho_path, itens_path, db_path=self.db_path)
+            self.query_agent = IntegratedFiscalAgent(cabecalho_path, itens_path, aggregates=self.aggregates)
+        else:
+            self.dataset = FiscalDataset(cabecalho_path, itens_path)
+            self.classification_agent = FiscalDocumentAgent(cabecalho_path, itens_path, self.dataset, self.db_path)
+            self.query_agent = IntegratedFiscalAgent(cabecalho_path, itens_path, self.dataset)
+
+    def to_dict(self) -> Dict:
+        return {
+            "dataset_id": self.id,
+            "pronto": self.ready,
+            "streaming": self.streaming_sources is not None,
+            "carregado": self.loaded,
+            "memoria_bytes": self.memory_usage(),
+            "versao": self.aggregates.version if self.aggregates is not None else None,
+            "criado_em": self.created_at,
+            "ultimo_acesso": self.last_access,
+        }
+
+
+class DatasetRegistry:
+    """
+    Conjuntos de dados identificados pelo id devolvido no upload. Cada
+    conjunto tem seus próprios diretórios e base de documentos, de modo que
+    uploads simultâneos não se sobrescrevem.
+
+    Os conjuntos carregados em memória formam uma LRU limitada por bytes:
+    quando o limite é ultrapassado, os menos usados são descarregados e
+    recarregados sob demanda a partir dos arquivos colunares em disco.
+    Quem usa um conjunto o obtém com `acquire` e o devolve com `release`:
+    enquanto estiver em uso, ele não é descarregado.
+
+    A trava global protege apenas a LRU; restaurar e carregar as tabelas
+    acontecem fora dela, sob uma trava de cada conjunto, de modo que uma
+    carga demorada não bloqueia as requisições dos demais conjuntos.
+
+    Com vários processos (workers) cada um tem seu registro; o disco é a
+    fonte comum. Um id desconhecido é restaurado do manifesto gravado por
+    quem recebeu o upload, e um conjunto cujo manifesto sumiu (removido em
+    outro processo) é descartado.
+    """
+
+    def __init__(self, upload_root: str, data_root: str, max_memory_bytes: Optional[int] = None):
+        if max_memory_bytes is None:
+            max_memory_bytes = int(os.environ.get(MEMORY_LIMIT_ENV, DEFAULT_MEMORY_LIMIT_MB)) * 1024 * 1024
+        self.upload_root = upload_root
+        self.data_root = data_root
+        self.max_memory_bytes = max_memory_bytes
+        self._entries: "OrderedDict[str, DatasetEntry]" = OrderedDict()
+        self._latest_id: Optional[str] = None
+        self._latest_path = os.path.join(data_root, LATEST_FILENAME)
+        self._lock = threading.RLock()
+        self._load_locks: Dict[str, threading.Lock] = {}
+
+    def create(self) -> DatasetEntry:
+        """
+        Reserva um novo id com diretórios de upload e de dados vazios.
+        """
+        dataset_id = uuid.uuid4().hex[:12]
+        entry = DatasetEntry(
+            dataset_id,
+            os.path.join(self.upload_root, dataset_id),
+            os.path.join(self.data_root, dataset_id),
+        )
+        os.makedirs(entry.upload_dir, exist_ok=True)
+        os.makedirs(entry.data_dir, exist_ok=True)
+        with self._lock:
+            self._entries[dataset_id] = entry
+        return entry
+
+    def load_files(self, entry: DatasetEntry, cabecalho_path: str, itens_path: str,
+                   progress: "ProgressCallback" = None) -> DatasetEntry:
+        """
+        Carrega os CSVs do conjunto e prepara os agentes sobre os dados compartilhados.
+        """
+        from aggregates import get_aggregates
+        from csv_query_agent import IntegratedFiscalAgent
+        from dataset import FiscalDataset
+        from fiscal_agent import PROGRESS_PARSED, FiscalDocumentAgent
+
+        dataset = FiscalDataset(cabecalho_path, itens_path)
+        dataset.load()
+        if progress:
+            progress(PROGRESS_PARSED, len(dataset.df_cabecalho) + len(dataset.df_itens))
+        aggregates = get_aggregates(dataset)
+
+        entry.dataset = dataset
+        entry.aggregates = aggregates
+        entry.streaming_sources = None
+        entry.classification_agent = FiscalDocumentAgent(cabecalho_path, itens_path, dataset, entry.db_path)
+        entry.query_agent = IntegratedFiscalAgent(cabecalho_path, itens_path, dataset)
+        self._publish(entry)
+        print(f"Conjunto {entry.id} carregado com os arquivos: {cabecalho_path} e {itens_path}")
+        return entry
+
+    def load_stream(self, entry: DatasetEntry, archive_path: str, cabecalho_member: str, itens_member: str,
+                    progress: "ProgressCallback" = None) -> DatasetEntry:
+        """
+        Ingere o arquivo compactado em streaming; apenas os agregados ficam em memória.
+        """
+        from aggregates import register_aggregates
+        from csv_query_agent import IntegratedFiscalAgent
+        from fiscal_agent import FiscalDocumentAgent
+        from ingestion import StreamingIngestor
+
+        sources = ((archive_path, cabecalho_member), (archive_path, itens_member))
+        agent = FiscalDocumentAgent(cabecalho_member, itens_member, db_path=entry.db_path)
+        aggregates = StreamingIngestor(agent.classifier, agent.organizer).ingest(*sources, progress=progress)
+        register_aggregates(aggregates)
+
+        entry.dataset = None
+        entry.aggregates = aggregates
+        entry.streaming_sources = sources
+        entry.classification_agent = agent
+        entry.query_agent = IntegratedFiscalAgent(cabecalho_member, itens_member, aggregates=aggregates)
+        self._publish(entry)
+        print(f"Conjunto {entry.id} carregado em streaming a partir de {archive_path}")
+        return entry
+
+    def _publish(self, entry: DatasetEntry):
+        # Respostas antigas da mesma versão ou base deixam de valer com o novo upload
+        entry.invalidate_answers()
+        entry.write_manifest()
+        _write_atomic(self._latest_path, entry.id)
+        with self._lock:
+            self._entries[entry.id] = entry
+            self._entries.move_to_end(entry.id)
+            self._latest_id = entry.id
+            self._enforce_memory_limit(keep=entry.id)
+
+    def get(self, dataset_id: Optional[str] = None) -> Optional[DatasetEntry]:
+        """
+        Conjunto pelo id (ou o último carregado), recarregado se tiver sido descarregado.
+        """
+        entry = self.acquire(dataset_id)
+        if entry is not None:
+            self.release(entry)
+        return entry
+
+    def acquire(self, dataset_id: Optional[str] = None) -> Optional[DatasetEntry]:
+        """
+        Como `get`, mas o conjunto fica em uso (não é descarregado nem
+        removido) até ser devolvido em `release`.
+        """
+        dataset_id = dataset_id or self.latest_id
+        if not dataset_id or not DATASET_ID_PATTERN.fullmatch(dataset_id):
+            return None
+        entry = self._lookup(dataset_id)
+        load_lock = self._load_lock(dataset_id)
+
+        with self._lock:
+            if entry is None or not entry.ready or self._entries.get(entry.id) is not entry:
+                return None
+            entry.leases += 1
+            self._entries.move_to_end(entry.id)
+            entry.last_access = time.time()
+
+        try:
+            if entry.dataset is not None and not entry.loaded:
+                with load_lock:
+                    entry.load()
+                with self._lock:
+                    self._enforce_memory_limit(keep=entry.id)
+        except BaseException:
+            self.release(entry)
+            raise
+        return entry
+
+    def _load_lock(self, dataset_id: str) -> threading.Lock:
+        with self._lock:
+            return self._load_locks.setdefault(dataset_id, threading.Lock())
+
+    def _lookup(self, dataset_id: str) -> Optional[DatasetEntry]:
+        """
+        Conjunto registrado neste processo ou restaurado do manifesto. A
+        restauração (leitura do disco e do JSON) acontece fora da trava
+        global, sob a trava do conjunto.
+        """
+        with self._lock:
+            entry = self._entries.get(dataset_id)
+            if entry is not None and entry.ready and not os.path.exists(entry.manifest_path):
+                self._discard(entry)
+                entry = None
+        if entry is None:
+            with self._load_lock(dataset_id):
+                entry = self._entries.get(dataset_id) or self._restore(dataset_id)
+        return entry
+
+    def release(self, entry: DatasetEntry):
+        """
+        Devolve um conjunto obtido em `acquire`.
+        """
+        with self._lock:
+            entry.leases = max(entry.leases - 1, 0)
+
+    def _enforce_memory_limit(self, keep: str):
+        """
+        Descarrega os conjuntos menos usados até caber no limite (o atual e os em uso sempre ficam).
+        """
+        total = sum(entry.memory_usage() for entry in self._entries.values())
+        for entry in list(self._entries.values()):
+            if total <= self.max_memory_bytes:
+                break
+            if entry.id == keep or entry.leases or not entry.loaded:
+                continue
+            total -= entry.memory_usage()
+            entry.release()
+            print(f"Conjunto {entry.id} descarregado da memória (limite de {self.max_memory_bytes} bytes)")
+
+    def _restore(self, dataset_id: str) -> Optional[DatasetEntry]:
+        """
+        Restaura um conjunto publicado por outro processo (ou antes de um reinício).
+        """
+        entry = DatasetEntry(
+            dataset_id,
+            os.path.join(self.upload_root, dataset_id),
+            os.path.join(self.data_root, dataset_id),
+        )
+        try:
+            with open(entry.manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        entry.restore(manifest)
+        with self._lock:
+            # Outro acesso (upload, listagem) pode ter registrado o conjunto enquanto restaurávamos
+            return self._entries.setdefault(dataset_id, entry)
+
+    def _discard(self, entry: DatasetEntry):
+        """
+        Tira o conjunto deste processo (memória, caches e conexões), sem apagar arquivos.
+        """
+        self._entries.pop(entry.id, None)
+        self._load_locks.pop(entry.id, None)
+        if self._latest_id == entry.id:
+            self._latest_id = None
+        if entry.aggregates is not None:
+            from aggregates import invalidate_aggregates
+            invalidate_aggregates(entry.aggregates.version)
+        entry.invalidate_answers()
+        entry.release()
+        close_pool(entry.db_path)
+
+    def _stored_ids(self) -> List[str]:
+        """
+        Ids dos conjuntos publicados em disco, do mais antigo ao mais recente.
+        """
+        found = []
+        try:
+            names = os.listdir(self.data_root)
+        except FileNotFoundError:
+            return []
+        for name in names:
+            manifest_path = os.path.join(self.data_root, name, MANIFEST_FILENAME)
+            if DATASET_ID_PATTERN.fullmatch(name) and os.path.exists(manifest_path):
+                found.append((os.path.getmtime(manifest_path), name))
+        return [name for _, name in sorted(found)]
+
+    def list(self) -> List[DatasetEntry]:
+        """
+        Conjuntos publicados, inclusive os enviados a outros processos.
+        """
+        stored = self._stored_ids()
+        with self._lock:
+            for entry in list(self._entries.values()):
+                if entry.ready and entry.id not in stored:
+                    self._discard(entry)
+        for dataset_id in stored:
+            if dataset_id not in self._entries:
+                self._lookup(dataset_id)
+        with self._lock:
+            return [entry for entry in self._entries.values() if entry.ready]
+
+    def list_loaded(self) -> List[DatasetEntry]:
+        """
+        Conjuntos com as tabelas em memória neste processo (sem esperar por cargas em andamento).
+        """
+        return [entry for entry in list(self._entries.values()) if entry.loaded]
+
+    def preload(self) -> int:
+        """
+        Restaura os conjuntos em disco e carrega as tabelas dos mais recentes
+        enquanto couberem no limite de memória. Chamado no processo mestre
+        antes do fork, as tabelas ficam compartilhadas (copy-on-write) entre
+        os workers. Retorna o número de conjuntos carregados.
+        """
+        stored = self._stored_ids()
+        loaded, total = 0, 0
+        for dataset_id in reversed(stored):
+            entry = self._lookup(dataset_id)
+            if entry is None or total >= self.max_memory_bytes:
+                continue
+            with self._load_lock(dataset_id):
+                entry.load()
+            total += entry.memory_usage()
+            loaded += 1
+        with self._lock:
+            # Ordem da LRU: o mais recente por último
+            for dataset_id in stored:
+                if dataset_id in self._entries:
+                    self._entries.move_to_end(dataset_id)
+            self._enforce_memory_limit(keep=stored[-1] if stored else "")
+        return loaded
+
+    @property
+    def latest_id(self) -> Optional[str]:
+        """
+        Último conjunto publicado por qualquer processo.
+        """
+        try:
+            with open(self._latest_path, encoding="utf-8") as f:
+                return f.read().strip() or None
+        except OSError:
+            return self._latest_id
+
+    def remove(self, dataset_id: str) -> bool:
+        """
+        Remove o conjunto, seus agregados, a base de documentos e os
+        diretórios. Lança DatasetInUse se alguma requisição ou tarefa deste
+        processo ainda o usa (obtido em `acquire`).
+        """
+        if not DATASET_ID_PATTERN.fullmatch(dataset_id):
+            return False
+        entry = self._lookup(dataset_id)
+        if entry is None:
+            return False
+        with self._lock:
+            if entry.leases:
+                raise DatasetInUse(f"Conjunto de dados '{dataset_id}' em uso por "
+                                   f"{entry.leases} requisição(ões) ou tarefa(s).")
+            # Sem o manifesto, nenhum acesso concorrente volta a restaurar o conjunto
+            try:
+                os.remove(entry.manifest_path)
+            except OSError:
+                pass
+            self._discard(entry)
+
+            if self.latest_id == dataset_id:
+                stored = self._stored_ids()
+                if stored:
+                    _write_atomic(self._latest_path, stored[-1])
+                else:
+                    try:
+                        os.remove(self._latest_path)
+                    except OSError:
+                        pass
+        shutil.rmtree(entry.upload_dir, ignore_errors=True)
+        shutil.rmtree(entry.data_dir, ignore_errors=True)
+        return True
+
+
+def _write_atomic(path: str, content: str):
+    """
+    Grava o arquivo por inteiro ou não grava: outros processos nunca leem um arquivo pela metade.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
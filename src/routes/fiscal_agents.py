@@ -1,53 +1,243 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Request, Response, g, request, jsonify, stream_with_context
+import importlib
+import json
 import os
 import sys
-import zipfile
-import rarfile
-import shutil
-# O pandas não é mais necessário aqui, pois a identificação será pelo nome do arquivo.
-# import pandas as pd 
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+# Os CSVs do upload são identificados pela primeira linha, lida sem o pandas
 
 # Adiciona o diretório src ao path para importar os agentes
 current_dir = os.path.dirname(__file__)
 src_dir = os.path.dirname(current_dir)
 sys.path.insert(0, src_dir)
 
-from fiscal_agent import FiscalDocumentAgent
-from csv_query_agent import IntegratedFiscalAgent
+# Só módulos leves na importação: ingestão, exportação, agentes e LLM (com
+# pandas, rarfile e langchain) são importados nas rotas que os usam
+from jobs import FINISHED_STATES, JobCancelled, JobManager
+from registry import DatasetInUse, DatasetRegistry
+from intents import TARGET_CLASSIFICATION, get_intent_registry
+from answer_cache import get_answer_cache
+from metrics import GAUGE, count, get_metrics
+from profiler import SamplingProfiler
 
 fiscal_bp = Blueprint("fiscal", __name__)
 
 UPLOAD_FOLDER = os.path.join(src_dir, "uploads")
 DATA_FOLDER = os.path.join(src_dir, "data")
 
-# Garante que os diretórios existam
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(DATA_FOLDER, exist_ok=True)
+# Arquivos em recebimento: ficam no mesmo sistema de arquivos dos conjuntos
+# para que a gravação final seja um hard link, e não uma cópia
+RECEIVING_FOLDER = os.path.join(UPLOAD_FOLDER, ".recebendo")
+
+# Os diretórios são criados quando usados pela primeira vez (upload,
+# tarefas, métricas), e não na importação
 
 # --- GERENCIAMENTO DE ESTADO CENTRALIZADO ---
-# Mantemos esta melhoria: as variáveis são dinâmicas.
-global_cabecalho_path = None
-global_itens_path = None
-classification_agent = None
-query_agent = None
+# Cada upload gera um conjunto de dados com id próprio (diretórios, base e
+# agentes separados); os endpoints recebem o id em `dataset_id` e, sem ele,
+# usam o último conjunto carregado.
+registry = DatasetRegistry(UPLOAD_FOLDER, DATA_FOLDER)
+
+# Tarefas longas (classificação e upload) executadas em segundo plano. O
+# estado fica em disco para que qualquer worker do servidor responda por elas.
+job_manager = JobManager(state_dir=os.path.join(DATA_FOLDER, "tarefas"))
+
+# Consultas em streaming: a resposta é calculada fora da thread da conexão,
+# que fica livre para enviar eventos enquanto espera
+query_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="fiscal-query")
+
+# Intervalo (segundos) entre comentários de keep-alive nos fluxos de eventos
+SSE_KEEPALIVE = 15.0
+
+# Tamanho de página da listagem de documentos (padrão e máximo)
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
 
-def update_agents_with_new_data(cabecalho_path, itens_path):
+
+
+class UploadRequest(Request):
     """
-    Função central que atualiza o estado da aplicação com os novos dados.
+    Requisição que grava os arquivos enviados direto em disco, ao lado dos
+    diretórios dos conjuntos, à medida que o corpo chega (o padrão é um
+    temporário em memória ou em /tmp, copiado depois para o destino).
     """
-    global classification_agent, query_agent, global_cabecalho_path, global_itens_path
-    
-    global_cabecalho_path = cabecalho_path
-    global_itens_path = itens_path
-    
-    classification_agent = FiscalDocumentAgent(cabecalho_path, itens_path)
-    query_agent = IntegratedFiscalAgent(cabecalho_path, itens_path)
-    print(f"Agentes atualizados com os arquivos: {cabecalho_path} e {itens_path}")
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        os.makedirs(RECEIVING_FOLDER, exist_ok=True)
+        return tempfile.NamedTemporaryFile("w+b", dir=RECEIVING_FOLDER, prefix="upload-")
+
+
+def _save_upload(file, filepath):
+    """
+    Grava o arquivo enviado em `filepath` com um hard link quando ele já
+    está em disco (UploadRequest); senão, copia como antes.
+    """
+    received_path = getattr(file.stream, "name", None)
+    if isinstance(received_path, str) and os.path.exists(received_path):
+        file.stream.flush()
+        try:
+            os.link(received_path, filepath)
+            return
+        except OSError:
+            pass
+    file.save(filepath)
+
+# Módulos importados sob demanda pelas rotas e pelo registro de conjuntos
+LAZY_MODULES = ("fiscal_agent", "csv_query_agent", "ingestion", "export", "llm_agent", "rarfile")
+
+def preload_modules():
+    """
+    Importa de uma vez os módulos que as rotas carregam sob demanda (no
+    processo mestre, para que os workers os herdem já carregados).
+    """
+    for name in LAZY_MODULES:
+        importlib.import_module(name)
+
+# Métricas de todos os workers somadas em /api/metrics
+metrics = get_metrics()
+metrics.configure(os.path.join(DATA_FOLDER, "metricas"))
+
+# Perfil por amostragem sob demanda (?profile=1); FISCAL_PROFILING=0 desativa
+PROFILING_ENABLED = os.environ.get("FISCAL_PROFILING", "1").lower() not in ("0", "false", "nao")
+
+def _collect_dataset_metrics():
+    entries = registry.list_loaded()
+    return [
+        ("fiscal_conjuntos_carregados", GAUGE, len(entries), {}),
+        ("fiscal_conjuntos_memoria_bytes", GAUGE, sum(entry.memory_usage() for entry in entries), {}),
+    ]
+
+metrics.describe("fiscal_conjuntos_carregados", "Conjuntos de dados com as tabelas em memória")
+metrics.describe("fiscal_conjuntos_memoria_bytes", "Memória ocupada pelas tabelas dos conjuntos carregados")
+metrics.register_collector(_collect_dataset_metrics)
+
+@fiscal_bp.before_request
+def _start_request():
+    g.request_start = time.perf_counter()
+    if PROFILING_ENABLED and str(request.args.get("profile")).lower() in ("1", "true", "sim"):
+        g.profiler = SamplingProfiler(threading.get_ident()).start()
+
+@fiscal_bp.after_request
+def _finish_request(response):
+    """
+    Registra a duração da requisição e, se pedido, anexa o perfil à resposta JSON.
+    """
+    elapsed = time.perf_counter() - g.pop("request_start", time.perf_counter())
+    metrics.observe("fiscal_requisicao_segundos", elapsed, endpoint=request.endpoint or "desconhecido",
+                    metodo=request.method, status=response.status_code)
+
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.stop()
+        if response.is_json and not response.is_streamed:
+            payload = response.get_json()
+            if isinstance(payload, dict):
+                payload["perfil"] = profiler.to_dict()
+                response.set_data(json.dumps(payload, ensure_ascii=False))
+    return response
+
+def _request_option(name):
+    """
+    Lê uma opção da query string, do formulário ou do corpo JSON.
+    """
+    value = request.args.get(name) or request.form.get(name)
+    if value is None and request.is_json:
+        value = (request.get_json(silent=True) or {}).get(name)
+    return value
+
+def _wants_async():
+    """
+    Indica se o cliente pediu execução em segundo plano (?async=1 ou campo async).
+    """
+    return str(_request_option("async")).lower() in ("1", "true", "sim")
+
+def _get_entry():
+    """
+    Conjunto de dados indicado em `dataset_id` (ou o último carregado), em
+    uso até o fim da requisição (inclusive de respostas em fluxo).
+    """
+    if "dataset_entry" not in g:
+        g.dataset_entry = registry.acquire(_request_option("dataset_id"))
+    return g.dataset_entry
+
+@fiscal_bp.teardown_request
+def _release_entry(exc):
+    entry = g.pop("dataset_entry", None)
+    if entry is not None:
+        registry.release(entry)
+
+def _dataset_not_found():
+    dataset_id = _request_option("dataset_id")
+    if dataset_id:
+        return jsonify({"status": "error", "message": f"Conjunto de dados '{dataset_id}' não encontrado."}), 404
+    return None
+
+def _wants_stream():
+    """
+    Indica se o cliente pediu a resposta como fluxo de eventos (?stream=1 ou campo stream).
+    """
+    return str(_request_option("stream")).lower() in ("1", "true", "sim")
+
+def _submit_job(kind, fn, **extra):
+    job = job_manager.submit(kind, fn)
+    if _wants_stream():
+        return _event_stream(_job_events(job))
+    return jsonify({"status": "success", "job_id": job.id, "job": job.to_dict(), **extra}), 202
+
+def _sse(event, data):
+    """
+    Formata um evento Server-Sent Events com dados em JSON.
+    """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _event_stream(events):
+    """
+    Resposta text/event-stream enviada à medida que o gerador produz os eventos.
+    """
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(events), mimetype="text/event-stream", headers=headers)
+
+def _job_events(job):
+    """
+    Eventos 'progresso' a cada mudança da tarefa e um evento final com o
+    estado ('concluido', 'erro' ou 'cancelado'). Mudanças próximas são
+    agrupadas: cada evento traz o estado completo no momento do envio.
+    """
+    revision = -1
+    while True:
+        current = job.wait_for_change(revision, SSE_KEEPALIVE)
+        if current == revision:
+            yield ": keep-alive\n\n"
+            continue
+        revision = current
+        snapshot = job.to_dict()
+        if snapshot["estado"] in FINISHED_STATES:
+            yield _sse(snapshot["estado"], snapshot)
+            return
+        yield _sse("progresso", snapshot)
+
+def _run_as_job(process):
+    """
+    Adapta uma função que retorna (payload, status) para a fila de tarefas.
+    """
+    def run(job):
+        payload, status_code = process(job.report)
+        if status_code >= 400:
+            raise RuntimeError(payload["message"])
+        return payload
+    return run
 
 @fiscal_bp.route("/upload", methods=["POST"])
 def upload_file():
     """
-    Endpoint para upload. Extrai arquivos e os identifica pelo NOME.
+    Endpoint para upload. O arquivo é gravado em disco enquanto é recebido
+    e apenas os CSVs de cabeçalho e itens (identificados pela primeira
+    linha) são extraídos, direto para o diretório de dados. Cada upload
+    recebe um dataset_id usado pelos demais endpoints.
+    Com async=1 o processamento roda em segundo plano e é retornado um job_id.
     """
     if "file" not in request.files:
         return jsonify({"status": "error", "message": "Nenhum arquivo enviado"}), 400
@@ -56,89 +246,110 @@ def upload_file():
     if file.filename == "":
         return jsonify({"status": "error", "message": "Nenhum arquivo selecionado"}), 400
 
-    shutil.rmtree(UPLOAD_FOLDER)
-    os.makedirs(UPLOAD_FOLDER)
-    filepath = os.path.join(UPLOAD_FOLDER, file.filename)
-    file.save(filepath)
+    entry = registry.create()
+    filepath = os.path.join(entry.upload_dir, os.path.basename(file.filename))
+    _save_upload(file, filepath)
 
-    extracted_csv_paths = []
-    try:
-        if zipfile.is_zipfile(filepath):
-            with zipfile.ZipFile(filepath, "r") as zip_ref:
-                zip_ref.extractall(UPLOAD_FOLDER)
-        elif rarfile.is_rarfile(filepath):
-             with rarfile.RarFile(filepath, "r") as rar_ref:
-                rar_ref.extractall(UPLOAD_FOLDER)
-        elif filepath.endswith(".csv"):
-             # Adiciona o arquivo CSV único à lista para ser processado
-             extracted_csv_paths.append(filepath)
+    # Modo streaming: lê os CSVs direto do arquivo compactado, sem extraí-los
+    mode = request.form.get("mode")
+
+    def process(progress=None):
+        try:
+            payload, status_code = _process_upload(entry, filepath, mode, progress)
+        except BaseException:
+            registry.remove(entry.id)
+            raise
+        if status_code >= 400:
+            registry.remove(entry.id)
         else:
-            return jsonify({"status": "error", "message": "Formato de arquivo não suportado. Use .zip, .rar ou .csv."}), 400
+            payload["dataset_id"] = entry.id
+        return payload, status_code
+
+    if _wants_async() or _wants_stream():
+        return _submit_job("upload", _run_as_job(process), dataset_id=entry.id)
+
+    payload, status_code = process()
+    return jsonify(payload), status_code
+
+def _process_upload(entry, filepath, mode=None, progress=None):
+    """
+    Extrai e carrega o arquivo salvo no diretório do conjunto. Retorna (payload, status HTTP).
+    """
+    from ingestion import PROGRESS_EXTRACTED, extract_members, find_fiscal_members, list_archive_members
+
+    if mode == "stream":
+        return _upload_streaming(entry, filepath, progress)
+
+    if progress:
+        progress(PROGRESS_EXTRACTED, 0)
+
+    if filepath.lower().endswith(".csv"):
+        return {"status": "error", "message": "Não foi possível encontrar os arquivos de 'cabecalho' e 'itens' dentro do arquivo enviado. Verifique os nomes dos arquivos."}, 400
 
-        if not extracted_csv_paths:
-            for root, _, files in os.walk(UPLOAD_FOLDER):
-                for f in files:
-                    if f.endswith(".csv"):
-                        extracted_csv_paths.append(os.path.join(root, f))
+    try:
+        found_cabecalho, found_itens = find_fiscal_members(filepath)
+        if not (found_cabecalho or found_itens) and not list_archive_members(filepath):
+            return {"status": "error", "message": "Nenhum arquivo CSV encontrado dentro do arquivo compactado."}, 400
+    except ValueError:
+        return {"status": "error", "message": "Formato de arquivo não suportado. Use .zip, .rar ou .csv."}, 400
     except Exception as e:
-        return jsonify({"status": "error", "message": f"Erro ao extrair o arquivo: {str(e)}"}), 500
-        
-    # --- LÓGICA DE IDENTIFICAÇÃO REVERTIDA PARA O MÉTODO ORIGINAL (POR NOME) ---
-    found_cabecalho = None
-    found_itens = None
-    
-    # Validação para garantir que pelo menos um CSV foi encontrado
-    if not extracted_csv_paths:
-        return jsonify({"status": "error", "message": "Nenhum arquivo CSV encontrado dentro do arquivo compactado."}), 400
-
-    for path in extracted_csv_paths:
-        filename_lower = os.path.basename(path).lower()
-        if "cabecalho" in filename_lower:
-            found_cabecalho = path
-        elif "itens" in filename_lower:
-            found_itens = path
-
-    # Se a identificação foi bem-sucedida, processa os arquivos
-    if found_cabecalho and found_itens:
-        shutil.rmtree(DATA_FOLDER)
-        os.makedirs(DATA_FOLDER)
-        
-        # Usa o nome original do arquivo ao copiar, para clareza
-        new_cabecalho_path = os.path.join(DATA_FOLDER, os.path.basename(found_cabecalho))
-        new_itens_path = os.path.join(DATA_FOLDER, os.path.basename(found_itens))
-        shutil.copy(found_cabecalho, new_cabecalho_path)
-        shutil.copy(found_itens, new_itens_path)
-        
-        update_agents_with_new_data(new_cabecalho_path, new_itens_path)
-        
-        return jsonify({"status": "success", "message": "Arquivos processados e agentes atualizados!"})
-    else:
-        return jsonify({"status": "error", "message": "Não foi possível encontrar os arquivos de 'cabecalho' e 'itens' dentro do arquivo enviado. Verifique os nomes dos arquivos."}), 400
+        return {"status": "error", "message": f"Erro ao extrair o arquivo: {str(e)}"}, 500
+
+    if not (found_cabecalho and found_itens):
+        return {"status": "error", "message": "Não foi possível encontrar os arquivos de 'cabecalho' e 'itens' dentro do arquivo enviado. Verifique os nomes dos arquivos."}, 400
+
+    # Só os dois CSVs são extraídos, em paralelo e já no diretório de dados do conjunto
+    try:
+        cabecalho_path, itens_path = extract_members(filepath, [found_cabecalho, found_itens], entry.data_dir, progress)
+    except JobCancelled:
+        raise
+    except Exception as e:
+        return {"status": "error", "message": f"Erro ao extrair o arquivo: {str(e)}"}, 500
+
+    registry.load_files(entry, cabecalho_path, itens_path, progress)
+
+    return {"status": "success", "message": "Arquivos processados e agentes atualizados!"}, 200
+
+def _upload_streaming(entry, filepath, progress=None):
+    from ingestion import find_fiscal_members
+
+    try:
+        found_cabecalho, found_itens = find_fiscal_members(filepath)
+    except ValueError:
+        return {"status": "error", "message": "O modo streaming aceita apenas arquivos .zip ou .rar."}, 400
+    except Exception as e:
+        return {"status": "error", "message": f"Erro ao ler o arquivo: {str(e)}"}, 500
+
+    if not (found_cabecalho and found_itens):
+        return {"status": "error", "message": "Não foi possível encontrar os arquivos de 'cabecalho' e 'itens' dentro do arquivo enviado. Verifique os nomes dos arquivos."}, 400
+
+    try:
+        registry.load_stream(entry, filepath, found_cabecalho, found_itens, progress)
+    except JobCancelled:
+        raise
+    except Exception as e:
+        return {"status": "error", "message": f"Erro ao processar o arquivo: {str(e)}"}, 500
+
+    return {"status": "success", "message": "Arquivos processados em streaming e documentos classificados!"}, 200
 
 @fiscal_bp.route("/stats", methods=["GET"])
 def get_stats():
     """
-    Endpoint para buscar as estatísticas. Usa as variáveis globais de estado.
+    Endpoint para buscar as estatísticas do conjunto de dados.
     """
-    if not global_cabecalho_path or not os.path.exists(global_cabecalho_path) or not classification_agent:
+    entry = _get_entry()
+    if entry is None:
+        not_found = _dataset_not_found()
+        if not_found:
+            return not_found
         empty_stats = {
             "total_notas": 0, "total_itens": 0, "valor_total": 0.0, "valor_medio": 0.0
         }
         return jsonify({"status": "success", "stats": empty_stats})
 
     try:
-        classification_agent.load_data()
-        
-        df_cabecalho = classification_agent.df_cabecalho
-        df_itens = classification_agent.df_itens
-
-        stats = {
-            "total_notas": len(df_cabecalho),
-            "total_itens": len(df_itens),
-            "valor_total": float(df_cabecalho["VALOR NOTA FISCAL"].sum()),
-            "valor_medio": float(df_cabecalho["VALOR NOTA FISCAL"].mean()),
-        }
-        return jsonify({"status": "success", "stats": stats})
+        stats = entry.aggregates.stats()
+        return jsonify({"status": "success", "dataset_id": entry.id, "stats": stats})
     except Exception as e:
         return jsonify({"status": "error", "message": f"Erro ao calcular estatísticas: {str(e)}"}), 500
 
@@ -146,22 +357,138 @@ def get_stats():
 def classify_documents():
     """
     Endpoint para disparar a classificação dos documentos carregados.
+    Com async=1 a classificação roda em segundo plano e é retornado um job_id;
+    com stream=1 o progresso é enviado como Server-Sent Events até o fim;
+    workers=N classifica em paralelo com N processos; incremental=1 classifica
+    apenas as notas novas ou alteradas desde a última execução.
     """
-    if not classification_agent:
-        return jsonify({"status": "error", "message": "Nenhum arquivo foi carregado para classificar. Faça o upload primeiro."}), 400
+    entry = _get_entry()
+    if entry is None:
+        return _dataset_not_found() or (jsonify({"status": "error", "message": "Nenhum arquivo foi carregado para classificar. Faça o upload primeiro."}), 400)
+
+    # Captura o conjunto atual para que um novo upload não altere a tarefa em andamento
+    agent, sources = entry.classification_agent, entry.streaming_sources
     try:
-        classification_agent.process_documents()
-        return jsonify({"status": "success", "message": "Documentos classificados com sucesso!"})
+        workers = int(_request_option("workers") or 1)
+    except ValueError:
+        return jsonify({"status": "error", "message": "Parâmetro 'workers' inválido"}), 400
+    incremental = str(_request_option("incremental")).lower() in ("1", "true", "sim")
+
+    def process(progress=None):
+        processed = None
+        if sources:
+            from ingestion import StreamingIngestor
+            StreamingIngestor(agent.classifier, agent.organizer).ingest(*sources, progress=progress)
+        else:
+            processed = agent.process_documents(progress=progress, workers=workers, incremental=incremental)
+        return {"status": "success", "message": "Documentos classificados com sucesso!", "dataset_id": entry.id,
+                "documentos_processados": processed}, 200
+
+    if _wants_async() or _wants_stream():
+        def process_job(progress=None):
+            # A tarefa mantém o conjunto em uso (recarregado, se preciso) até terminar
+            job_entry = registry.acquire(entry.id)
+            if job_entry is None:
+                return {"status": "error", "message": f"Conjunto de dados '{entry.id}' removido."}, 404
+            try:
+                return process(progress)
+            finally:
+                registry.release(job_entry)
+
+        return _submit_job("classify", _run_as_job(process_job), dataset_id=entry.id)
+
+    try:
+        payload, status_code = process()
+        return jsonify(payload), status_code
     except Exception as e:
         return jsonify({"status": "error", "message": f"Erro ao classificar documentos: {str(e)}"}), 500
 
+@fiscal_bp.route("/datasets", methods=["GET"])
+def list_datasets():
+    """
+    Lista os conjuntos de dados carregados e o uso de memória de cada um.
+    """
+    return jsonify({
+        "status": "success",
+        "dataset_atual": registry.latest_id,
+        "datasets": [entry.to_dict() for entry in registry.list()],
+    })
+
+@fiscal_bp.route("/datasets/<dataset_id>", methods=["DELETE"])
+def delete_dataset(dataset_id):
+    """
+    Remove um conjunto de dados, seus arquivos e documentos classificados.
+    """
+    try:
+        removed = registry.remove(dataset_id)
+    except DatasetInUse as e:
+        return jsonify({"status": "error", "message": f"{e} Tente novamente ao fim do processamento."}), 409
+    if not removed:
+        return jsonify({"status": "error", "message": "Conjunto de dados não encontrado"}), 404
+    return jsonify({"status": "success", "message": f"Conjunto de dados '{dataset_id}' removido."})
+
+@fiscal_bp.route("/cache", methods=["GET"])
+def get_cache_stats():
+    """
+    Estatísticas do cache de respostas (acertos, falhas e ocupação) e do modelo de linguagem.
+    """
+    from llm_agent import get_llm_engine
+    return jsonify({"status": "success", "cache": get_answer_cache().stats(), "llm": get_llm_engine().stats()})
+
+@fiscal_bp.route("/metrics", methods=["GET"])
+def get_metrics_text():
+    """
+    Métricas no formato texto do Prometheus: duração das etapas e das
+    requisições, linhas lidas, documentos classificados e gravados, cache
+    de respostas e conjuntos em memória.
+    """
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+@fiscal_bp.route("/jobs", methods=["GET"])
+def list_jobs():
+    """
+    Lista as tarefas em segundo plano conhecidas.
+    """
+    return jsonify({"status": "success", "jobs": [job.to_dict() for job in job_manager.list()]})
+
+@fiscal_bp.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """
+    Estado e progresso (linhas lidas, classificadas e gravadas) de uma tarefa.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Tarefa não encontrada"}), 404
+    return jsonify({"status": "success", "job": job.to_dict()})
+
+@fiscal_bp.route("/jobs/<job_id>/events", methods=["GET"])
+def get_job_events(job_id):
+    """
+    Progresso de uma tarefa como Server-Sent Events, sem polling.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Tarefa não encontrada"}), 404
+    return _event_stream(_job_events(job))
+
+@fiscal_bp.route("/jobs/<job_id>/cancel", methods=["POST"])
+def cancel_job(job_id):
+    """
+    Solicita o cancelamento de uma tarefa em andamento.
+    """
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Tarefa não encontrada"}), 404
+    return jsonify({"status": "success", "job": job.to_dict()})
+
 @fiscal_bp.route("/query", methods=["POST"])
 def query_documents():
     """
     Endpoint para fazer perguntas em linguagem natural sobre os dados.
     """
-    if not query_agent:
-        return jsonify({"status": "error", "message": "Nenhum arquivo foi carregado para consultar. Faça o upload primeiro."}), 400
+    entry = _get_entry()
+    if entry is None:
+        return _dataset_not_found() or (jsonify({"status": "error", "message": "Nenhum arquivo foi carregado para consultar. Faça o upload primeiro."}), 400)
     
     data = request.get_json()
     question = data.get("question", "")
@@ -170,15 +497,161 @@ def query_documents():
         return jsonify({"status": "error", "message": "Pergunta não fornecida"}), 400
     
     try:
-        if any(keyword in question.lower() for keyword in ["classificação", "cfop", "setor", "centro de custo"]):
-            answer = classification_agent.query_documents(question)
-        else:
-            answer = query_agent.process_query(question)
-        
-        return jsonify({"status": "success", "question": question, "answer": answer})
+        # Uma única busca no registro escolhe o agente e a intenção
+        match = get_intent_registry().match(question)
+        answer = _answer(entry, question, match)
+        return jsonify({"status": "success", "dataset_id": entry.id, "question": question, "answer": answer})
     except Exception as e:
         return jsonify({"status": "error", "message": f"Erro ao processar consulta: {str(e)}"}), 500
 
+@fiscal_bp.route("/search", methods=["GET", "POST"])
+def search_documents():
+    """
+    Busca textual sobre descrições de produtos, emitentes, destinatários e
+    naturezas da operação: `q` com as palavras (prefixos, sem diferenciar
+    acentos), `tipo` com os tipos separados por vírgula e `limite`.
+    Os resultados vêm do mais ao menos relevante; com totais=1 trazem
+    também notas, itens, quantidade e valor dos itens de cada resultado.
+    """
+    entry = _get_entry()
+    if entry is None:
+        return _dataset_not_found() or (jsonify({"status": "error", "message": "Nenhum arquivo foi carregado para consultar. Faça o upload primeiro."}), 400)
+
+    text = _request_option("q") or ""
+    if not text.strip():
+        return jsonify({"status": "error", "message": "Texto de busca não fornecido"}), 400
+    kinds = [kind.strip() for kind in (_request_option("tipo") or "").split(",") if kind.strip()]
+    try:
+        limit = int(_request_option("limite") or 20)
+        with_totals = str(_request_option("totais")).lower() in ("1", "true", "sim")
+        results = entry.classification_agent.organizer.search.search(text, kinds=kinds, limit=limit,
+                                                                     with_totals=with_totals)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"status": "error", "message": f"Erro na busca: {str(e)}"}), 500
+    return jsonify({"status": "success", "dataset_id": entry.id, "q": text, "resultados": results})
+
+def _document_criteria():
+    """
+    Filtros da listagem e da exportação (mesmos nomes de DOCUMENT_FILTERS).
+    """
+    from fiscal_agent import DOCUMENT_FILTERS
+    return {name: _request_option(name) for name in DOCUMENT_FILTERS if _request_option(name)}
+
+@fiscal_bp.route("/documents", methods=["GET"])
+def list_documents():
+    """
+    Documentos classificados, em páginas de `limite` (máximo 1000) com
+    paginação por chave: a resposta traz `proximo_cursor`, enviado em
+    `cursor` para a página seguinte (ausente na última). Filtros:
+    tipo_operacao, centro_custo, setor, data_inicio e data_fim.
+    """
+    entry = _get_entry()
+    if entry is None:
+        return _dataset_not_found() or (jsonify({"status": "error", "message": "Nenhum arquivo foi carregado. Faça o upload primeiro."}), 400)
+
+    try:
+        limit = int(_request_option("limite") or DEFAULT_PAGE_SIZE)
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError(f"Parâmetro 'limite' deve estar entre 1 e {MAX_PAGE_SIZE}")
+        documents, next_cursor = entry.classification_agent.organizer.list_documents(
+            _document_criteria(), limit=limit, cursor=_request_option("cursor")
+        )
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"status": "error", "message": f"Erro ao listar documentos: {str(e)}"}), 500
+    return jsonify({"status": "success", "dataset_id": entry.id, "documentos": documents,
+                    "proximo_cursor": next_cursor})
+
+@fiscal_bp.route("/documents/export", methods=["GET"])
+def export_documents_stream():
+    """
+    Exporta os documentos classificados em `formato` ndjson (padrão), csv ou
+    parquet, com os mesmos filtros da listagem. A resposta é gerada à medida
+    que o cursor da base avança: a memória não cresce com o número de
+    documentos e os primeiros bytes saem de imediato.
+    """
+    entry = _get_entry()
+    if entry is None:
+        return _dataset_not_found() or (jsonify({"status": "error", "message": "Nenhum arquivo foi carregado. Faça o upload primeiro."}), 400)
+
+    from export import EXPORT_FORMATS, export_documents
+
+    fmt = (_request_option("formato") or "ndjson").lower()
+    try:
+        chunks = export_documents(entry.classification_agent.organizer, _document_criteria(), fmt)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f'attachment; filename="documentos_{entry.id}.{extension}"'
+    return response
+
+def _answer(entry, question, match):
+    count("fiscal_intencoes_total", intencao=match.intent.name if match else "nenhuma")
+    if match is not None and match.intent.target == TARGET_CLASSIFICATION:
+        return entry.classification_agent.query_documents(question, match)
+    return entry.query_agent.process_query(question, match)
+
+@fiscal_bp.route("/query/events", methods=["POST"])
+def query_events():
+    """
+    Mesma consulta de /query como Server-Sent Events: 'inicio' sai de
+    imediato com a intenção e o agente escolhidos, comentários de
+    keep-alive mantêm a conexão enquanto a resposta é calculada,
+    'resposta' traz a resposta completa e 'fim' encerra o fluxo com o
+    tempo total ('erro' em caso de falha). A resposta não é parcial: o
+    ganho é saber de imediato como a pergunta foi entendida.
+    """
+    entry = _get_entry()
+    if entry is None:
+        return _dataset_not_found() or (jsonify({"status": "error", "message": "Nenhum arquivo foi carregado para consultar. Faça o upload primeiro."}), 400)
+
+    data = request.get_json(silent=True) or {}
+    question = data.get("question", "")
+    if not question:
+        return jsonify({"status": "error", "message": "Pergunta não fornecida"}), 400
+
+    def events():
+        start = time.perf_counter()
+        match = get_intent_registry().match(question)
+        yield _sse("inicio", {
+            "dataset_id": entry.id,
+            "question": question,
+            "intencao": match.intent.name if match else None,
+            "agente": match.intent.target if match else None,
+        })
+
+        # A consulta tem o seu próprio uso do conjunto, devolvido só quando
+        # ela termina: o da requisição acaba se o cliente desconectar antes
+        leased = registry.acquire(entry.id)
+        if leased is None:
+            yield _sse("erro", {"message": f"Conjunto de dados '{entry.id}' removido."})
+            return
+        future = query_executor.submit(_answer, leased, question, match)
+        future.add_done_callback(lambda _: registry.release(leased))
+        try:
+            while True:
+                try:
+                    answer = future.result(timeout=SSE_KEEPALIVE)
+                    break
+                except FutureTimeout:
+                    yield ": keep-alive\n\n"
+                except Exception as e:
+                    yield _sse("erro", {"message": f"Erro ao processar consulta: {str(e)}"})
+                    return
+        except GeneratorExit:
+            # Cliente desconectado: a consulta ainda na fila nem começa
+            future.cancel()
+            raise
+
+        yield _sse("resposta", {"texto": answer})
+        yield _sse("fim", {"tempo_ms": round((time.perf_counter() - start) * 1000, 1)})
+
+    return _event_stream(events())
+
 @fiscal_bp.route("/examples", methods=["GET"])
 def get_example_questions():
     """
@@ -192,6 +665,8 @@ def get_example_questions():
         "Resuma os dados presentes.",
         "Quantos documentos são de venda?",
         "Quantos documentos são de compra?",
-        "Liste os setores encontrados nos documentos."
+        "Liste os setores encontrados nos documentos.",
+        "Top 5 fornecedores em SP no mês de janeiro",
+        "Quanto compramos de livros do 4º ano?"
     ]
     return jsonify({"status": "success", "examples": examples})
\ No newline at end of file
@@ -1,12 +1,32 @@
-from flask import Blueprint, jsonify, request
-from src.models.user import User, db
+from flask import Blueprint, jsonify, request, url_for
+from src.models.user import User, create_tables, db
 
 user_bp = Blueprint('user', __name__)
 
+# Tabelas criadas na primeira requisição de usuários, e não na inicialização
+user_bp.before_request(create_tables)
+
+# Tamanho de página da listagem de usuários (padrão e máximo)
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
 @user_bp.route('/users', methods=['GET'])
 def get_users():
-    users = User.query.all()
-    return jsonify([user.to_dict() for user in users])
+    # Paginação por chave: `cursor` é o id do último usuário da página
+    # anterior e a página seguinte vem no cabeçalho Link (rel="next")
+    try:
+        limit = int(request.args.get('limite', DEFAULT_PAGE_SIZE))
+        after = int(request.args.get('cursor', 0))
+    except ValueError:
+        return jsonify({'error': "Parâmetros 'limite' e 'cursor' devem ser inteiros"}), 400
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    users = User.query.filter(User.id > after).order_by(User.id).limit(limit + 1).all()
+    response = jsonify([user.to_dict() for user in users[:limit]])
+    if len(users) > limit:
+        next_url = url_for('user.get_users', limite=limit, cursor=users[limit - 1].id)
+        response.headers['Link'] = f'<{next_url}>; rel="next"'
+    return response
 
 @user_bp.route('/users', methods=['POST'])
 def create_user():
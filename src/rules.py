@@ -0,0 +1,219 @@
+# Motor de regras de classificação fiscal (CFOP e NCM)
+
+import csv
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+UNCLASSIFIED_OPERATION = "Operação não classificada"
+UNCLASSIFIED_SECTOR = "Setor não classificado"
+OTHER_COST_CENTER = "Outros"
+
+# Variável de ambiente com um arquivo de regras (JSON ou CSV) que estende as regras padrão
+RULES_PATH_ENV = "FISCAL_RULES_PATH"
+
+DEFAULT_CFOP_RULES = {
+    # Vendas
+    "5": "Venda",
+    "6": "Venda Interestadual",
+    "7": "Venda para Exterior",
+
+    # Compras
+    "1": "Compra",
+    "2": "Compra Interestadual",
+    "3": "Compra do Exterior",
+
+    # Específicos por CFOP
+    "5101": "Venda de produção do estabelecimento",
+    "5102": "Venda de mercadoria adquirida ou recebida de terceiros",
+    "5403": "Venda de mercadoria sujeita ao regime de substituição tributária",
+    "6101": "Venda de produção do estabelecimento",
+    "6102": "Venda de mercadoria adquirida ou recebida de terceiros",
+    "6403": "Venda de mercadoria sujeita ao regime de substituição tributária",
+    "1101": "Compra para industrialização",
+    "1102": "Compra para comercialização",
+    "2101": "Compra para industrialização",
+    "2102": "Compra para comercialização",
+    "2949": "Outra entrada de mercadoria ou prestação de serviço não especificada",
+}
+
+DEFAULT_SECTOR_RULES = {
+    # Baseado em NCM/SH (capítulo, posição ou subposição)
+    "49": "Editorial/Gráfico",
+    "85": "Eletrônicos/Elétricos",
+    "73": "Metalúrgico",
+    "39": "Plásticos",
+    "84": "Máquinas e Equipamentos",
+    "87": "Veículos",
+    "90": "Instrumentos de Precisão",
+}
+
+# Centro de custo pelo termo contido no tipo de operação (na ordem de prioridade)
+DEFAULT_COST_CENTER_RULES = {
+    "Venda": "Receitas",
+    "Compra": "Custos",
+}
+
+
+def normalize_code(code) -> str:
+    """
+    Converte um código (CFOP/NCM) para texto, descartando o ".0" de leituras numéricas.
+    """
+    code_str = str(code).strip()
+    if code_str.endswith(".0"):
+        code_str = code_str[:-2]
+    return code_str
+
+
+class PrefixRuleTable:
+    """
+    Tabela de regras por prefixo compilada em uma trie: cada código é
+    classificado pelo prefixo cadastrado mais longo (longest-prefix match),
+    em tempo proporcional ao tamanho do código e não ao número de regras.
+    """
+
+    _VALUE = ""  # marca de fim de prefixo na trie (nunca coincide com um caractere)
+
+    def __init__(self, rules: Dict[str, str], default: Optional[str] = None):
+        self.rules = dict(rules)
+        self.default = default
+        self._trie: Dict = {}
+        for prefix, value in self.rules.items():
+            node = self._trie
+            for char in prefix:
+                node = node.setdefault(char, {})
+            node[self._VALUE] = value
+
+    def lookup(self, code) -> Optional[str]:
+        """
+        Retorna o valor do prefixo mais longo que casa com o código.
+        """
+        node = self._trie
+        found = self.default
+        for char in normalize_code(code):
+            node = node.get(char)
+            if node is None:
+                break
+            found = node.get(self._VALUE, found)
+        return found
+
+    def lookup_column(self, codes: pd.Series) -> np.ndarray:
+        """
+        Classifica uma coluna inteira: cada código distinto é consultado uma
+        única vez e o resultado é propagado com indexação vetorizada.
+        """
+        factor_codes, uniques = pd.factorize(codes.astype(str))
+        values = np.array([self.lookup(code) for code in uniques] + [self.default], dtype=object)
+        # Códigos -1 (valores ausentes) apontam para o padrão, na última posição
+        return values[factor_codes]
+
+
+class FiscalRules:
+    """
+    Conjunto compilado das regras de CFOP, setor (NCM) e centro de custo,
+    compartilhado pelos agentes de classificação e de consultas.
+    """
+
+    def __init__(self, cfop_rules: Dict[str, str] = None, sector_rules: Dict[str, str] = None,
+                 cost_center_rules: Dict[str, str] = None):
+        self.cfop = PrefixRuleTable(DEFAULT_CFOP_RULES if cfop_rules is None else cfop_rules,
+                                    default=UNCLASSIFIED_OPERATION)
+        self.sector = PrefixRuleTable(DEFAULT_SECTOR_RULES if sector_rules is None else sector_rules,
+                                      default=UNCLASSIFIED_SECTOR)
+        self.cost_center_rules = dict(DEFAULT_COST_CENTER_RULES if cost_center_rules is None else cost_center_rules)
+        # Identifica o conteúdo das tabelas (documentos classificados com outras regras são refeitos)
+        self.fingerprint = hashlib.sha1(json.dumps(
+            [self.cfop.rules, self.sector.rules, self.cost_center_rules], sort_keys=True
+        ).encode()).hexdigest()[:16]
+        self._cost_centers: Dict[str, str] = {}
+        for operation_type in set(self.cfop.rules.values()) | {UNCLASSIFIED_OPERATION}:
+            self._cost_centers[operation_type] = self._match_cost_center(operation_type)
+
+    def _match_cost_center(self, operation_type: str) -> str:
+        for term, cost_center in self.cost_center_rules.items():
+            if term in operation_type:
+                return cost_center
+        return OTHER_COST_CENTER
+
+    def cost_center(self, operation_type: str) -> str:
+        """
+        Centro de custo de um tipo de operação (pré-calculado na compilação).
+        """
+        cost_center = self._cost_centers.get(operation_type)
+        if cost_center is None:
+            cost_center = self._match_cost_center(operation_type)
+        return cost_center
+
+    def classify_cfop(self, cfop) -> Tuple[str, str]:
+        operation_type = self.cfop.lookup(cfop)
+        return operation_type, self.cost_center(operation_type)
+
+    def classify_cfop_column(self, cfops: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Tipo de operação e centro de custo de uma coluna inteira de CFOPs.
+        """
+        operation_types = self.cfop.lookup_column(cfops)
+        factor_codes, uniques = pd.factorize(operation_types)
+        cost_centers = np.array([self.cost_center(op) for op in uniques], dtype=object)
+        return operation_types, cost_centers[factor_codes]
+
+    @classmethod
+    def from_file(cls, path: str, extend_defaults: bool = True) -> "FiscalRules":
+        """
+        Carrega regras de um arquivo externo.
+
+        JSON: {"cfop": {...}, "setores": {...}, "centros_custo": {...}}
+        CSV:  colunas tipo,codigo,descricao com tipo "cfop", "ncm" ou "centro_custo"
+        """
+        if path.lower().endswith(".json"):
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            tables = {
+                "cfop": data.get("cfop", {}),
+                "ncm": data.get("setores", {}),
+                "centro_custo": data.get("centros_custo", {}),
+            }
+        else:
+            tables = {"cfop": {}, "ncm": {}, "centro_custo": {}}
+            with open(path, encoding="utf-8", newline="") as f:
+                for row in csv.DictReader(f):
+                    tables[row["tipo"].strip().lower()][normalize_code(row["codigo"])] = row["descricao"].strip()
+
+        if extend_defaults:
+            return cls(
+                {**DEFAULT_CFOP_RULES, **tables["cfop"]},
+                {**DEFAULT_SECTOR_RULES, **tables["ncm"]},
+                {**DEFAULT_COST_CENTER_RULES, **tables["centro_custo"]},
+            )
+        return cls(tables["cfop"] or None, tables["ncm"] or None, tables["centro_custo"] or None)
+
+
+_default_rules: Optional[FiscalRules] = None
+_default_rules_lock = threading.Lock()
+
+
+def get_default_rules() -> FiscalRules:
+    """
+    Regras compiladas uma única vez por processo (padrão ou do arquivo em FISCAL_RULES_PATH).
+    """
+    global _default_rules
+    if _default_rules is None:
+        with _default_rules_lock:
+            if _default_rules is None:
+                path = os.environ.get(RULES_PATH_ENV)
+                _default_rules = FiscalRules.from_file(path) if path else FiscalRules()
+    return _default_rules
+
+
+def set_default_rules(rules: FiscalRules):
+    """
+    Substitui as regras compartilhadas (por exemplo, após carregar novas tabelas).
+    """
+    global _default_rules
+    with _default_rules_lock:
+        _default_rules = rules
@@ -0,0 +1,191 @@
+# Busca textual (FTS5) sobre produtos, emitentes, destinatários e naturezas da operação
+
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from intents import normalize_question
+from item_facts import FACTS_TABLE, ISSUERS, NATURES, PRODUCTS, RECIPIENTS, ItemFactStore
+from metrics import count, span
+
+SEARCH_TABLE = 'busca_textual'
+# Último id de cada dimensão já indexado
+SEARCH_STATE_TABLE = 'busca_textual_indexado'
+
+# Tipos de resultado: dimensão, coluna com o texto e chave estrangeira na
+# tabela fato. A posição do tipo compõe o rowid do índice
+# (rowid = id * len(KIND_NAMES) + posição).
+SEARCH_KINDS = {
+    'produto': (PRODUCTS, 'descricao', 'produto_id'),
+    'emitente': (ISSUERS, 'nome', 'emitente_id'),
+    'destinatario': (RECIPIENTS, 'nome', 'destinatario_id'),
+    'natureza': (NATURES, 'nome', 'natureza_id'),
+}
+KIND_NAMES = tuple(SEARCH_KINDS)
+KIND_POSITIONS = {kind: position for position, kind in enumerate(KIND_NAMES)}
+
+# O texto é gravado já normalizado (minúsculas, sem acentos, "4º" vira
+# "4o"), como as perguntas; o índice não guarda o texto (content=''), que
+# é lido das dimensões. Prefixos de 2 e 3 letras têm índice próprio.
+SEARCH_SCHEMA = (
+    f'''CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+        texto, content='', tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )''',
+    f"CREATE TABLE IF NOT EXISTS {SEARCH_STATE_TABLE} (tipo TEXT PRIMARY KEY, ultimo_id INTEGER NOT NULL)",
+)
+
+# Palavras ignoradas nos termos de busca
+STOPWORDS = {
+    "a", "as", "o", "os", "de", "da", "das", "do", "dos", "e", "em", "no", "na", "nos", "nas",
+    "com", "para", "por", "um", "uma", "que",
+}
+
+MAX_RESULTS = 100
+
+
+def search_terms(text: str) -> List[str]:
+    """
+    Palavras normalizadas do texto de busca, sem as palavras vazias.
+    """
+    return [word for word in re.findall(r"\w+", normalize_question(text)) if word not in STOPWORDS]
+
+
+def match_expression(terms: Iterable[str]) -> str:
+    """
+    Consulta FTS5 em que todas as palavras são exigidas como prefixo. O "s"
+    final sai das palavras longas para que o plural encontre o singular.
+    """
+    return " ".join(f'"{term[:-1] if len(term) > 3 and term.endswith("s") else term}"*' for term in terms)
+
+
+class SearchIndex:
+    """
+    Índice de texto das dimensões dos itens. Cada descrição ou nome distinto
+    é indexado uma única vez; os resultados trazem a relevância (bm25) e,
+    se pedidos, os totais dos itens na tabela fato.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    @staticmethod
+    def init_schema(conn):
+        for statement in SEARCH_SCHEMA:
+            conn.execute(statement)
+        SearchIndex.update(conn)
+
+    @staticmethod
+    def update(conn) -> int:
+        """
+        Indexa as linhas das dimensões inseridas desde a última atualização
+        (os ids das dimensões só crescem e os textos não mudam).
+        """
+        indexed = dict(conn.execute(f"SELECT tipo, ultimo_id FROM {SEARCH_STATE_TABLE}"))
+        added = 0
+        for kind, (dimension, column, _) in SEARCH_KINDS.items():
+            position, last = KIND_POSITIONS[kind], indexed.get(kind, 0)
+            rows = conn.execute(
+                f"SELECT id, {column} FROM {dimension.table} WHERE id > ? AND {column} IS NOT NULL ORDER BY id",
+                (last,)
+            ).fetchall()
+            if not rows:
+                continue
+            conn.executemany(
+                f"INSERT INTO {SEARCH_TABLE} (rowid, texto) VALUES (?, ?)",
+                ((row_id * len(KIND_NAMES) + position, normalize_question(text)) for row_id, text in rows)
+            )
+            conn.execute(f"INSERT OR REPLACE INTO {SEARCH_STATE_TABLE} (tipo, ultimo_id) VALUES (?, ?)",
+                         (kind, rows[-1][0]))
+            added += len(rows)
+        if added:
+            count("fiscal_busca_indexados_total", added)
+        return added
+
+    def refresh(self) -> int:
+        with self.pool.transaction() as conn:
+            return self.update(conn)
+
+    @staticmethod
+    def _kinds(kinds: Optional[Iterable[str]]) -> List[str]:
+        kinds = list(kinds) if kinds else list(SEARCH_KINDS)
+        unknown = [kind for kind in kinds if kind not in SEARCH_KINDS]
+        if unknown:
+            raise ValueError(f"Tipo de busca não suportado: {', '.join(unknown)}")
+        return kinds
+
+    @staticmethod
+    def _matching_ids(kind: str) -> str:
+        """
+        Subconsulta com os ids de um tipo que casam com a expressão (parâmetro ?).
+        """
+        return (f"SELECT rowid / {len(KIND_NAMES)} FROM {SEARCH_TABLE} "
+                f"WHERE {SEARCH_TABLE} MATCH ? AND rowid % {len(KIND_NAMES)} = {KIND_POSITIONS[kind]}")
+
+    def search(self, text: str, kinds: Iterable[str] = None, limit: int = 20,
+               with_totals: bool = False, criteria: Dict = None) -> List[Dict]:
+        """
+        Descrições e nomes que contêm todas as palavras do texto (como
+        prefixo, sem diferenciar acentos), do mais ao menos relevante. Com
+        `with_totals`, cada resultado traz notas, itens, quantidade e valor
+        dos itens que atendem aos critérios (lidos da tabela fato, o que
+        custa mais que a busca em si para textos muito frequentes).
+        """
+        kinds = self._kinds(kinds)
+        terms = search_terms(text)
+        if not terms:
+            return []
+        limit = max(1, min(int(limit), MAX_RESULTS))
+        positions = ', '.join(str(KIND_POSITIONS[kind]) for kind in kinds)
+
+        with span("busca_textual"), self.pool.connection() as conn:
+            hits = conn.execute(
+                f"SELECT rowid, bm25({SEARCH_TABLE}) FROM {SEARCH_TABLE} "
+                f"WHERE {SEARCH_TABLE} MATCH ? AND rowid % {len(KIND_NAMES)} IN ({positions}) "
+                "ORDER BY rank LIMIT ?",
+                (match_expression(terms), limit)
+            ).fetchall()
+
+            by_kind: Dict[str, List[int]] = {}
+            for row_id, _ in hits:
+                by_kind.setdefault(KIND_NAMES[row_id % len(KIND_NAMES)], []).append(row_id // len(KIND_NAMES))
+            texts: Dict[Tuple[str, int], str] = {}
+            totals: Dict[Tuple[str, int], Tuple] = {}
+            where, params = ItemFactStore._where(criteria or {})
+            for kind, ids in by_kind.items():
+                dimension, column, fact_column = SEARCH_KINDS[kind]
+                marks = ', '.join('?' for _ in ids)
+                for row_id, value in conn.execute(
+                        f"SELECT id, {column} FROM {dimension.table} WHERE id IN ({marks})", ids):
+                    texts[kind, row_id] = value
+                if not with_totals:
+                    continue
+                for row in conn.execute(
+                        f"SELECT {fact_column}, COUNT(DISTINCT nota_id), COUNT(*), COALESCE(SUM(quantidade), 0), "
+                        f"COALESCE(SUM(valor_total), 0) FROM {FACTS_TABLE}{where} AND {fact_column} IN ({marks}) "
+                        f"GROUP BY {fact_column}",
+                        params + ids):
+                    totals[kind, row[0]] = row[1:]
+
+        results = []
+        for row_id, score in hits:
+            key = (KIND_NAMES[row_id % len(KIND_NAMES)], row_id // len(KIND_NAMES))
+            result = {'tipo': key[0], 'id': key[1], 'texto': texts.get(key), 'relevancia': round(-score, 4)}
+            if with_totals:
+                documents, items, quantity, value = totals.get(key, (0, 0, 0.0, 0.0))
+                result.update(documentos=documents, itens=items, quantidade=quantity, valor_total=value)
+            results.append(result)
+        return results
+
+    def totals(self, terms: List[str], kind: str, criteria: Dict = None) -> Dict:
+        """
+        Notas, itens, quantidade e valor de todos os itens cujo texto do tipo
+        `kind` contém os termos, sem limite de resultados.
+        """
+        _, _, fact_column = SEARCH_KINDS[self._kinds([kind])[0]]
+        where, params = ItemFactStore._where(criteria or {})
+        with span("busca_textual"), self.pool.connection() as conn:
+            documents, items, quantity, value = conn.execute(
+                f"SELECT COUNT(DISTINCT nota_id), COUNT(*), COALESCE(SUM(quantidade), 0), "
+                f"COALESCE(SUM(valor_total), 0) FROM {FACTS_TABLE}{where} AND {fact_column} IN ({self._matching_ids(kind)})",
+                params + [match_expression(terms)]
+            ).fetchone()
+        return {'documentos': documents, 'itens': items, 'quantidade': quantity, 'valor_total': value}
@@ -0,0 +1,208 @@
+# Esboços probabilísticos: contagem de distintos (HyperLogLog) e maiores itens (top-k)
+
+import base64
+import math
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Modo de análise aproximada e erros aceitos, configuráveis por variável de ambiente
+APPROXIMATE_ENV = "FISCAL_APROXIMADO"
+DISTINCT_ERROR_ENV = "FISCAL_APROXIMADO_ERRO_DISTINTOS"
+TOPK_ERROR_ENV = "FISCAL_APROXIMADO_ERRO_TOPK"
+# Erro padrão relativo das contagens de distintos
+DEFAULT_DISTINCT_ERROR = 0.02
+# Erro máximo dos rankings, como fração do peso total (valor ou quantidade)
+DEFAULT_TOPK_ERROR = 0.005
+
+# Nível de confiança dos intervalos das contagens (z da normal)
+CONFIDENCE = 0.95
+CONFIDENCE_Z = 1.96
+
+MIN_PRECISION, MAX_PRECISION = 4, 18
+
+
+def approximate_mode() -> bool:
+    return os.environ.get(APPROXIMATE_ENV, "0").lower() in ("1", "true", "sim")
+
+
+def configured_errors() -> Tuple[float, float]:
+    """
+    Erro das contagens de distintos e dos rankings definidos no ambiente.
+    """
+    return (float(os.environ.get(DISTINCT_ERROR_ENV, DEFAULT_DISTINCT_ERROR)),
+            float(os.environ.get(TOPK_ERROR_ENV, DEFAULT_TOPK_ERROR)))
+
+
+def hash_values(values) -> np.ndarray:
+    """
+    Hash de 64 bits dos valores, igual em qualquer processo (os esboços de
+    workers diferentes podem ser combinados).
+    """
+    return pd.util.hash_array(np.asarray(values, dtype=object))
+
+
+class HyperLogLog:
+    """
+    Contagem aproximada de valores distintos em 2^precision registradores
+    (um byte cada). O erro padrão relativo é 1,04/sqrt(2^precision) e dois
+    esboços com a mesma precisão se combinam sem perda (máximo registrador
+    a registrador): por mês, por partição ou por worker.
+    """
+
+    def __init__(self, precision: int = 12, registers: Optional[np.ndarray] = None):
+        if not MIN_PRECISION <= precision <= MAX_PRECISION:
+            raise ValueError(f"Precisão do HyperLogLog deve estar entre {MIN_PRECISION} e {MAX_PRECISION}")
+        self.precision = precision
+        self.registers = registers if registers is not None else np.zeros(1 << precision, dtype=np.uint8)
+
+    @classmethod
+    def for_error(cls, error: float) -> "HyperLogLog":
+        """
+        Esboço com o menor número de registradores cujo erro padrão não passa de `error`.
+        """
+        precision = math.ceil(math.log2((1.04 / error) ** 2))
+        return cls(min(max(precision, MIN_PRECISION), MAX_PRECISION))
+
+    @property
+    def standard_error(self) -> float:
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def add_hashes(self, hashes: np.ndarray):
+        """
+        Registra hashes de 64 bits: os primeiros `precision` bits escolhem o
+        registrador, que guarda a maior posição do primeiro bit 1 do restante.
+        """
+        if len(hashes) == 0:
+            return
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        index = (hashes >> np.uint64(64 - self.precision)).astype(np.intp)
+        rest = hashes & np.uint64((1 << (64 - self.precision)) - 1)
+        # frexp devolve o expoente do bit mais alto + 1 (0 para rest == 0)
+        _, exponent = np.frexp(rest.astype(np.float64))
+        rank = (65 - self.precision - exponent).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def add(self, values: Iterable):
+        self.add_hashes(hash_values(pd.unique(np.asarray(values, dtype=object))))
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        if other.precision != self.precision:
+            raise ValueError("Só é possível combinar esboços HyperLogLog com a mesma precisão")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def copy(self) -> "HyperLogLog":
+        return HyperLogLog(self.precision, self.registers.copy())
+
+    def count(self) -> float:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / float(np.sum(np.ldexp(1.0, -self.registers.astype(np.int64))))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        # Poucos valores: contagem linear pelos registradores vazios
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return estimate
+
+    def interval(self) -> Tuple[int, int, int]:
+        """
+        Estimativa e intervalo com o nível de confiança CONFIDENCE.
+        """
+        estimate = self.count()
+        margin = CONFIDENCE_Z * self.standard_error * estimate
+        return round(estimate), max(0, math.floor(estimate - margin)), math.ceil(estimate + margin)
+
+    def to_dict(self) -> Dict:
+        return {"precisao": self.precision, "registradores": base64.b64encode(self.registers.tobytes()).decode()}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "HyperLogLog":
+        registers = np.frombuffer(base64.b64decode(data["registradores"]), dtype=np.uint8).copy()
+        return cls(data["precisao"], registers)
+
+
+class HeavyHitters:
+    """
+    Maiores itens por peso (valor, quantidade) com no máximo `capacity`
+    contadores (Misra–Gries ponderado). Cada contador subestima o peso
+    verdadeiro em no máximo `offset`, que nunca passa de total/(capacity+1):
+    o peso de um item está em [contador, contador + offset] e o de um item
+    fora dos contadores, em [0, offset]. Esboços se combinam somando os
+    contadores e reduzindo de novo, com a mesma garantia.
+    """
+
+    def __init__(self, capacity: int = 200):
+        self.capacity = capacity
+        self.counters = pd.Series(dtype='float64')
+        self.offset = 0.0
+        self.total = 0.0
+
+    @classmethod
+    def for_error(cls, error: float) -> "HeavyHitters":
+        """
+        Esboço cujo erro máximo não passa de `error` vezes o peso total.
+        """
+        return cls(max(1, math.ceil(1 / error)))
+
+    def update(self, weights: pd.Series):
+        """
+        Acrescenta um lote já somado por item (índice: item, valor: peso).
+        """
+        weights = pd.Series(weights.to_numpy(dtype='float64'), index=weights.index.astype(str))
+        weights = weights[weights > 0]
+        if weights.empty:
+            return
+        self.total += float(weights.sum())
+        self._reduce(self.counters.add(weights, fill_value=0) if len(self.counters) else weights)
+
+    def _reduce(self, counters: pd.Series):
+        if len(counters) > self.capacity:
+            # O (capacity+1)-ésimo maior contador sai de todos; os que zeram são descartados
+            cut = float(counters.nlargest(self.capacity + 1).iloc[-1])
+            counters = counters[counters > cut] - cut
+            self.offset += cut
+        self.counters = counters
+
+    def merge(self, other: "HeavyHitters") -> "HeavyHitters":
+        self.total += other.total
+        self.offset += other.offset
+        self._reduce(self.counters.add(other.counters, fill_value=0))
+        return self
+
+    def copy(self) -> "HeavyHitters":
+        sketch = HeavyHitters(self.capacity)
+        sketch.counters, sketch.offset, sketch.total = self.counters.copy(), self.offset, self.total
+        return sketch
+
+    def top(self, n: int) -> List[Tuple[str, float, float]]:
+        """
+        Os n maiores itens como (item, peso mínimo, peso máximo).
+        """
+        return [(name, value, value + self.offset) for name, value in self.counters.nlargest(n).items()]
+
+    def guaranteed(self, n: int) -> bool:
+        """
+        Indica se os n itens de `top(n)` são com certeza os n maiores: o
+        menor deles pesa ao menos o máximo possível de qualquer outro item.
+        """
+        ranked = self.counters.nlargest(n + 1)
+        if len(ranked) < n:
+            # Menos contadores que o pedido: itens fora deles só se o deslocamento for zero
+            return self.offset == 0
+        others = float(ranked.iloc[n]) if len(ranked) > n else 0.0
+        return float(ranked.iloc[n - 1]) >= others + self.offset
+
+    def to_dict(self) -> Dict:
+        return {"capacidade": self.capacity, "contadores": [[str(k), float(v)] for k, v in self.counters.items()],
+                "deslocamento": self.offset, "total": self.total}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "HeavyHitters":
+        sketch = cls(data["capacidade"])
+        counters = data["contadores"]
+        sketch.counters = pd.Series([v for _, v in counters], index=[k for k, _ in counters], dtype='float64')
+        sketch.offset, sketch.total = data["deslocamento"], data["total"]
+        return sketch
@@ -0,0 +1,174 @@
+# Camada de armazenamento SQLite compartilhada pelos agentes
+
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from metrics import span
+
+# Pragmas aplicados a cada nova conexão. O modo WAL permite que leituras
+# aconteçam enquanto uma classificação está gravando no banco.
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "temp_store": "MEMORY",
+    "cache_size": -64000,      # ~64 MB de cache de páginas
+    "mmap_size": 268435456,    # 256 MB mapeados em memória
+    "busy_timeout": 30000,     # espera até 30s por um lock antes de falhar
+}
+
+
+class SQLiteConnectionPool:
+    """
+    Pool de conexões SQLite reutilizáveis para um único arquivo de banco.
+
+    As conexões são criadas sob demanda até `max_connections` e devolvidas
+    ao pool após o uso, mantendo o cache de prepared statements do sqlite3
+    entre as requisições.
+    """
+
+    def __init__(self, db_path: str, max_connections: int = 8,
+                 pragmas: Optional[Dict] = None, cached_statements: int = 256):
+        self.db_path = db_path
+        self.max_connections = max_connections
+        self.pragmas = dict(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+        self.cached_statements = cached_statements
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        # Serializa escritores dentro do processo; leitores não passam por aqui
+        self._write_lock = threading.RLock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.pragmas.get("busy_timeout", 30000) / 1000,
+            isolation_level=None,  # transações controladas explicitamente
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name}={value}")
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.max_connections:
+                self._created += 1
+                create = True
+            else:
+                create = False
+
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        return self._idle.get()
+
+    def _release(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Empresta uma conexão do pool para leitura.
+        """
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        Empresta uma conexão e abre uma transação de escrita (BEGIN IMMEDIATE),
+        confirmando ao final ou desfazendo em caso de erro.
+        """
+        with self._write_lock, self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                # A versão do conteúdo fica no cabeçalho do arquivo (user_version),
+                # gravada na mesma transação: todos os processos veem o mesmo valor
+                version = conn.execute("PRAGMA user_version").fetchone()[0]
+                conn.execute(f"PRAGMA user_version={version + 1}")
+                with span("sqlite_commit"):
+                    conn.commit()
+
+    @property
+    def generation(self) -> int:
+        """
+        Versão do conteúdo do banco, incrementada a cada transação de escrita confirmada.
+        """
+        with self.connection() as conn:
+            return conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def close_all(self):
+        """
+        Fecha todas as conexões ociosas do pool.
+        """
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+_pools: Dict[str, SQLiteConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path: str) -> SQLiteConnectionPool:
+    """
+    Retorna o pool compartilhado para o arquivo de banco informado.
+    """
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = SQLiteConnectionPool(key)
+            _pools[key] = pool
+        return pool
+
+
+def close_pool(db_path: str):
+    """
+    Fecha e descarta o pool de um arquivo de banco (por exemplo, ao removê-lo).
+    """
+    with _pools_lock:
+        pool = _pools.pop(os.path.abspath(db_path), None)
+    if pool is not None:
+        pool.close_all()
+
+
+def close_all_pools():
+    """
+    Fecha as conexões de todos os pools. Conexões SQLite não podem atravessar
+    um fork: o processo mestre as fecha antes de criar os workers.
+    """
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close_all()
@@ -0,0 +1,26 @@
+# Ponto de entrada de produção: gunicorn -c gunicorn.conf.py src.wsgi:app
+
+import gc
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from src.main import create_app, preload_enabled
+from storage import close_all_pools
+
+# Com preload_app (gunicorn.conf.py) este módulo é importado uma única vez no
+# processo mestre: os módulos pesados e os conjuntos já enviados são carregados
+# aqui e os workers criados pelo fork compartilham essas páginas de memória
+# (copy-on-write). Com FISCAL_PRELOAD=0 a inicialização é rápida: os módulos
+# são importados no primeiro uso e o último conjunto é restaurado em segundo plano.
+preload = preload_enabled()
+app = create_app(preload_datasets=preload, restore_latest=not preload)
+
+# Conexões SQLite não podem ser herdadas pelo fork: cada worker abre as suas
+close_all_pools()
+
+# Move os objetos já criados para uma geração que o coletor não percorre: sem
+# isso, a primeira coleta em cada worker escreveria nos cabeçalhos de todos os
+# objetos pré-carregados e desfaria o compartilhamento das páginas
+gc.freeze()
@@ -0,0 +1,49 @@
+"""
+Aplicação de teste com as rotas fiscais sobre um registro em diretório temporário.
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+from flask import Flask
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+
+from ingestion import extract_members, find_fiscal_members
+from registry import DatasetRegistry
+from routes import fiscal_agents
+from storage import close_pool
+
+# Retratos das métricas fora de src/data (a importação das rotas os aponta para lá)
+fiscal_agents.metrics.configure(tempfile.mkdtemp(prefix="metricas_"))
+
+SAMPLE_ARCHIVE = os.path.join(ROOT_DIR, "202401_NFs.zip")
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    registry = DatasetRegistry(str(tmp_path / "uploads"), str(tmp_path / "dados"))
+    monkeypatch.setattr(fiscal_agents, "registry", registry)
+    yield registry
+    for entry in list(registry._entries.values()):
+        close_pool(entry.db_path)
+
+
+@pytest.fixture
+def dataset(registry):
+    """
+    Conjunto de exemplo (202401_NFs.zip) carregado e publicado no registro.
+    """
+    entry = registry.create()
+    members = find_fiscal_members(SAMPLE_ARCHIVE)
+    return registry.load_files(entry, *extract_members(SAMPLE_ARCHIVE, members, entry.data_dir))
+
+
+@pytest.fixture
+def client(dataset):
+    app = Flask(__name__)
+    app.register_blueprint(fiscal_agents.fiscal_bp, url_prefix="/api")
+    return app.test_client()
@@ -0,0 +1,64 @@
+"""
+O cache de respostas reconhece a mesma pergunta escrita de outro jeito,
+descarta as mais antigas (LRU) e as vencidas (TTL) e nunca serve respostas
+de outra versão dos dados.
+"""
+
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+
+import answer_cache
+from answer_cache import AnswerCache
+
+
+def test_normalized_questions_share_an_entry():
+    cache = AnswerCache()
+    cache.put(cache.key("consulta", "v1", "Qual o valor total?"), "R$ 10")
+    assert cache.get(cache.key("consulta", "v1", "  qual O VALOR   total ")) == "R$ 10"
+    assert cache.get(cache.key("consulta", "v2", "Qual o valor total?")) is None
+    assert cache.get(cache.key("classificacao", "v1", "Qual o valor total?")) is None
+    stats = cache.stats()
+    assert (stats["acertos"], stats["falhas"]) == (1, 2)
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = AnswerCache(max_entries=2)
+    first, second, third = (cache.key("consulta", "v1", q) for q in ("a", "b", "c"))
+    cache.put(first, "1")
+    cache.put(second, "2")
+    assert cache.get(first) == "1"  # "b" passa a ser a menos usada
+    cache.put(third, "3")
+    assert cache.get(second) is None
+    assert cache.get(first) == "1" and cache.get(third) == "3"
+    assert cache.stats()["descartes_lru"] == 1
+
+
+def test_expired_entries_are_not_served(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(answer_cache.time, "monotonic", lambda: now[0])
+    cache = AnswerCache(ttl=10)
+    key = cache.key("consulta", "v1", "pergunta")
+    cache.put(key, "resposta")
+    now[0] = 109.0
+    assert cache.get(key) == "resposta"
+    now[0] = 111.0
+    assert cache.get(key) is None
+    assert cache.stats()["expiradas"] == 1 and cache.stats()["entradas"] == 0
+
+
+def test_invalidate_by_version_and_scope():
+    cache = AnswerCache()
+    keys = [cache.key(scope, version, "pergunta")
+            for scope in ("consulta", "classificacao") for version in ("v1", "v2")]
+    for key in keys:
+        cache.put(key, "resposta")
+
+    cache.invalidate(version="v1", scope="consulta")
+    assert [cache.get(key) is not None for key in keys] == [False, True, True, True]
+    cache.invalidate(version="v2")
+    assert [cache.get(key) is not None for key in keys] == [False, False, True, False]
+    cache.invalidate()
+    assert cache.stats()["entradas"] == 0
@@ -0,0 +1,71 @@
+"""
+Cancelar a classificação depois de gravados os documentos não deixa a
+tabela fato e o índice de busca desatualizados em relação a eles.
+"""
+
+import os
+import sqlite3
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+
+from fiscal_agent import PROGRESS_STORED, CFOPClassifier, DocumentOrganizer, FiscalDocumentAgent
+from ingestion import StreamingIngestor, extract_members, find_fiscal_members
+from item_facts import PROGRESS_ITEMS_STORED
+from jobs import JobCancelled
+from storage import close_pool
+
+ARCHIVE = os.path.join(ROOT_DIR, "202401_NFs.zip")
+
+
+def cancel_at(stage):
+    def progress(current, amount):
+        if current == stage:
+            raise JobCancelled()
+    return progress
+
+
+def counts(db_path):
+    with sqlite3.connect(db_path) as conn:
+        documents = conn.execute("SELECT COUNT(*) FROM documentos_classificados").fetchone()[0]
+        items = conn.execute("SELECT COUNT(*) FROM fato_itens").fetchone()[0]
+    return documents, items
+
+
+@pytest.mark.parametrize("stage, stored", [(PROGRESS_STORED, False), (PROGRESS_ITEMS_STORED, True)])
+def test_cancelled_classification_stays_consistent(stage, stored, tmp_path):
+    db_path = str(tmp_path / "documentos.db")
+    agent = FiscalDocumentAgent(*extract_members(ARCHIVE, find_fiscal_members(ARCHIVE), str(tmp_path)),
+                                db_path=db_path)
+    try:
+        with pytest.raises(JobCancelled):
+            agent.process_documents(progress=cancel_at(stage))
+        documents, items = counts(db_path)
+        if stored:
+            # Cancelado depois da gravação dos documentos: itens e busca terminam antes
+            assert documents == len(agent.df_cabecalho) and items == len(agent.df_itens)
+            assert agent.organizer.search.search("ltda", limit=1)
+        else:
+            # Cancelado durante a gravação: nada muda na base
+            assert (documents, items) == (0, 0)
+    finally:
+        close_pool(db_path)
+
+
+def test_cancelled_streaming_ingestion_stays_consistent(tmp_path):
+    db_path = str(tmp_path / "streaming.db")
+    members = find_fiscal_members(ARCHIVE)
+    organizer = DocumentOrganizer(db_path)
+    try:
+        with pytest.raises(JobCancelled):
+            StreamingIngestor(CFOPClassifier(), organizer, chunk_size=50).ingest(
+                (ARCHIVE, members[0]), (ARCHIVE, members[1]), progress=cancel_at(PROGRESS_STORED)
+            )
+        documents, items = counts(db_path)
+        assert documents == 100 and items > 0
+        assert organizer.search.search("ltda", limit=1)
+    finally:
+        close_pool(db_path)
@@ -0,0 +1,38 @@
+"""
+Classificação das amostras distribuídas com o repositório, do arquivo
+compactado até a base de documentos e a tabela fato de itens.
+"""
+
+import os
+import sqlite3
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+
+from fiscal_agent import FiscalDocumentAgent
+from ingestion import extract_members, find_fiscal_members
+from storage import close_pool
+
+
+@pytest.mark.parametrize("archive", ["202401_NFs.zip", "random_data.zip"])
+def test_classifies_sample_archive(archive, tmp_path):
+    archive_path = os.path.join(ROOT_DIR, archive)
+    cabecalho_path, itens_path = extract_members(archive_path, find_fiscal_members(archive_path), str(tmp_path))
+    db_path = str(tmp_path / "documentos.db")
+
+    agent = FiscalDocumentAgent(cabecalho_path, itens_path, db_path=db_path)
+    try:
+        processed = agent.process_documents()
+    finally:
+        close_pool(db_path)
+
+    assert processed == len(agent.df_cabecalho)
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM documentos_classificados").fetchone()[0] == processed
+        items, months = conn.execute("SELECT COUNT(*), MIN(mes) FROM fato_itens").fetchone()
+    # Os itens de random_data.zip não têm data de emissão: o mês vem do cabeçalho
+    assert items == len(agent.df_itens)
+    assert months > 0
@@ -0,0 +1,17 @@
+"""
+Todas as perguntas de exemplo de /api/examples têm resposta com os dados
+de exemplo distribuídos com o projeto.
+"""
+
+EMPTY_ANSWERS = ("Nenhum", "Nada encontrado", "Consulta não reconhecida", "Não há", "Não foi possível")
+
+
+def test_every_example_question_has_an_answer(client):
+    assert client.post("/api/classify").status_code == 200
+    examples = client.get("/api/examples").get_json()["examples"]
+    assert examples
+    for question in examples:
+        response = client.post("/api/query", json={"question": question})
+        answer = response.get_json().get("answer")
+        assert response.status_code == 200, question
+        assert answer and not answer.startswith(EMPTY_ANSWERS), (question, answer)
@@ -0,0 +1,59 @@
+"""
+/api/documents/export devolve os mesmos documentos da listagem em NDJSON,
+CSV e Parquet, com os filtros da listagem.
+"""
+
+import csv
+import io
+import json
+
+import pytest
+
+from fiscal_agent import LISTED_COLUMNS
+
+
+@pytest.fixture
+def classified(client):
+    assert client.post("/api/classify").status_code == 200
+    return client
+
+
+def export(client, fmt, **filters):
+    response = client.get("/api/documents/export", query_string={"formato": fmt, **filters})
+    assert response.status_code == 200
+    assert response.is_streamed
+    return response
+
+
+def test_ndjson_and_csv_hold_the_same_documents(classified):
+    response = export(classified, "ndjson")
+    assert response.mimetype == "application/x-ndjson"
+    assert ".ndjson" in response.headers["Content-Disposition"]
+    documents = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert len(documents) == 100
+    assert all(tuple(document) == LISTED_COLUMNS for document in documents)
+
+    rows = list(csv.DictReader(io.StringIO(export(classified, "csv").get_data(as_text=True))))
+    assert [row["chave_acesso"] for row in rows] == [document["chave_acesso"] for document in documents]
+    assert [float(row["valor_total"]) for row in rows] == [document["valor_total"] for document in documents]
+
+
+def test_parquet_export(classified):
+    pq = pytest.importorskip("pyarrow.parquet")
+    table = pq.read_table(io.BytesIO(export(classified, "parquet").get_data()))
+    assert table.num_rows == 100
+    assert table.schema.names == list(LISTED_COLUMNS)
+    assert str(table.schema.field("valor_total").type) == "double"
+
+
+def test_export_applies_listing_filters(classified):
+    body = export(classified, "ndjson", tipo_operacao="Venda").get_data(as_text=True)
+    documents = [json.loads(line) for line in body.splitlines()]
+    listed = classified.get("/api/documents", query_string={"tipo_operacao": "Venda", "limite": 1000}).get_json()
+    assert documents and all(document["tipo_operacao"] == "Venda" for document in documents)
+    assert [d["chave_acesso"] for d in documents] == [d["chave_acesso"] for d in listed["documentos"]]
+
+
+def test_unknown_format_is_rejected(classified):
+    response = classified.get("/api/documents/export", query_string={"formato": "xlsx"})
+    assert response.status_code == 400
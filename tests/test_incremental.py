@@ -0,0 +1,35 @@
+"""
+A classificação incremental só reclassifica notas novas ou alteradas,
+inclusive depois de uma classificação em paralelo.
+"""
+
+import os
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+
+from fiscal_agent import FiscalDocumentAgent
+from ingestion import extract_members, find_fiscal_members
+from storage import close_pool
+
+ARCHIVE = os.path.join(ROOT_DIR, "202401_NFs.zip")
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_incremental_after_full_classification(workers, tmp_path):
+    db_path = str(tmp_path / "documentos.db")
+    paths = extract_members(ARCHIVE, find_fiscal_members(ARCHIVE), str(tmp_path))
+    agent = FiscalDocumentAgent(*paths, db_path=db_path)
+    try:
+        total = agent.process_documents(workers=workers)
+        assert total > 0
+        assert agent.process_documents(incremental=True) == 0
+
+        # Uma nota alterada é a única reclassificada
+        agent.df_itens.loc[agent.df_itens.index[0], 'VALOR TOTAL'] += 1
+        assert agent.process_documents(incremental=True) == 1
+    finally:
+        close_pool(db_path)
@@ -0,0 +1,128 @@
+"""
+A fila de tarefas publica o progresso, atende cancelamentos (também de
+outro processo, pelo diretório de estado) e /api/classify?stream=1 envia o
+andamento como Server-Sent Events até o estado final.
+"""
+
+import json
+import threading
+
+from fiscal_agent import FiscalDocumentAgent
+from jobs import CANCELLED, DONE, FAILED, JobManager
+
+
+def wait(job, timeout=10):
+    revision = -1
+    while not job.finished:
+        revision = job.wait_for_change(revision, timeout)
+    return job
+
+
+def test_job_reports_progress_and_result():
+    manager = JobManager(max_workers=1)
+
+    def work(job):
+        for _ in range(3):
+            job.report("linhas_lidas", 10)
+        return "ok"
+
+    job = wait(manager.submit("teste", work))
+    assert job.status == DONE and job.result == "ok"
+    assert job.to_dict()["progresso"] == {"linhas_lidas": 30}
+    assert manager.get(job.id) is job and job in manager.list()
+
+
+def test_cancel_stops_running_and_pending_jobs():
+    manager = JobManager(max_workers=1)
+    started, proceed = threading.Event(), threading.Event()
+
+    def work(job):
+        started.set()
+        proceed.wait(10)
+        job.report("linhas_lidas", 1)
+        return "não deveria terminar"
+
+    calls = []
+    running = manager.submit("teste", work)
+    pending = manager.submit("teste", calls.append)
+    assert started.wait(10)
+    manager.cancel(pending.id)
+    manager.cancel(running.id)
+    proceed.set()
+
+    assert wait(running).status == CANCELLED and running.result is None
+    assert wait(pending).status == CANCELLED and calls == []
+
+
+def test_failures_are_reported():
+    def work(job):
+        raise RuntimeError("arquivo inválido")
+
+    job = wait(JobManager().submit("teste", work))
+    assert job.status == FAILED and job.error == "arquivo inválido"
+
+
+def test_jobs_are_shared_through_the_state_dir(tmp_path):
+    owner = JobManager(max_workers=1, state_dir=str(tmp_path), persist_interval=0)
+    other = JobManager(state_dir=str(tmp_path))
+    started = threading.Event()
+
+    def work(job):
+        started.set()
+        while True:
+            job.report("linhas_lidas", 1)
+            threading.Event().wait(0.01)
+
+    job = owner.submit("teste", work)
+    assert started.wait(10)
+    stored = other.get(job.id)
+    assert stored is not None and stored is not job
+    other.cancel(job.id)
+    assert wait(job).status == CANCELLED
+    stored.poll_interval = 0.01
+    assert wait(stored).status == CANCELLED
+    assert other.get("0" * 32) is None and other.get("../x") is None
+
+
+def parse_events(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n") if not line.startswith(":"))
+        if "event" in lines:
+            events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_classify_stream_sends_progress_until_done(client, dataset):
+    response = client.post("/api/classify?stream=1")
+    assert response.mimetype == "text/event-stream"
+    events = parse_events(response.get_data(as_text=True))
+    names = [name for name, _ in events]
+    assert names[-1] == DONE and set(names[:-1]) <= {"progresso"}
+    final = events[-1][1]
+    assert final["resultado"]["documentos_processados"] == 100
+    assert final["progresso"]["documentos_gravados"] == 100
+
+    job_id = final["job_id"]
+    assert client.get(f"/api/jobs/{job_id}").get_json()["job"]["estado"] == DONE
+    replay = parse_events(client.get(f"/api/jobs/{job_id}/events").get_data(as_text=True))
+    assert [name for name, _ in replay] == [DONE]
+    assert client.post("/api/jobs/ffff/cancel").status_code == 404
+    assert dataset.leases == 0
+
+
+def test_cancel_route_ends_the_stream(client, monkeypatch):
+    def endless(self, progress=None, **kwargs):
+        while True:
+            progress("linhas_lidas", 1)
+            threading.Event().wait(0.01)
+
+    monkeypatch.setattr(FiscalDocumentAgent, "process_documents", endless)
+    response = client.post("/api/classify?stream=1", buffered=False)
+    chunks = iter(response.response)
+    name, first = parse_events(next(chunk for chunk in chunks if chunk.startswith(b"event:")).decode())[0]
+    assert name == "progresso"
+    assert client.post(f"/api/jobs/{first['job_id']}/cancel").status_code == 200
+
+    events = parse_events(b"".join(chunks).decode())
+    assert events[-1][0] == CANCELLED
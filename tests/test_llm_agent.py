@@ -0,0 +1,62 @@
+"""
+O código gerado pelo modelo só roda se usar os DataFrames e uma lista
+fechada de funções: módulos alcançados a partir de `pd` são recusados.
+"""
+
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+
+from llm_agent import LLMQueryEngine, LocalFiscalLLM, pandas_tool, validate_code
+
+DF_CABECALHO = pd.DataFrame({
+    "CHAVE DE ACESSO": ["1", "2", "3"],
+    "UF EMITENTE": ["SP", "RJ", "SP"],
+    "VALOR NOTA FISCAL": [10.0, 30.0, 20.0],
+})
+DF_ITENS = pd.DataFrame({
+    "CHAVE DE ACESSO": ["1", "2", "2", "3"],
+    "DESCRIÇÃO DO PRODUTO/SERVIÇO": ["A", "B", "C", "D"],
+    "VALOR UNITÁRIO": [1.0, 4.0, 2.0, 3.0],
+})
+
+
+@pytest.mark.parametrize("code", [
+    'pd.io.common.os.listdir("/")',
+    "pd.io.common.os.environ",
+    'pd.io.common.os.remove("/tmp/x")',
+    'pd.io.common.os.execv("/bin/sh", ["sh"])',
+    "pd.read_csv('/etc/passwd')",
+    "df_itens.to_csv('/tmp/x')",
+    "df_itens.pipe(len)",
+    "df_itens.__class__",
+    "pd.to_datetime.__globals__",
+    "__import__('os')",
+])
+def test_rejects_code_outside_the_allowlist(code):
+    with pytest.raises(ValueError):
+        validate_code(code)
+    with pytest.raises(ValueError):
+        pandas_tool(DF_CABECALHO, DF_ITENS).invoke(code)
+
+
+@pytest.mark.parametrize("code, expected", [
+    ("len(df_cabecalho)", 3),
+    ("df_cabecalho.groupby('UF EMITENTE', observed=True)['VALOR NOTA FISCAL'].sum()['SP']", 30.0),
+    ("df_itens.nlargest(1, 'VALOR UNITÁRIO')['DESCRIÇÃO DO PRODUTO/SERVIÇO'].to_list()", ["B"]),
+    ("pd.to_numeric(df_cabecalho['CHAVE DE ACESSO']).max()", 3),
+])
+def test_runs_allowed_expressions(code, expected):
+    assert pandas_tool(DF_CABECALHO, DF_ITENS).invoke(code) == expected
+
+
+def test_local_model_code_passes_validation():
+    engine = LLMQueryEngine(LocalFiscalLLM(), batch_window=0)
+    answer = engine.answer("Qual o total por UF?", "teste", DF_CABECALHO, DF_ITENS)
+    assert answer is not None and "SP: 30.00" in answer
+    assert engine.answer("Quais os 2 produtos mais caros?", "teste", DF_CABECALHO, DF_ITENS) is not None
@@ -0,0 +1,27 @@
+"""
+`from src.main import app`, o ponto de entrada original, continua valendo
+sem que a importação de src.main crie a aplicação.
+"""
+
+import os
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPT = """
+import src.main
+assert "app" not in vars(src.main)
+from src.main import app
+from src.main import app as again
+assert app is again
+print(app.url_map.bind("localhost").match("/api/examples")[0])
+"""
+
+
+def test_main_module_exposes_app():
+    # Processo separado: a aplicação registra as rotas e métricas globais do processo
+    result = subprocess.run([sys.executable, "-c", SCRIPT], cwd=ROOT_DIR, capture_output=True, text=True,
+                            env={**os.environ, "FISCAL_PRELOAD": "0"}, timeout=120)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().endswith("fiscal.get_example_questions")
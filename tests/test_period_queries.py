@@ -0,0 +1,50 @@
+"""
+Contagens de documentos de venda/compra por período quando os itens não
+têm data de emissão (random_data.zip): o mês vem do cabeçalho.
+"""
+
+import os
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+
+from csv_query_agent import CSVQueryAgent
+from fiscal_agent import CFOPClassifier, DocumentOrganizer
+from ingestion import StreamingIngestor, extract_members, find_fiscal_members
+from storage import close_pool
+
+ARCHIVE = os.path.join(ROOT_DIR, "random_data.zip")
+
+# Todas as notas de random_data.zip são de janeiro de 2024 e têm itens de venda
+EXPECTED = {
+    "Quantos documentos são de venda no 1º trimestre de 2024?": "10 documentos de venda",
+    "Quantos documentos são de compra em janeiro?": "0 documentos de compra",
+    "Quantos documentos são de venda em fevereiro de 2024?": "0 documentos de venda",
+}
+
+
+@pytest.fixture
+def members():
+    return find_fiscal_members(ARCHIVE)
+
+
+def test_period_counts_in_memory(members, tmp_path):
+    cabecalho_path, itens_path = extract_members(ARCHIVE, members, str(tmp_path))
+    agent = CSVQueryAgent(cabecalho_path, itens_path)
+    for question, expected in EXPECTED.items():
+        assert expected in agent.query_data(question)
+
+
+def test_period_counts_streaming(members, tmp_path):
+    db_path = str(tmp_path / "documentos.db")
+    ingestor = StreamingIngestor(CFOPClassifier(), DocumentOrganizer(db_path))
+    try:
+        aggregates = ingestor.ingest((ARCHIVE, members[0]), (ARCHIVE, members[1]))
+    finally:
+        close_pool(db_path)
+    agent = CSVQueryAgent(*members, aggregates=aggregates)
+    for question, expected in EXPECTED.items():
+        assert expected in agent.query_data(question)
@@ -0,0 +1,56 @@
+"""
+/api/query/events envia a intenção de imediato e a resposta completa ao
+fim, e o conjunto fica em uso até a consulta terminar, mesmo que o cliente
+desconecte antes.
+"""
+
+import json
+import threading
+
+from routes import fiscal_agents
+
+
+def parse_events(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n") if not line.startswith(":"))
+        if "event" in lines:
+            events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_query_events_sends_intent_then_answer(client, dataset):
+    response = client.post("/api/query/events", json={"question": "Qual o valor total das notas fiscais?"})
+    events = parse_events(response.get_data(as_text=True))
+
+    assert [name for name, _ in events] == ["inicio", "resposta", "fim"]
+    assert events[0][1]["intencao"] == "valor_total"
+    assert "R$ 3,371,754.84" in events[1][1]["texto"]
+    assert dataset.leases == 0
+
+
+def test_query_keeps_dataset_in_use_after_disconnect(client, dataset, monkeypatch):
+    started, proceed = threading.Event(), threading.Event()
+
+    def slow_answer(entry, question, match):
+        started.set()
+        proceed.wait(10)
+        return "resposta"
+
+    monkeypatch.setattr(fiscal_agents, "_answer", slow_answer)
+    monkeypatch.setattr(fiscal_agents, "SSE_KEEPALIVE", 0.05)
+    response = client.post("/api/query/events", json={"question": "Qual o valor total?"}, buffered=False)
+    chunks = iter(response.response)
+    assert b"event: inicio" in next(chunks)
+    assert next(chunks) == b": keep-alive\n\n"
+    assert started.wait(10)
+    response.close()
+
+    # O cliente saiu, mas a consulta ainda usa o conjunto
+    assert dataset.leases == 1
+    proceed.set()
+    for _ in range(100):
+        if dataset.leases == 0:
+            break
+        threading.Event().wait(0.05)
+    assert dataset.leases == 0
@@ -0,0 +1,121 @@
+"""
+O registro não descarrega nem remove conjuntos em uso e não bloqueia os
+demais conjuntos enquanto um deles é restaurado ou carregado.
+"""
+
+import os
+import sys
+import threading
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+
+from ingestion import extract_members, find_fiscal_members
+from registry import DatasetInUse, DatasetRegistry
+from storage import close_pool
+
+ARCHIVE = os.path.join(ROOT_DIR, "random_data.zip")
+
+
+def upload(registry):
+    entry = registry.create()
+    members = find_fiscal_members(ARCHIVE)
+    return registry.load_files(entry, *extract_members(ARCHIVE, members, entry.data_dir))
+
+
+def make_registry(tmp_path):
+    # Limite de 1 byte: só o conjunto atual caberia na memória
+    return DatasetRegistry(str(tmp_path / "uploads"), str(tmp_path / "dados"), max_memory_bytes=1)
+
+
+def test_leased_entries_are_not_evicted(tmp_path):
+    registry = make_registry(tmp_path)
+    first = upload(registry)
+    try:
+        assert registry.acquire(first.id) is first
+        second = upload(registry)
+        assert first.loaded and second.loaded
+
+        registry.release(first)
+        third = upload(registry)
+        assert not first.loaded and not second.loaded and third.loaded
+    finally:
+        for entry in registry.list():
+            close_pool(entry.db_path)
+
+
+def test_cold_load_does_not_block_other_datasets(tmp_path):
+    registry = make_registry(tmp_path)
+    slow, other = upload(registry), upload(registry)
+    try:
+        assert not slow.loaded
+        started, proceed = threading.Event(), threading.Event()
+        load = slow.load
+
+        def slow_load():
+            started.set()
+            proceed.wait(10)
+            load()
+
+        slow.load = slow_load
+        loader = threading.Thread(target=registry.get, args=(slow.id,))
+        loader.start()
+        assert started.wait(10)
+
+        result = []
+        reader = threading.Thread(target=lambda: result.append(registry.get(other.id)))
+        reader.start()
+        reader.join(5)
+        blocked = reader.is_alive()
+        proceed.set()
+        loader.join(10)
+        reader.join(10)
+        assert not blocked
+        assert result == [other] and slow.loaded
+    finally:
+        for entry in registry.list():
+            close_pool(entry.db_path)
+
+
+def test_datasets_in_use_are_not_removed(tmp_path):
+    registry = make_registry(tmp_path)
+    entry = upload(registry)
+    leased = registry.acquire(entry.id)
+    try:
+        with pytest.raises(DatasetInUse):
+            registry.remove(entry.id)
+        assert os.path.exists(entry.db_path) and registry.get(entry.id) is entry
+    finally:
+        registry.release(leased)
+
+    assert registry.remove(entry.id)
+    assert not os.path.exists(entry.data_dir) and registry.get(entry.id) is None
+
+
+def test_restore_runs_outside_the_registry_lock(tmp_path):
+    registry = make_registry(tmp_path)
+    entry = upload(registry)
+    other = DatasetRegistry(registry.upload_root, registry.data_root, max_memory_bytes=1)
+    started, proceed = threading.Event(), threading.Event()
+    restore = other._restore
+
+    def slow_restore(dataset_id):
+        started.set()
+        proceed.wait(10)
+        return restore(dataset_id)
+
+    other._restore = slow_restore
+    lister = threading.Thread(target=other.list)
+    lister.start()
+    try:
+        assert started.wait(10)
+        # A trava global está livre enquanto o manifesto é lido
+        assert other._lock.acquire(timeout=5)
+        other._lock.release()
+    finally:
+        proceed.set()
+        lister.join(10)
+    assert [found.id for found in other.list()] == [entry.id]
+    close_pool(entry.db_path)
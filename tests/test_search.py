@@ -0,0 +1,54 @@
+"""
+/api/search encontra descrições e nomes por prefixo, sem diferenciar
+acentos, do mais ao menos relevante, com os totais da tabela fato.
+"""
+
+import pytest
+
+from intents import normalize_question
+from search_index import search_terms
+
+
+@pytest.fixture
+def classified(client):
+    assert client.post("/api/classify").status_code == 200
+    return client
+
+
+def search(client, **params):
+    response = client.get("/api/search", query_string=params)
+    assert response.status_code == 200
+    return response.get_json()["resultados"]
+
+
+def test_results_match_every_term_by_relevance(classified):
+    results = search(classified, q="livr", limite=50)
+    assert results
+    assert all("livr" in normalize_question(result["texto"]) for result in results)
+    scores = [result["relevancia"] for result in results]
+    assert scores == sorted(scores, reverse=True)
+    assert search(classified, q="LÍVRO", limite=50) == search(classified, q="livro", limite=50)
+
+
+def test_kinds_restrict_the_results(classified):
+    results = search(classified, q="ltda", tipo="emitente", limite=5)
+    assert results and {result["tipo"] for result in results} == {"emitente"}
+    assert all("documentos" not in result for result in results)
+
+
+def test_totals_come_from_the_item_facts(classified, dataset):
+    results = search(classified, q="livro", tipo="produto", totais=1, limite=100)
+    items = dataset.classification_agent.df_itens
+    descriptions = items["DESCRIÇÃO DO PRODUTO/SERVIÇO"].astype(str)
+    for result in results:
+        matched = items[descriptions == result["texto"]]
+        assert result["itens"] == len(matched)
+        assert result["valor_total"] == pytest.approx(matched["VALOR TOTAL"].sum())
+
+    totals = dataset.classification_agent.organizer.search.totals(search_terms("livro"), "produto")
+    assert totals["itens"] == sum(result["itens"] for result in results)
+
+
+@pytest.mark.parametrize("params", [{"q": "  "}, {"q": "livro", "tipo": "cliente"}, {"q": "livro", "limite": "x"}])
+def test_invalid_searches_are_rejected(classified, params):
+    assert classified.get("/api/search", query_string=params).status_code == 400
@@ -0,0 +1,119 @@
+"""
+Os esboços da análise aproximada respeitam os erros prometidos e se
+combinam e serializam sem perda.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+
+from aggregates import DatasetSketches
+from sketches import HeavyHitters, HyperLogLog
+
+
+def keys(start, stop):
+    return [f"nota-{i}" for i in range(start, stop)]
+
+
+@pytest.mark.parametrize("distinct", [10, 1000, 50000])
+def test_hyperloglog_count_within_error(distinct):
+    sketch = HyperLogLog.for_error(0.02)
+    sketch.add(keys(0, distinct))
+    sketch.add(keys(0, distinct // 2))  # repetidos não contam
+    assert sketch.standard_error <= 0.02
+    # 4 erros padrão: falha com probabilidade desprezível
+    assert abs(sketch.count() - distinct) <= 4 * sketch.standard_error * distinct + 1
+    estimate, low, high = sketch.interval()
+    assert low <= estimate <= high
+
+
+def test_hyperloglog_merge_equals_union():
+    first, second, union = HyperLogLog(12), HyperLogLog(12), HyperLogLog(12)
+    first.add(keys(0, 6000))
+    second.add(keys(4000, 10000))
+    union.add(keys(0, 10000))
+    merged = first.copy().merge(second)
+    assert np.array_equal(merged.registers, union.registers)
+    assert first.count() < merged.count()
+    with pytest.raises(ValueError):
+        first.merge(HyperLogLog(10))
+    assert np.array_equal(HyperLogLog.from_dict(merged.to_dict()).registers, merged.registers)
+
+
+def weighted_stream(seed=7, size=20000, items=2000):
+    rng = np.random.default_rng(seed)
+    names = pd.Series(rng.zipf(1.3, size) % items).astype(str)
+    weights = pd.Series(rng.uniform(1, 100, size))
+    return names, weights
+
+
+def test_heavy_hitters_bounds_hold():
+    names, weights = weighted_stream()
+    sketch = HeavyHitters(50)
+    for start in range(0, len(names), 1000):
+        part = slice(start, start + 1000)
+        sketch.update(weights[part].groupby(names[part].to_numpy()).sum())
+    truth = weights.groupby(names.to_numpy()).sum()
+
+    assert len(sketch.counters) <= 50
+    assert sketch.total == pytest.approx(truth.sum())
+    assert sketch.offset <= sketch.total / 51
+    for name, low, high in sketch.top(10):
+        assert low - 1e-6 <= truth[name] <= high + 1e-6
+    missing = truth.drop(sketch.counters.index, errors="ignore")
+    assert missing.max() <= sketch.offset + 1e-6
+    if sketch.guaranteed(3):
+        assert [name for name, _, _ in sketch.top(3)] == list(truth.nlargest(3).index)
+
+
+def test_heavy_hitters_merge_and_serialization():
+    names, weights = weighted_stream(seed=3)
+    half = len(names) // 2
+    first, second = HeavyHitters(100), HeavyHitters(100)
+    first.update(weights[:half].groupby(names[:half].to_numpy()).sum())
+    second.update(weights[half:].groupby(names[half:].to_numpy()).sum())
+    merged = first.copy().merge(second)
+    truth = weights.groupby(names.to_numpy()).sum()
+
+    assert merged.total == pytest.approx(truth.sum())
+    assert merged.offset <= merged.total / 101 + 1e-6
+    for name, low, high in merged.top(5):
+        assert low - 1e-6 <= truth[name] <= high + 1e-6
+
+    restored = HeavyHitters.from_dict(merged.to_dict())
+    assert restored.top(5) == merged.top(5) and restored.offset == merged.offset
+
+
+def test_exact_heavy_hitters_are_guaranteed():
+    sketch = HeavyHitters(10)
+    sketch.update(pd.Series({"a": 5.0, "b": 3.0, "c": 1.0}))
+    assert sketch.offset == 0 and sketch.guaranteed(2)
+    assert sketch.top(2) == [("a", 5.0, 5.0), ("b", 3.0, 3.0)]
+
+
+def test_dataset_sketches_merge_by_month_and_round_trip():
+    first, second = DatasetSketches(0.02, 0.01), DatasetSketches(0.02, 0.01)
+    first.update_cabecalho(pd.DataFrame({
+        "RAZÃO SOCIAL EMITENTE": ["A", "B"], "VALOR NOTA FISCAL": [10.0, 5.0],
+        "DATA EMISSÃO": pd.to_datetime(["2024-01-05", "2024-02-07"]),
+    }))
+    second.update_cabecalho(pd.DataFrame({
+        "RAZÃO SOCIAL EMITENTE": ["B"], "VALOR NOTA FISCAL": [20.0],
+        "DATA EMISSÃO": pd.to_datetime(["2024-01-09"]),
+    }))
+    first.update_documentos(pd.Series(["1", "2", "3"]), np.array([202401, 202401, 202402]),
+                            {"documentos_venda": np.array([True, True, False])})
+
+    merged = DatasetSketches.from_dict(first.merge(second).to_dict())
+    assert sorted(merged.months) == [202401, 202402]
+    january = merged.combined("fornecedores", [202401])
+    assert january.top(2) == [("B", 20.0, 20.0), ("A", 10.0, 10.0)]
+    assert merged.combined("fornecedores").top(1)[0][:2] == ("B", 25.0)
+    assert round(merged.combined("documentos_venda").count()) == 2
+    assert merged.combined("documentos_compra") is None
@@ -0,0 +1,94 @@
+"""
+A ingestão em streaming grava a tabela fato de itens e o índice de busca
+como a classificação em memória, mesmo com as notas divididas entre blocos.
+"""
+
+import os
+import sqlite3
+import sys
+
+import pandas as pd
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+
+from fiscal_agent import CFOPClassifier, DocumentOrganizer, FiscalDocumentAgent
+from ingestion import StreamingIngestor, extract_members, find_fiscal_members
+from storage import close_pool
+
+FACTS_QUERY = """
+    SELECT n.chave_acesso, f.numero_item, f.mes, f.quantidade, f.valor_total, e.nome, p.descricao
+    FROM fato_itens f
+    JOIN dim_nota n ON n.id = f.nota_id
+    LEFT JOIN dim_emitente e ON e.id = f.emitente_id
+    LEFT JOIN dim_produto p ON p.id = f.produto_id
+    ORDER BY n.chave_acesso, f.numero_item
+"""
+
+
+def facts(db_path):
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute(FACTS_QUERY).fetchall()
+
+
+@pytest.mark.parametrize("archive", ["202401_NFs.zip", "random_data.zip"])
+@pytest.mark.parametrize("chunk_size", [50, 100000])
+def test_streaming_fills_item_facts_and_search(archive, chunk_size, tmp_path):
+    archive_path = os.path.join(ROOT_DIR, archive)
+    members = find_fiscal_members(archive_path)
+    memory_db, streaming_db = str(tmp_path / "memoria.db"), str(tmp_path / "streaming.db")
+
+    agent = FiscalDocumentAgent(*extract_members(archive_path, members, str(tmp_path)), db_path=memory_db)
+    organizer = DocumentOrganizer(streaming_db)
+    try:
+        agent.process_documents()
+        # A segunda ingestão substitui os itens da primeira
+        for _ in range(2):
+            StreamingIngestor(CFOPClassifier(), organizer, chunk_size=chunk_size).ingest(
+                (archive_path, members[0]), (archive_path, members[1])
+            )
+        assert organizer.search.search("ltda", limit=1)
+    finally:
+        close_pool(memory_db)
+        close_pool(streaming_db)
+
+    expected = facts(memory_db)
+    assert expected
+    assert facts(streaming_db) == expected
+
+
+def test_dimensions_resolve_chunk_keys_without_duplicates(tmp_path):
+    from item_facts import PRODUCTS, ItemFactStore
+
+    chunks = [
+        pd.DataFrame({"ncm": ["1", None, "2"], "descricao": ["A", "B", None]}),
+        pd.DataFrame({"ncm": [None, "3", "1", "1"], "descricao": ["B", "C", "A", None]}),
+    ]
+    with sqlite3.connect(str(tmp_path / "dim.db")) as conn:
+        ItemFactStore.init_schema(conn)
+        first = PRODUCTS.encode(conn, chunks[0], ["ncm", "descricao"], lambda sample: [("X",)] * len(sample))
+        second = PRODUCTS.encode(conn, chunks[1], ["ncm", "descricao"], lambda sample: [("Y",)] * len(sample))
+        rows = conn.execute("SELECT id, codigo_ncm, descricao, setor FROM dim_produto ORDER BY id").fetchall()
+
+    assert first.tolist() == [1, 2, 3]
+    assert second.tolist() == [2, 4, 1, 5]
+    # Chaves já gravadas têm o atributo atualizado; chaves fora do bloco ficam como estavam
+    assert rows == [(1, "1", "A", "Y"), (2, None, "B", "Y"), (3, "2", None, "X"), (4, "3", "C", "Y"),
+                    (5, "1", None, "Y")]
+
+
+def test_streaming_rankings_keep_bounded_state():
+    from aggregates import TOP_CAPACITY, IncrementalAggregates
+
+    aggregates = IncrementalAggregates("teste", top_n=3)
+    names = [f"emitente {i}" for i in range(TOP_CAPACITY * 3)]
+    for start in range(0, len(names), 500):
+        block = names[start:start + 500]
+        aggregates.update_cabecalho(pd.DataFrame({
+            "RAZÃO SOCIAL EMITENTE": block + ["grande", "medio"],
+            "VALOR NOTA FISCAL": [1.0] * len(block) + [1000.0, 500.0],
+        }))
+
+    assert len(aggregates.fornecedores.counters) <= TOP_CAPACITY
+    assert [name for name, _ in aggregates.result().top_fornecedores[:2]] == ["grande", "medio"]